@@ -5,16 +5,34 @@ Implements an agent with multiple tools:
 - Retriever: Search document database
 - Summarizer: Summarize retrieved content
 - Memory: Access conversation history
+- Document summary: Serve precomputed per-document summaries
 """
 
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import Tool
-from retriever import retrieve_with_scores
+from langchain_core.runnables import RunnableConfig
+from langchain_core.messages import AIMessage
+from retriever import (
+    retrieve_with_scores, embed_query, retrieve_by_vector, list_documents,
+    db_generation, embed_queries, retrieve_by_vectors,
+)
 from memory import ConversationMemory
-from typing import Dict, Any, Optional
+from providers import create_chat_model, is_anthropic
+from context_packer import pack_context
+from summarizer import summarize
+from doc_summaries import load_summary, format_summary
+from answer_cache import answer_cache, ANSWER_CACHE
+from llm_scheduler import llm_priority
+from single_flight import group, normalize
+from tracing import span, submit_traced, SpanCallbackHandler
+from usage import track_usage, UsageCallbackHandler
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Any, Optional
+import copy
+import math
 import os
+import time
 
 # Retrieval guardrail: if no retrieved chunk reaches this relevance score
 # (0-1, higher = better), the retriever reports "not found" instead of feeding
@@ -22,6 +40,261 @@ import os
 # (answerable questions scored 0.664-0.858, off-topic 0.597-0.683).
 RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.65"))
 
+# Speculative retrieval: query() starts retrieving the user's question in the
+# background while the first LLM turn runs. When the agent's rewritten tool
+# query embeds at least this close to the question (cosine), the prefetched
+# results are served instead of searching again.
+PREFETCH_SIMILARITY = float(os.getenv("PREFETCH_SIMILARITY", "0.95"))
+
+# Anthropic prompt caching (opt-in): mark the tool schemas, system prompt and
+# latest turn as cache breakpoints so each ReAct step re-reads the shared
+# prefix from cache instead of paying full input price for it.
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "0").lower() in ("1", "true", "yes")
+_CACHE_CONTROL = {"type": "ephemeral"}
+
+# Token budget for the retriever tool's packed context (see context_packer).
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Shared by all agents; prefetches are short I/O-bound embedding + search calls.
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-prefetch")
+_query_flights = group("agent.query")
+
+# query_batch embeds and searches its questions this many at a time
+BATCH_CHUNK = 128
+
+
+def _cosine(a, b) -> float:
+    """Cosine similarity of two embedding vectors."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _prefetch_question(question: str, top_k: int, doc_names, vector=None) -> tuple:
+    """Embed (unless already embedded) and retrieve the user's question;
+    keeps the vector for reuse."""
+    if vector is None:
+        vector = embed_query(question)
+    return vector, retrieve_by_vector(vector, top_k=top_k, doc_names=doc_names,
+                                      query=question)
+
+
+def _pop_retrieval(retrievals: list, args: dict) -> dict:
+    """
+    Take the logged retrieval matching a document_retriever tool call.
+
+    Parallel tool calls can finish out of order, so match on the query
+    string rather than position. Returns the scores as reasoning-step fields.
+    """
+    query = args.get("__arg1", args.get("query")) if isinstance(args, dict) else args
+    for i, entry in enumerate(retrievals):
+        if entry["query"] == query:
+            retrievals.pop(i)
+            break
+    else:
+        return {}
+    output = f"best relevance {entry['best_score']:.2f}"
+    if entry["fallback_score"] is not None:
+        output += (f"; original question {entry['fallback_score']:.2f}"
+                   f" (used {entry['used']})")
+    return {
+        "output": output,
+        "best_score": entry["best_score"],
+        "fallback_score": entry["fallback_score"],
+    }
+
+
+def _retrieved_docs(retrieval_log: list) -> list:
+    """
+    Flatten a run's retriever calls into the passages the agent was shown.
+
+    Only searches that passed the guardrail count, and only the packed
+    passages (merged chunks that fit the context budget). Each passage
+    appears once (first retrieval wins its query, best score kept), in
+    retrieval order: dicts with 'content', 'score', 'query' and 'metadata'.
+    """
+    docs = {}
+    for entry in retrieval_log:
+        for passage in entry.get("passages", []):
+            text, score = passage["text"], passage["score"]
+            seen = docs.get(text)
+            if seen is None:
+                docs[text] = {
+                    "content": text,
+                    "score": score,
+                    "query": entry["query"],
+                    "metadata": dict(passage["metadata"] or {}),
+                }
+            elif score > seen["score"]:
+                seen["score"] = score
+    return list(docs.values())
+
+
+# System message for the agent
+SYSTEM_PROMPT = """You are a research assistant whose ONLY source of facts is the uploaded document database.
+
+Important Instructions:
+- ALWAYS use the document_retriever tool IMMEDIATELY for ANY factual question - even if you think you already know the answer
+- NEVER answer factual questions from your own knowledge - facts must come from retrieved documents
+- If document_retriever reports no sufficiently relevant content, tell the user the uploaded documents do not contain this information - do NOT fill in the answer yourself
+- Only skip retrieval for pure conversation (greetings, thanks, chitchat)
+- DO NOT ask permission to search - just search automatically
+- Answer directly from the retrieved documents - DO NOT use the summarizer tool
+- For "summarize / what is this document about" questions, use the document_summary tool first
+- Be concise, direct, and factual"""
+
+
+class _QueryRun:
+    """
+    State of one question's agent run.
+
+    The compiled graph and its tools are shared between AgenticRAG
+    instances, so nothing per-question can live on them. query() creates a
+    run and passes it through the run config ("rag_run"); the tools read it
+    back to reach their session (the AgenticRAG) and this question's state.
+    """
+
+    def __init__(self, agent: "AgenticRAG", question: str):
+        self.agent = agent
+        self.question = question
+        self.guardrail_hits = 0
+        # Speculative retrieval of the question (see AgenticRAG.query)
+        self.prefetch = None
+        # Retriever calls and their scores, for the reasoning steps
+        self.retrieval_log = []
+
+    def prefetched(self):
+        """(vector, results) of the question's prefetch, or None."""
+        if self.prefetch is None:
+            return None
+        try:
+            return self.prefetch.result()
+        except Exception:
+            # A failed prefetch only loses the speedup; search normally.
+            return None
+
+
+def _run_from(config: RunnableConfig) -> _QueryRun:
+    return config["configurable"]["rag_run"]
+
+
+def _create_tools():
+    """Create the tools available to the agent (shared by every session)."""
+
+    # Tool 1: Document Retriever
+    def retriever_func(query: str, config: RunnableConfig) -> str:
+        """Retrieve relevant documents from the knowledge base."""
+        run = _run_from(config)
+        return run.agent._document_retriever(run, query)
+
+    retriever_tool = Tool(
+        name="document_retriever",
+        func=retriever_func,
+        description="""Search the document database for relevant information.
+        Use this when you need to find specific information from the uploaded documents.
+        Input should be a clear search query or question.
+        Returns relevant document excerpts."""
+    )
+
+    # Tool 2: Summarizer
+    def summarizer_func(text: str, config: RunnableConfig) -> str:
+        """Summarize text content."""
+        return _run_from(config).agent._summarize(text)
+
+    summarizer_tool = Tool(
+        name="summarizer",
+        func=summarizer_func,
+        description="""Summarize long text into concise points.
+        Use this when you need to condense retrieved information.
+        Input should be the text to summarize.
+        Returns a concise summary."""
+    )
+
+    # Tool 3: Memory Search
+    def memory_func(query: str, config: RunnableConfig) -> str:
+        """Search conversation history."""
+        return _run_from(config).agent.memory.search_history(query)
+
+    memory_tool = Tool(
+        name="conversation_memory",
+        func=memory_func,
+        description="""Access previous conversation history.
+        Use this when the user references something from earlier in the conversation,
+        or when context from previous Q&As would be helpful.
+        Input should be a keyword or topic to search for.
+        Returns relevant past exchanges."""
+    )
+
+    # Tool 4: Precomputed document summaries
+    def document_summary_func(query: str, config: RunnableConfig) -> str:
+        """Serve the ingest-time summary of the document(s) asked about."""
+        return _run_from(config).agent._document_summary(query)
+
+    document_summary_tool = Tool(
+        name="document_summary",
+        func=document_summary_func,
+        description="""Get the precomputed summary and section outline of a whole document.
+        Use this when the user asks what a document is about or to summarize/overview it.
+        Input should be the document name, or "all" for every document in scope.
+        Returns the document summary and a per-section outline."""
+    )
+
+    return [retriever_tool, summarizer_tool, memory_tool, document_summary_tool]
+
+
+TOOLS = _create_tools()
+
+
+def _bind_prompt(llm, prompt_caching: bool):
+    """
+    Return the (model, system prompt) create_react_agent is built from.
+
+    With prompt caching, breakpoints on the last tool schema and the system
+    prompt cache the static prefix across questions; cache_control bound on
+    the model marks the newest message, so each ReAct step reads the
+    previous steps' turns from cache. The tools are bound here, so
+    create_react_agent must accept the model as already bound (see
+    ResilientChatModel.bind_tools).
+    """
+    from langchain_core.messages import SystemMessage
+
+    if not prompt_caching:
+        return llm, SystemMessage(content=SYSTEM_PROMPT)
+    from langchain_anthropic.chat_models import convert_to_anthropic_tool
+
+    tool_schemas = [convert_to_anthropic_tool(t) for t in TOOLS]
+    tool_schemas[-1]["cache_control"] = _CACHE_CONTROL
+    model = llm.bind_tools(tool_schemas, cache_control=_CACHE_CONTROL)
+    prompt = SystemMessage(content=[{
+        "type": "text",
+        "text": SYSTEM_PROMPT,
+        "cache_control": _CACHE_CONTROL,
+    }])
+    return model, prompt
+
+
+@lru_cache(maxsize=32)
+def get_agent_graph(model_name: str, temperature: float, prompt_caching: bool):
+    """
+    Return the (llm, compiled ReAct graph) shared by every AgenticRAG with
+    these settings.
+
+    Building a chat model (and its HTTP client) and compiling the LangGraph
+    agent cost far more than a query's bookkeeping, and app.py / evaluate.py
+    create agents often. All per-session state reaches the graph through the
+    run config, so one graph safely serves many sessions and threads.
+    """
+    llm = create_chat_model(model_name, temperature)
+    model, prompt = _bind_prompt(llm, prompt_caching)
+
+    # Create the ReAct agent using LangGraph
+    agent_executor = create_react_agent(
+        model=model,
+        tools=TOOLS,
+        prompt=prompt
+    )
+    return llm, agent_executor
+
 
 class AgenticRAG:
     """
@@ -32,6 +305,9 @@ class AgenticRAG:
     - Summarize content
     - Access conversation memory
     - Reason about the best approach to answer
+
+    An instance is one session: settings, memory and document scope. The
+    LLM and compiled agent graph come from get_agent_graph and are shared.
     """
 
     def __init__(
@@ -41,7 +317,12 @@ class AgenticRAG:
         top_k: int = 5,
         verbose: bool = True,
         relevance_threshold: Optional[float] = None,
-        doc_filter: Optional[list] = None
+        doc_filter: Optional[list] = None,
+        prefetch: bool = True,
+        prompt_caching: Optional[bool] = None,
+        context_budget: Optional[int] = None,
+        answer_caching: Optional[bool] = None,
+        memory_budget: Optional[int] = None
     ):
         self.model_name = model_name
         self.temperature = temperature
@@ -51,209 +332,407 @@ class AgenticRAG:
             RELEVANCE_THRESHOLD if relevance_threshold is None
             else relevance_threshold
         )
-        self._guardrail_hits = 0
-        self._current_question = None
+        self.context_budget = (
+            CONTEXT_TOKEN_BUDGET if context_budget is None else context_budget
+        )
+        # Speculative retrieval of each question (see query())
+        self.prefetch = prefetch
         # Restrict retrieval to these document names (None = all documents)
         self.doc_filter = list(doc_filter) if doc_filter else None
 
-        # Initialize LLM based on model provider
-        if model_name.startswith("claude"):
-            self.llm = ChatAnthropic(
-                model=model_name,
-                temperature=temperature,
-                max_tokens=4096
-            )
-        elif model_name.startswith("gpt"):
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                max_tokens=2000
-            )
-        else:
-            # Default to Anthropic
-            self.llm = ChatAnthropic(
-                model=model_name,
-                temperature=temperature,
-                max_tokens=4096
-            )
-
-        # Initialize memory
-        self.memory = ConversationMemory()
+        # Prompt caching is Anthropic-only; other providers ignore the flag
+        self.prompt_caching = bool(
+            PROMPT_CACHING if prompt_caching is None else prompt_caching
+        ) and is_anthropic(model_name)
 
-        # Create tools
-        self.tools = self._create_tools()
+        # Serve near-duplicate questions from the shared semantic answer
+        # cache (see answer_cache.py)
+        self.answer_caching = bool(
+            ANSWER_CACHE if answer_caching is None else answer_caching
+        )
 
-        # Create agent
-        self.agent_executor = self._create_agent()
+        # Initialize memory (bounded by MEMORY_TOKEN_BUDGET unless given)
+        self.memory = ConversationMemory(token_budget=memory_budget)
 
-    def _create_tools(self):
-        """Create the tools available to the agent."""
+        self.tools = TOOLS
+        self._bind_graph()
 
-        # Tool 1: Document Retriever
-        def retriever_func(query: str) -> str:
-            """Retrieve relevant documents from the knowledge base."""
-            try:
-                results = retrieve_with_scores(
-                    query, top_k=self.top_k, doc_names=self.doc_filter
-                )
-                if not results:
-                    return "No relevant documents found."
-
-                # Guardrail: refuse to pass low-relevance context to the LLM.
-                # Retrieval scores vary with query phrasing, so the FIRST
-                # sub-threshold result invites one reworded retry; the counter
-                # (reset per user question in query()) enforces the limit
-                # deterministically instead of trusting the model to obey.
-                best_score = max(score for _, score in results)
-
-                # The agent rewrites queries before calling this tool, and a
-                # poor rewrite can score below threshold even when the user's
-                # original question retrieves fine. Fall back to the original
-                # phrasing before engaging the guardrail.
-                if (best_score < self.relevance_threshold
-                        and self._current_question
-                        and self._current_question.strip().lower() != query.strip().lower()):
-                    fallback = retrieve_with_scores(
-                        self._current_question, top_k=self.top_k,
-                        doc_names=self.doc_filter
-                    )
-                    if fallback:
-                        fallback_best = max(score for _, score in fallback)
-                        if fallback_best >= self.relevance_threshold:
-                            results, best_score = fallback, fallback_best
-
-                if best_score < self.relevance_threshold:
-                    self._guardrail_hits += 1
-                    if self._guardrail_hits == 1:
-                        return (
-                            f"No sufficiently relevant content found "
-                            f"(best relevance {best_score:.2f}, threshold "
-                            f"{self.relevance_threshold}). Retry document_retriever "
-                            f"ONCE with different wording (e.g. the document's "
-                            f"likely terminology)."
-                        )
-                    return (
-                        f"Still no sufficiently relevant content (best relevance "
-                        f"{best_score:.2f}). STOP retrying. Tell the user the "
-                        f"uploaded documents do not contain this information - "
-                        f"do NOT answer from your own knowledge."
-                    )
-
-                # Full chunk text — truncating here starved the LLM of facts
-                # that sit past the cutoff (chunks are ~800 chars).
-                result_parts = [f"Found {len(results)} relevant documents:\n"]
-                for i, (doc, score) in enumerate(results, 1):
-                    content = doc.page_content.replace("\n", " ")
-                    result_parts.append(
-                        f"\n[Document {i} | relevance {score:.2f}]\n{content}"
-                    )
-
-                return "\n".join(result_parts)
-            except Exception as e:
-                return f"Error retrieving documents: {str(e)}"
-
-        retriever_tool = Tool(
-            name="document_retriever",
-            func=retriever_func,
-            description="""Search the document database for relevant information.
-            Use this when you need to find specific information from the uploaded documents.
-            Input should be a clear search query or question.
-            Returns relevant document excerpts."""
+    def _bind_graph(self):
+        """Attach the shared LLM + agent graph for the current settings."""
+        self.llm, self.agent_executor = get_agent_graph(
+            self.model_name, self.temperature, self.prompt_caching
         )
 
-        # Tool 2: Summarizer
-        def summarizer_func(text: str) -> str:
-            """Summarize text content."""
-            try:
-                # Use the LLM to summarize
-                from langchain_core.messages import HumanMessage
-                summary_prompt = f"""Summarize the following text concisely in 2-3 sentences:
-
-{text[:2000]}
-
-Summary:"""
-                # Handle both invoke and predict methods
-                if hasattr(self.llm, 'invoke'):
-                    result = self.llm.invoke([HumanMessage(content=summary_prompt)])
-                    return result.content.strip()
-                else:
-                    return self.llm.predict(summary_prompt).strip()
-            except Exception as e:
-                return f"Error summarizing: {str(e)}"
-
-        summarizer_tool = Tool(
-            name="summarizer",
-            func=summarizer_func,
-            description="""Summarize long text into concise points.
-            Use this when you need to condense retrieved information.
-            Input should be the text to summarize.
-            Returns a concise summary."""
-        )
+    def _retrieve(self, run: _QueryRun, query: str):
+        """
+        Retrieve for the agent's query, serving the prefetched results of
+        the user's question when the query is (nearly) the same question.
+        """
+        if run.prefetch is None:
+            return retrieve_with_scores(
+                query, top_k=self.top_k, doc_names=self.doc_filter
+            )
 
-        # Tool 3: Memory Search
-        def memory_func(query: str) -> str:
-            """Search conversation history."""
-            return self.memory.search_history(query)
-
-        memory_tool = Tool(
-            name="conversation_memory",
-            func=memory_func,
-            description="""Access previous conversation history.
-            Use this when the user references something from earlier in the conversation,
-            or when context from previous Q&As would be helpful.
-            Input should be a keyword or topic to search for.
-            Returns relevant past exchanges."""
-        )
+        if query.strip().lower() == run.question.strip().lower():
+            prefetched = run.prefetched()
+            if prefetched is not None:
+                return prefetched[1]
+            return retrieve_with_scores(
+                query, top_k=self.top_k, doc_names=self.doc_filter
+            )
 
-        return [retriever_tool, summarizer_tool, memory_tool]
+        # Embed once: the vector decides whether the prefetch is close
+        # enough, and is reused for the search if it isn't. A prefetch
+        # still in flight is not waited on, so the two searches overlap.
+        vector = embed_query(query)
+        prefetched = run.prefetched() if run.prefetch.done() else None
+        if (prefetched is not None
+                and _cosine(vector, prefetched[0]) >= PREFETCH_SIMILARITY):
+            return prefetched[1]
+        return retrieve_by_vector(
+            vector, top_k=self.top_k, doc_names=self.doc_filter, query=query
+        )
 
-    def _create_agent(self):
-        """Create the ReAct agent with tools using LangGraph."""
+    def _document_retriever(self, run: _QueryRun, query: str) -> str:
+        """document_retriever tool: search, guardrail and format results."""
+        try:
+            # The agent rewrites queries before calling this tool, and a
+            # poor rewrite can score below threshold even when the user's
+            # original question retrieves fine, so the original phrasing
+            # is the fallback. It is in flight alongside the primary
+            # search (usually as the prefetch) rather than after it, so a
+            # low-relevance question costs one round-trip, not two.
+            rewritten = bool(
+                run.question
+                and run.question.strip().lower() != query.strip().lower()
+            )
+            if rewritten and run.prefetch is None:
+                run.prefetch = submit_traced(
+                    _PREFETCH_POOL, _prefetch_question, run.question,
+                    self.top_k, self.doc_filter
+                )
 
-        # System message for the agent
-        from langchain_core.messages import SystemMessage
+            results = self._retrieve(run, query)
+            best_score = max((score for _, score in results), default=0.0)
+            step = {"query": query, "best_score": best_score,
+                    "fallback_score": None, "used": "query"}
+            run.retrieval_log.append(step)
+
+            # Guardrail: refuse to pass low-relevance context to the LLM.
+            # Retrieval scores vary with query phrasing, so the FIRST
+            # sub-threshold result invites one reworded retry; the counter
+            # (per user question, on the run) enforces the limit
+            # deterministically instead of trusting the model to obey.
+            # Only a sub-threshold primary waits on the fallback.
+            if rewritten and (best_score < self.relevance_threshold
+                              or run.prefetch.done()):
+                prefetched = run.prefetched()
+                fallback = prefetched[1] if prefetched else []
+                if fallback:
+                    fallback_best = max(score for _, score in fallback)
+                    step["fallback_score"] = fallback_best
+                    if (best_score < self.relevance_threshold
+                            and fallback_best > best_score):
+                        results, best_score = fallback, fallback_best
+                        step["used"] = "original question"
+
+            if not results:
+                return "No relevant documents found."
+
+            if best_score < self.relevance_threshold:
+                run.guardrail_hits += 1
+                if run.guardrail_hits == 1:
+                    return (
+                        f"No sufficiently relevant content found "
+                        f"(best relevance {best_score:.2f}, threshold "
+                        f"{self.relevance_threshold}). Retry document_retriever "
+                        f"ONCE with different wording (e.g. the document's "
+                        f"likely terminology)."
+                    )
+                return (
+                    f"Still no sufficiently relevant content (best relevance "
+                    f"{best_score:.2f}). STOP retrying. Tell the user the "
+                    f"uploaded documents do not contain this information - "
+                    f"do NOT answer from your own knowledge."
+                )
 
-        system_message = """You are a research assistant whose ONLY source of facts is the uploaded document database.
+            # Full chunk text — truncating here starved the LLM of facts
+            # that sit past the cutoff (chunks are ~800 chars). Instead,
+            # same-page chunks are merged without their overlap and whole
+            # passages fill the token budget in relevance order.
+            passages, stats = pack_context(results, self.context_budget)
+            # What the agent actually saw, returned by query() so callers
+            # don't re-run retrieval to show or judge it.
+            step["passages"] = passages
+            result_parts = [
+                f"Found {len(results)} relevant documents "
+                f"({len(passages)} passages, {stats['packed_tokens']} tokens; "
+                f"{stats['overlap_tokens']} overlapping tokens merged, "
+                f"{stats['dropped_tokens']} over the budget left out):\n"
+            ]
+            for i, passage in enumerate(passages, 1):
+                content = passage["text"].replace("\n", " ")
+                page = passage["metadata"].get("page")
+                where = f" | page {page + 1}" if isinstance(page, int) else ""
+                result_parts.append(
+                    f"\n[Document {i} | relevance {passage['score']:.2f}"
+                    f"{where}]\n{content}"
+                )
 
-Important Instructions:
-- ALWAYS use the document_retriever tool IMMEDIATELY for ANY factual question - even if you think you already know the answer
-- NEVER answer factual questions from your own knowledge - facts must come from retrieved documents
-- If document_retriever reports no sufficiently relevant content, tell the user the uploaded documents do not contain this information - do NOT fill in the answer yourself
-- Only skip retrieval for pure conversation (greetings, thanks, chitchat)
-- DO NOT ask permission to search - just search automatically
-- Answer directly from the retrieved documents - DO NOT use the summarizer tool
-- Be concise, direct, and factual"""
+            return "\n".join(result_parts)
+        except Exception as e:
+            return f"Error retrieving documents: {str(e)}"
 
-        # Create the ReAct agent using LangGraph
-        agent_executor = create_react_agent(
-            model=self.llm,
-            tools=self.tools,
-            prompt=SystemMessage(content=system_message)
-        )
+    def _summarize(self, text: str) -> str:
+        """summarizer tool: map-reduce summary of text of any length."""
+        try:
+            return summarize(self.llm, text)
+        except Exception as e:
+            return f"Error summarizing: {str(e)}"
 
-        return agent_executor
+    def _document_summary(self, query: str) -> str:
+        """document_summary tool: precomputed summaries of documents in scope."""
+        try:
+            docs = list_documents()
+            if self.doc_filter:
+                docs = [d for d in docs if d["name"] in self.doc_filter]
+            wanted = query.strip().lower()
+            matched = [d for d in docs if d["name"].lower() in wanted
+                       or (wanted and wanted in d["name"].lower())]
+            docs = matched or docs
+            if not docs:
+                return "No documents are loaded."
+
+            found, missing = [], []
+            for d in docs:
+                record = load_summary(d["name"])
+                # A summary of an older ingestion of the document is stale
+                if record and record.get("ingested_at") == d["ingested_at"]:
+                    found.append(record)
+                else:
+                    missing.append(d["name"])
+            parts = [format_summary(r, outline=len(docs) == 1) for r in found]
+            if missing:
+                parts.append(
+                    "No precomputed summary yet for: " + ", ".join(missing)
+                    + ". Use document_retriever to look at their content."
+                )
+            return "\n\n".join(parts)
+        except Exception as e:
+            return f"Error loading document summaries: {str(e)}"
 
-    def query(self, question: str) -> Dict[str, Any]:
+    def query(self, question: str,
+              on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Process a question through the agentic RAG system.
 
         Args:
             question: User's question
+            on_token: Called with each text token of the agent's LLM turns
+                as it streams (server.py relays them as server-sent events)
 
         Returns:
             Dict containing answer, reasoning steps, and metadata
+            ("answer_cache" with the similarity and original question when
+            served from the semantic answer cache; "coalesced" when another
+            session's identical in-flight question supplied the answer)
         """
-        # Get conversation context
+        return self._run_question(question, on_token)
+
+    def _run_question(self, question: str, on_token, prefetched=None) -> Dict[str, Any]:
+        """query(), optionally with the question's (vector, results) already
+        retrieved by query_batch."""
+        with span("agent.query", model=self.model_name, top_k=self.top_k) as root, \
+                track_usage("query", model=self.model_name,
+                            question=question[:200]) as tracker:
+            # Identical concurrent questions share one run (single_flight.py);
+            # not follow-ups, whose meaning depends on earlier turns, nor
+            # streamed answers, whose tokens go to one caller
+            fresh = not self._conversation_context()
+            if fresh and on_token is None:
+                result, leader = _query_flights.do(
+                    self._flight_key(question), self._answer,
+                    question, tracker, fresh, None, prefetched,
+                )
+                root.set_attribute("agent.coalesced", not leader)
+                if leader:
+                    # Shared with the followers; don't mutate it
+                    result = dict(result)
+                else:
+                    result = copy.deepcopy(result)
+                    result["coalesced"] = True
+                    if "error" not in result:
+                        self.memory.add_user_message(question)
+                        self.memory.add_ai_message(result["answer"])
+            else:
+                result = self._answer(question, tracker, fresh, on_token,
+                                      prefetched)
+            # Tokens and LLM round-trips for this question, all calls included
+            result["usage"] = tracker.totals()
+            if self.prompt_caching:
+                result["cache_read_tokens"] = result["usage"]["cache_read_tokens"]
+                result["cache_creation_tokens"] = (
+                    result["usage"]["cache_creation_tokens"]
+                )
+            root.set_attribute("agent.steps", len(result["reasoning_steps"]))
+            root.set_attribute("agent.llm_calls", result["usage"]["llm_calls"])
+            return result
+
+    def query_batch(self, questions, concurrency: int = 8,
+                    priority: str = "batch") -> list:
+        """
+        Answer many independent questions, concurrency at a time.
+
+        Every question runs with this agent's settings and document scope
+        but its own empty memory, so answers never leak into each other (or
+        into this session's conversation). The questions are embedded and
+        searched in bulk up front (BATCH_CHUNK per embeddings request and
+        Chroma query); each agent run starts from those results, as with
+        query()'s prefetch. LLM calls run in the given llm_scheduler
+        priority class. The bulk embedding calls are tracked as one
+        "query_batch" usage record; each question's own "usage" covers
+        only its agent run.
+
+        Returns one query() result per question, in order, each with
+        "timing": seconds from the start of the batch until its run began
+        ("queued_s": bulk retrieval plus waiting for a free worker) and
+        spent answering ("seconds").
+        """
+        questions = list(questions)
+        started = time.perf_counter()
+        with span("agent.query_batch", questions=len(questions),
+                  concurrency=concurrency), llm_priority(priority):
+            prefetched = self._retrieve_batch(questions)
+            with ThreadPoolExecutor(max_workers=max(1, concurrency),
+                                    thread_name_prefix="rag-batch") as pool:
+                futures = [
+                    submit_traced(pool, self._batch_item, question, item, started)
+                    for question, item in zip(questions, prefetched)
+                ]
+                return [f.result() for f in futures]
+
+    def _retrieve_batch(self, questions: list) -> list:
+        """(vector, results) per question, from bulk embedding and search;
+        None entries when there is nothing to reuse or the search failed
+        (those questions retrieve on their own)."""
+        if not (self.prefetch or self.answer_caching):
+            return [None] * len(questions)
+        unique = list(dict.fromkeys(questions))
+        found = {}
+        with span("agent.retrieve_batch", questions=len(unique)), \
+                track_usage("query_batch", model=self.model_name,
+                            questions=len(unique)):
+            for i in range(0, len(unique), BATCH_CHUNK):
+                chunk = unique[i:i + BATCH_CHUNK]
+                try:
+                    vectors = embed_queries(chunk)
+                    results = (retrieve_by_vectors(vectors, self.top_k, self.doc_filter)
+                               if self.prefetch else [None] * len(chunk))
+                except Exception:
+                    continue
+                found.update(zip(chunk, zip(vectors, results)))
+        return [found.get(question) for question in questions]
+
+    def _batch_item(self, question: str, prefetched, started: float) -> Dict[str, Any]:
+        """One query_batch question, on a copy of this agent with its own
+        memory (the graph, LLM and settings are shared)."""
+        began = time.perf_counter()
+        session = copy.copy(self)
+        session.memory = ConversationMemory(token_budget=self.memory.token_budget)
+        try:
+            result = session._run_question(question, None, prefetched)
+        except Exception as e:
+            result = {"answer": f"Error processing question: {str(e)}",
+                      "reasoning_steps": [], "retrieved_docs": [], "error": str(e)}
+        result["timing"] = {"queued_s": round(began - started, 3),
+                            "seconds": round(time.perf_counter() - began, 3)}
+        return result
+
+    def _answer(self, question: str, tracker, fresh: bool, on_token,
+                prefetched=None) -> Dict[str, Any]:
+        """The answer from the semantic cache or a full agent run."""
+        vector = scope = None
+        # A follow-up's meaning depends on earlier turns: never cached
+        if self.answer_caching and fresh:
+            with span("answer_cache.lookup") as lookup:
+                vector = prefetched[0] if prefetched else embed_query(question)
+                scope = self._answer_scope()
+                hit = answer_cache.lookup(vector, scope)
+                lookup.set_attribute("answer_cache.hit", hit is not None)
+            if hit is not None:
+                return self._cached_result(question, *hit)
+
+        if prefetched and vector is None:
+            vector = prefetched[0]
+        result = self._query(question, UsageCallbackHandler(tracker),
+                             vector, on_token,
+                             prefetched[1] if prefetched else None)
+        # Only answers that went through a lookup (scope computed) are stored
+        if scope is not None and "error" not in result:
+            answer_cache.store(vector, scope, question, {
+                key: result[key] for key in
+                ("answer", "reasoning_steps", "retrieved_docs")
+            })
+        return result
+
+    def _flight_key(self, question: str) -> tuple:
+        """Questions coalesce only with the same text (normalized), scope
+        and every setting that can change the answer."""
+        return self._answer_scope() + (
+            normalize(question), self.temperature, self.top_k,
+            self.relevance_threshold, self.context_budget, self.prompt_caching,
+        )
+
+    def _conversation_context(self) -> str:
+        """Recent turns to prepend to the question ("" if none)."""
         context = self.memory.get_recent_context(num_turns=2)
+        if context and context != "No previous conversation.":
+            return context
+        return ""
+
+    def _answer_scope(self) -> tuple:
+        """Answers are only reused for the same model, document selection
+        and knowledge-base contents."""
+        docs = tuple(sorted(self.doc_filter)) if self.doc_filter else None
+        return (self.model_name, docs, db_generation())
+
+    def _cached_result(self, question: str, cached: dict, similarity: float,
+                       cached_question: str) -> Dict[str, Any]:
+        """Result dict for an answer served from the semantic cache."""
+        self.memory.add_user_message(question)
+        self.memory.add_ai_message(cached["answer"])
+        return {
+            **cached,
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "top_k": self.top_k,
+            "answer_cache": {"similarity": similarity, "question": cached_question},
+        }
+
+    def _query(self, question: str, usage_handler, vector=None,
+               on_token=None, prefetched=None) -> Dict[str, Any]:
+        # Get conversation context
+        context = self._conversation_context()
 
         # Add context to question if there is any
         question_with_context = question
-        if context and context != "No previous conversation.":
+        if context:
             question_with_context = f"Context from previous conversation:\n{context}\n\nCurrent question: {question}"
 
-        # Reset per-question guardrail state
-        self._guardrail_hits = 0
-        self._current_question = question
+        # Fresh per-question state (guardrail counter, retrieval log)
+        run = _QueryRun(self, question)
+
+        # Start retrieving the question itself while the first LLM turn
+        # decides what to search for; the retriever tool picks it up.
+        # query_batch has already searched its questions in bulk.
+        if prefetched is not None:
+            run.prefetch = Future()
+            run.prefetch.set_result((vector, prefetched))
+        elif self.prefetch:
+            run.prefetch = submit_traced(
+                _PREFETCH_POOL, _prefetch_question, question,
+                self.top_k, self.doc_filter, vector
+            )
 
         # Run the agent
         try:
@@ -262,10 +741,14 @@ Important Instructions:
             # Invoke agent with message. recursion_limit bounds the ReAct
             # loop (~5 tool-call rounds) so a model that keeps retrying
             # retrieval can't spiral into dozens of API calls.
-            result = self.agent_executor.invoke(
-                {"messages": [HumanMessage(content=question_with_context)]},
-                config={"recursion_limit": 12},
-            )
+            inputs = {"messages": [HumanMessage(content=question_with_context)]}
+            config = {"recursion_limit": 12,
+                      "configurable": {"rag_run": run},
+                      "callbacks": [SpanCallbackHandler(), usage_handler]}
+            if on_token is None:
+                result = self.agent_executor.invoke(inputs, config=config)
+            else:
+                result = self._stream_graph(inputs, config, on_token)
 
             # Extract answer from messages
             messages = result.get("messages", [])
@@ -289,14 +772,20 @@ Important Instructions:
 
             # Extract reasoning steps from messages
             reasoning_steps = []
+            retrievals = list(run.retrieval_log)
             for msg in messages:
                 if hasattr(msg, 'tool_calls') and msg.tool_calls:
                     for tool_call in msg.tool_calls:
-                        reasoning_steps.append({
+                        step = {
                             "tool": tool_call.get("name", "unknown"),
                             "input": str(tool_call.get("args", {}))[:100],
                             "output": "Tool executed"
-                        })
+                        }
+                        if step["tool"] == "document_retriever":
+                            step.update(_pop_retrieval(
+                                retrievals, tool_call.get("args", {})
+                            ))
+                        reasoning_steps.append(step)
 
             # Update memory
             self.memory.add_user_message(question)
@@ -305,6 +794,7 @@ Important Instructions:
             return {
                 "answer": answer,
                 "reasoning_steps": reasoning_steps,
+                "retrieved_docs": _retrieved_docs(run.retrieval_log),
                 "model": self.model_name,
                 "temperature": self.temperature,
                 "top_k": self.top_k
@@ -315,9 +805,28 @@ Important Instructions:
             return {
                 "answer": error_msg,
                 "reasoning_steps": [],
+                "retrieved_docs": [],
                 "error": str(e)
             }
 
+    def _stream_graph(self, inputs, config, on_token) -> Dict[str, Any]:
+        """Run the graph like invoke, passing the agent node's text tokens
+        to on_token as they arrive; returns the final state."""
+        result = {}
+        for mode, payload in self.agent_executor.stream(
+                inputs, config=config, stream_mode=["messages", "values"]):
+            if mode == "values":
+                result = payload
+                continue
+            chunk, metadata = payload
+            # Chunks when the model streams; one whole message when it
+            # doesn't (fake or resilient models)
+            if metadata.get("langgraph_node") == "agent" and isinstance(chunk, AIMessage):
+                text = str(chunk.text)
+                if text:
+                    on_token(text)
+        return result
+
     def update_settings(
         self,
         temperature: Optional[float] = None,
@@ -325,9 +834,11 @@ Important Instructions:
         relevance_threshold: Optional[float] = None,
     ):
         """Update agent settings."""
-        if temperature is not None:
+        if temperature is not None and temperature != self.temperature:
+            # The LLM is shared with other sessions; switch graphs rather
+            # than mutating it.
             self.temperature = temperature
-            self.llm.temperature = temperature
+            self._bind_graph()
 
         if top_k is not None:
             self.top_k = top_k
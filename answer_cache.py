@@ -0,0 +1,134 @@
+"""
+Semantic answer cache for near-duplicate questions (opt-in).
+
+Production traffic repeats the same question in many phrasings, and each
+one would run the full ReAct loop. AgenticRAG.query embeds the question
+(the vector is reused by the retrieval prefetch) and serves a stored answer,
+with its sources, when an earlier question in the same scope embeds at
+least ANSWER_CACHE_THRESHOLD close (cosine).
+
+The scope is (model, document selection, DB generation): answers never
+cross document selections, and ingesting or deleting a document starts a
+new generation (see retriever.db_generation), so stale answers are never
+served. Entries are evicted least-recently-used beyond ANSWER_CACHE_SIZE
+and expire after ANSWER_CACHE_TTL seconds. Questions asked with
+conversational context bypass the cache, since their meaning depends on
+earlier turns.
+
+SemanticAnswerCache.stats() (hit rate, size, evictions) is reported by
+server.py's /health.
+
+The threshold is deliberately high: questions that differ only in a model
+code ("sDrive18d" vs "sDrive20i") embed very close together.
+
+Configuration (environment):
+    ANSWER_CACHE            1 to enable (default 0)
+    ANSWER_CACHE_THRESHOLD  min cosine similarity for a hit (default 0.97)
+    ANSWER_CACHE_SIZE       max cached answers (default 1000)
+    ANSWER_CACHE_TTL        seconds an answer stays valid (default 86400)
+"""
+
+from collections import OrderedDict
+import copy
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "0").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+
+class SemanticAnswerCache:
+    """Thread-safe LRU of (question vector, answer) per scope."""
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # scope -> OrderedDict(id -> (unit vector, question, result, stored_at))
+        self._scopes = {}
+        # id -> scope, in LRU order across all scopes
+        self._lru = OrderedDict()
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _drop(self, entry_id):
+        scope = self._lru.pop(entry_id)
+        entries = self._scopes[scope]
+        del entries[entry_id]
+        if not entries:
+            del self._scopes[scope]
+
+    def lookup(self, vector, scope):
+        """
+        The best cached answer for this question vector in scope, as
+        (result, similarity, cached question), or None below the threshold.
+        """
+        query = self._unit(vector)
+        now = time.time()
+        with self._lock:
+            entries = self._scopes.get(scope, {})
+            expired = [i for i, e in entries.items() if now - e[3] > self.ttl]
+            for entry_id in expired:
+                self._drop(entry_id)
+                self.evictions += 1
+            entries = self._scopes.get(scope)
+            if not entries:
+                self.misses += 1
+                return None
+            ids = list(entries)
+            similarities = np.stack([entries[i][0] for i in ids]) @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry_id = ids[best]
+            self._lru.move_to_end(entry_id)
+            _, question, result, _ = entries[entry_id]
+        return copy.deepcopy(result), similarity, question
+
+    def store(self, vector, scope, question: str, result: dict):
+        """Cache an answer, evicting the least recently used beyond the cap."""
+        entry = (self._unit(vector), question, copy.deepcopy(result), time.time())
+        with self._lock:
+            entry_id = next(self._ids)
+            self._scopes.setdefault(scope, OrderedDict())[entry_id] = entry
+            self._lru[entry_id] = scope
+            while len(self._lru) > self.max_entries:
+                self._drop(next(iter(self._lru)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        """Hits, misses, hit_rate, size and evictions since start."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0,
+                    "size": len(self._lru), "evictions": self.evictions}
+
+
+# Shared by every AgenticRAG in the process
+answer_cache = SemanticAnswerCache()
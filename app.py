@@ -13,13 +13,16 @@ A production-ready RAG system with:
 import streamlit as st
 from dotenv import load_dotenv
 import os
+import uuid
 
 # Load environment variables
 load_dotenv()
 
 from agents import AgenticRAG, RELEVANCE_THRESHOLD
-from retriever import retrieve_with_scores, list_documents, delete_document
+from retriever import list_documents, delete_document
 from ingestion import ingest_pdf, clear_database
+from doc_summaries import INGEST_SUMMARIES
+from session_store import get_session_store
 
 
 # ---------- UI helpers ----------
@@ -73,6 +76,8 @@ def render_reasoning(steps):
         query = raw.split("'__arg1': ", 1)[-1].strip("{}' ") if "__arg1" in raw else raw
         st.markdown(f"{icon} **Step {i}: `{step['tool']}`**")
         st.caption(f"Search query: {query}")
+        if step.get("output") and step["output"] != "Tool executed":
+            st.caption(f"Result: {step['output']}")
     if not steps:
         st.caption("No tools used — the agent answered directly (e.g. chitchat).")
 
@@ -105,6 +110,19 @@ if "doc_name" not in st.session_state:
 if "relevance_threshold" not in st.session_state:
     st.session_state.relevance_threshold = RELEVANCE_THRESHOLD
 
+# With SESSION_STORE set, the conversation is persisted under a session ID
+# kept in the URL, so a reload, restart or another worker resumes it.
+session_store = get_session_store()
+if session_store and "session_id" not in st.session_state:
+    session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = session_id
+    st.session_state.session_id = session_id
+    st.session_state.messages = [
+        {"role": role, "content": pair[key]}
+        for pair in session_store.get(session_id).conversation_pairs
+        for role, key in (("user", "question"), ("assistant", "answer"))
+    ]
+
 # Title
 st.title("🤖 Agentic RAG Research Copilot")
 st.markdown("*Intelligent document Q&A with reasoning transparency*")
@@ -151,6 +169,8 @@ with st.sidebar:
             clear_database()
             st.session_state.agent = None
             st.session_state.messages = []
+            if session_store:
+                session_store.delete(st.session_state.session_id)
             st.session_state.doc_name = None
             st.session_state.last_uploaded_file = None
             st.rerun()
@@ -201,6 +221,19 @@ with st.sidebar:
                     raise Exception(f"Ingestion failed: {result.stderr}")
                 st.success(f"✅ {result.stdout.strip()}")
 
+                if INGEST_SUMMARIES:
+                    # Precompute the document summaries in the background;
+                    # the document_summary tool serves them once written.
+                    subprocess.Popen(
+                        [python_path, script_path, "--summarize",
+                         uploaded_file.name],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                        env=os.environ.copy(),
+                        cwd=os.path.dirname(script_path),
+                        start_new_session=True,
+                    )
+
                 st.info("Step 2: Verifying ingestion...")
                 if any(d["name"] == uploaded_file.name for d in list_documents()):
                     st.success(f"📄 Added to knowledge base: {uploaded_file.name}")
@@ -291,15 +324,19 @@ with st.sidebar:
                 top_k=top_k,
                 relevance_threshold=relevance_threshold
             )
-            # If model changed, reinitialize
+            # If model changed, reinitialize (cheap: graphs are shared) and
+            # keep the conversation and document scope
             if model_option != st.session_state.agent.model_name:
+                old_agent = st.session_state.agent
                 st.session_state.agent = AgenticRAG(
                     model_name=model_option,
                     temperature=temperature,
                     top_k=top_k,
                     verbose=False,
-                    relevance_threshold=relevance_threshold
+                    relevance_threshold=relevance_threshold,
+                    doc_filter=old_agent.doc_filter
                 )
+                st.session_state.agent.memory = old_agent.memory
 
     st.divider()
 
@@ -321,6 +358,8 @@ with st.sidebar:
         st.session_state.messages = []
         if st.session_state.agent:
             st.session_state.agent.clear_memory()
+        elif session_store:
+            session_store.delete(st.session_state.session_id)
         st.rerun()
 
     # Info section
@@ -358,12 +397,13 @@ if not selected_docs:
                "in the sidebar to search it.")
     st.stop()
 
-# Main chat interface: (re)build the agent when missing or when the
-# document selection changed since it was created.
+# Main chat interface: build the agent when missing. The document scope is
+# per-session state, so a changed selection just rescopes the agent (and
+# keeps the conversation) — the compiled graph is shared either way.
 agent = st.session_state.agent
-if agent is None or set(agent.doc_filter or []) != set(selected_docs):
+if agent is None:
     try:
-        new_agent = AgenticRAG(
+        st.session_state.agent = AgenticRAG(
             model_name=st.session_state.model,
             temperature=st.session_state.temperature,
             top_k=st.session_state.top_k,
@@ -371,14 +411,16 @@ if agent is None or set(agent.doc_filter or []) != set(selected_docs):
             relevance_threshold=st.session_state.relevance_threshold,
             doc_filter=selected_docs
         )
-        # Rescoping shouldn't wipe the conversation — carry memory over
-        if agent is not None:
-            new_agent.memory = agent.memory
-        st.session_state.agent = new_agent
+        if session_store:
+            st.session_state.agent.memory = session_store.get(
+                st.session_state.session_id
+            )
     except Exception as e:
         st.error(f"Error initializing agent: {str(e)}")
         st.info("💡 Make sure you have set OPENAI_API_KEY in your .env file")
         st.stop()
+elif set(agent.doc_filter or []) != set(selected_docs):
+    agent.doc_filter = list(selected_docs)
 
 # Display chat messages
 for message in st.session_state.messages:
@@ -421,26 +463,13 @@ if prompt := st.chat_input("Ask a question about the document..."):
                 st.markdown(answer)
                 render_answer_badge(answer)
 
-                # Get retrieval scores if requested (only when the agent
-                # actually retrieved — chitchat has no scores to show)
+                # Retrieval scores come from the agent's own retriever calls
+                # (chitchat has none), so they match what the answer used
                 reasoning_steps = result.get("reasoning_steps", [])
-                did_retrieve = any(
-                    s["tool"] == "document_retriever" for s in reasoning_steps
-                )
-                retrieval_scores = []
-                if st.session_state.show_scores and did_retrieve:
-                    try:
-                        docs_with_scores = retrieve_with_scores(
-                            prompt,
-                            top_k=st.session_state.top_k,
-                            doc_names=selected_docs
-                        )
-                        retrieval_scores = [
-                            (doc.page_content, score)
-                            for doc, score in docs_with_scores
-                        ]
-                    except Exception:
-                        pass
+                retrieval_scores = [
+                    (doc["content"], doc["score"])
+                    for doc in result.get("retrieved_docs", [])
+                ]
 
                 # Show reasoning
                 if st.session_state.show_reasoning:
@@ -1,14 +1,21 @@
 """
 Automated test: Ingest PDF → Ask question → Clean up
+
+Runs offline with the fake providers (see fake_providers.py):
+    EMBEDDING_MODEL=fake CHROMA_DIR=./chroma_fake TEST_MODEL=fake-chat \
+    python automated_test.py
 """
 import os
 import shutil
 from ingestion import ingest_pdf
 from agents import AgenticRAG
+from providers import get_persist_dir
 from dotenv import load_dotenv
 
 load_dotenv()
 
+TEST_MODEL = os.getenv("TEST_MODEL", "gpt-3.5-turbo")
+
 def run_automated_test():
     print("=" * 70)
     print("AUTOMATED TEST: PDF Ingestion + Query")
@@ -28,7 +35,7 @@ def run_automated_test():
     # Step 2: Initialize Agent
     print("\n🤖 Step 2: Initializing AgenticRAG agent...")
     try:
-        agent = AgenticRAG(model_name="gpt-3.5-turbo", temperature=0.7, top_k=5)
+        agent = AgenticRAG(model_name=TEST_MODEL, temperature=0.7, top_k=5)
         print("✅ Agent initialized successfully")
     except Exception as e:
         print(f"❌ Agent initialization failed: {e}")
@@ -46,8 +53,8 @@ def run_automated_test():
         print(response["answer"])
 
         print("\n🧠 REASONING STEPS:")
-        for i, step in enumerate(response.get("reasoning", []), 1):
-            print(f"  {i}. {step}")
+        for i, step in enumerate(response.get("reasoning_steps", []), 1):
+            print(f"  {i}. {step['tool']}: {step['output']}")
 
         print("\n📊 RETRIEVAL SCORES:")
         for doc_info in response.get("retrieved_docs", [])[:3]:  # Show top 3
@@ -65,7 +72,7 @@ def run_automated_test():
     # Step 4: Clean up
     print("\n🧹 Step 4: Cleaning up ChromaDB...")
     try:
-        chroma_dir = os.path.join(os.path.dirname(__file__), "chroma_db")
+        chroma_dir = get_persist_dir()
         if os.path.exists(chroma_dir):
             shutil.rmtree(chroma_dir)
             os.makedirs(chroma_dir, exist_ok=True)
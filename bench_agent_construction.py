@@ -0,0 +1,63 @@
+"""
+Benchmark: AgenticRAG construction cost with and without the shared graph.
+
+app.py builds an agent per session / model switch and evaluate.py builds one
+per golden question. Each build used to create a fresh chat model (and HTTP
+client) and recompile the LangGraph agent; get_agent_graph now shares them
+per (model, settings). This compares the two. No API calls are made.
+
+Usage:
+    python bench_agent_construction.py [--n 50] [--model claude-opus-4-6]
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Construction only validates that a key is present; nothing is sent.
+os.environ.setdefault("ANTHROPIC_API_KEY", "bench-placeholder")
+os.environ.setdefault("OPENAI_API_KEY", "bench-placeholder")
+
+from agents import AgenticRAG, get_agent_graph
+
+
+def bench(n, model, shared):
+    timings = []
+    for _ in range(n):
+        if not shared:
+            get_agent_graph.cache_clear()
+        t0 = time.perf_counter()
+        AgenticRAG(model_name=model, temperature=0.0, verbose=False)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return sum(timings) / n, timings[n // 2], timings[int(n * 0.95) - 1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=50, help="agents to build")
+    parser.add_argument("--model", default="claude-opus-4-6")
+    args = parser.parse_args()
+
+    # Warm imports so the first cold build isn't charged for them
+    AgenticRAG(model_name=args.model, verbose=False)
+
+    print("=" * 70)
+    print(f"AGENT CONSTRUCTION ({args.n} builds, model={args.model})")
+    print("=" * 70)
+    print(f"  {'mode':<28}{'mean':>12}{'p50':>12}{'p95':>12}")
+    results = {}
+    for label, shared in (("rebuild graph every time", False),
+                          ("shared graph (cached)", True)):
+        mean, p50, p95 = bench(args.n, args.model, shared)
+        results[label] = mean
+        print(f"  {label:<28}{mean * 1000:>10.3f}ms{p50 * 1000:>10.3f}ms"
+              f"{p95 * 1000:>10.3f}ms")
+
+    cold, warm = results.values()
+    print(f"\n  Overhead removed per construction: {(cold - warm) * 1000:.2f}ms"
+          f" ({cold / warm:.0f}x faster)")
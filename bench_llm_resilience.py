@@ -0,0 +1,133 @@
+"""
+Benchmark: tail latency and errors with and without ResilientChatModel.
+
+Starts stub_chat_server.py instances locally (no API calls) and sends the
+same requests through:
+
+  1. a plain ChatOpenAI client,
+  2. ResilientChatModel with hedging (second request after the p95 delay),
+  3. ResilientChatModel failing over from a primary that answers 429 to a
+     healthy fallback, which opens the primary's circuit breaker.
+
+First it checks that Anthropic prompt caching (PROMPT_CACHING) survives the
+wrapper, and exits with status 1 if it does not.
+
+Usage:
+    python bench_llm_resilience.py [--n 300] [--concurrency 8]
+                                   [--latency-ms 100] [--tail-ms 2000] [--tail-prob 0.03]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+import resilient_llm
+from resilient_llm import ResilientChatModel
+from stub_chat_server import StubConfig, serve
+from tracing import percentile
+
+
+def stub_model(name, port):
+    return ChatOpenAI(model=name, base_url=f"http://127.0.0.1:{port}/v1",
+                      api_key="stub", max_retries=0, timeout=30)
+
+
+def check_prompt_caching() -> bool:
+    """
+    True when the prompt-caching binding survives ResilientChatModel:
+    LangGraph's create_react_agent must take the wrapper's binding as
+    already bound (else it rebinds bare tools), the Anthropic model behind
+    it must keep the cache_control kwarg and tool-schema breakpoint, and the
+    OpenAI fallback must not receive the marker.
+    """
+    from langchain_anthropic import ChatAnthropic
+    # The function create_react_agent uses to decide whether to rebind
+    from langgraph.prebuilt.chat_agent_executor import _should_bind_tools
+
+    from agents import TOOLS, _bind_prompt
+
+    wrapper = ResilientChatModel(models=[
+        ChatAnthropic(model="claude-stub", api_key="stub"),
+        stub_model("gpt-stub-fallback", 8766),
+    ])
+    model, _ = _bind_prompt(wrapper, True)
+    anthropic, fallback = getattr(model, "bound", model).models
+    return (not _should_bind_tools(model, TOOLS)
+            and anthropic.kwargs.get("cache_control") is not None
+            and anthropic.kwargs["tools"][-1].get("cache_control") is not None
+            and "cache_control" not in fallback.kwargs)
+
+
+def run(llm, n, concurrency):
+    def one(i):
+        t0 = time.perf_counter()
+        try:
+            llm.invoke([HumanMessage(content=f"Question {i}?")])
+            return time.perf_counter() - t0, False
+        except Exception:
+            return time.perf_counter() - t0, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n)))
+    latencies = sorted(t for t, _ in results)
+    errors = sum(failed for _, failed in results)
+    return latencies, errors
+
+
+def row(label, latencies, errors, n):
+    print(f"  {label:<34}{percentile(latencies, 50) * 1000:>8.0f}"
+          f"{percentile(latencies, 95) * 1000:>8.0f}"
+          f"{percentile(latencies, 99) * 1000:>8.0f}"
+          f"{latencies[-1] * 1000:>8.0f}{errors / n:>9.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--tail-ms", type=float, default=2000)
+    parser.add_argument("--tail-prob", type=float, default=0.03)
+    args = parser.parse_args()
+
+    caching_ok = check_prompt_caching()
+    print(f"Prompt caching through the wrapper: {'ok' if caching_ok else 'LOST'}")
+    if not caching_ok:
+        sys.exit(1)
+
+    slow = StubConfig(args.latency_ms, args.tail_ms, args.tail_prob)
+    serve(8765, slow)
+    serve(8766, StubConfig(args.latency_ms, args.tail_ms, args.tail_prob, seed=1))
+    serve(8767, StubConfig(args.latency_ms, 0, 0, error_rate=1.0))
+
+    print("=" * 74)
+    print(f"LLM RESILIENCE ({args.n} requests, concurrency {args.concurrency}, "
+          f"{args.tail_prob:.0%} of requests take {args.tail_ms:.0f}ms)")
+    print("=" * 74)
+    print(f"  {'client':<34}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'errors':>9}")
+
+    plain = stub_model("gpt-stub-plain", 8765)
+    row("plain client", *run(plain, args.n, args.concurrency), args.n)
+
+    hedged = ResilientChatModel(models=[stub_model("gpt-stub-hedged", 8765)],
+                                hedge=True)
+    # Warm-up: the hedge delay follows the p95 once enough samples exist
+    run(hedged, resilient_llm.MIN_SAMPLES, args.concurrency)
+    row("hedged (p95 delay)", *run(hedged, args.n, args.concurrency), args.n)
+
+    failover = ResilientChatModel(models=[stub_model("gpt-stub-429", 8767),
+                                          stub_model("gpt-stub-fallback", 8766)],
+                                  hedge=False)
+    row("failover from 429 primary", *run(failover, args.n, args.concurrency),
+        args.n)
+
+    print("\n  Per-model metrics (seconds):")
+    for name, m in resilient_llm.metrics().items():
+        print(f"    {name:<20} attempts={m['attempts']:<4} hedges={m['hedges']:<3}"
+              f" wins={m['hedge_wins']:<3} failovers={m['failovers']:<4}"
+              f" errors={m['errors']:<4} breaker={m['breaker']}"
+              f"  attempt p99={m['attempt_p99']}  call p99={m['call_p99']}")
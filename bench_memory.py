@@ -0,0 +1,110 @@
+"""
+Benchmark: per-turn memory footprint of ConversationMemory.
+
+ConversationMemory used to keep every exchange twice: a HumanMessage and an
+AIMessage in `messages`, plus a {"question", "answer"} dict in
+`conversation_pairs`. It now keeps one Turn record (__slots__) per exchange
+and derives both views. This builds a long session both ways and measures
+the allocations with tracemalloc; the question and answer text itself is
+the same in both and reported separately.
+
+Usage:
+    python bench_memory.py [--turns 10000] [--answer-chars 600]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from memory import ConversationMemory, HistoryIndex
+
+WORDS = ("engine torque fuel consumption seats boot volume towing brakes "
+         "transmission speakers sunroof paint package warranty service "
+         "interval tyre pressure headlights wipers battery charging").split()
+
+
+def make_texts(turns, answer_chars, seed=0):
+    rng = random.Random(seed)
+
+    def sentence(chars):
+        words = []
+        while sum(len(w) + 1 for w in words) < chars:
+            words.append(rng.choice(WORDS))
+        return " ".join(words)
+
+    return [(f"What about the {sentence(60)} of variant {i}?",
+             sentence(answer_chars)) for i in range(turns)]
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    kept = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, elapsed, kept
+
+
+def legacy_layout(texts):
+    """The previous representation: two messages plus a dict per turn."""
+    messages, pairs = [], []
+    for question, answer in texts:
+        messages.append(HumanMessage(content=question))
+        messages.append(AIMessage(content=answer))
+        pairs.append({"question": question, "answer": answer})
+    return messages, pairs
+
+
+def search_index(texts):
+    index = HistoryIndex()
+    for i, (question, answer) in enumerate(texts):
+        index.add(i, f"{question}\n{answer}")
+    return index
+
+
+def full_memory(texts):
+    memory = ConversationMemory(token_budget=0)
+    for question, answer in texts:
+        memory.add_user_message(question)
+        memory.add_ai_message(answer)
+    return memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--answer-chars", type=int, default=600)
+    args = parser.parse_args()
+
+    texts = make_texts(args.turns, args.answer_chars)
+    n = args.turns
+    # The strings exist before measuring, so only per-turn structure counts
+    text_bytes = sum(len(q) + len(a) for q, a in texts)
+
+    print("=" * 70)
+    print(f"CONVERSATION MEMORY FOOTPRINT ({n} turns, "
+          f"~{args.answer_chars}-char answers)")
+    print("=" * 70)
+    print(f"  {'layout':<40}{'bytes/turn':>12}{'build':>10}")
+    results = {}
+    for label, build in (
+        ("messages + pairs (previous)", legacy_layout),
+        ("ConversationMemory (Turn records + index)", full_memory),
+        ("  of which BM25 search index", search_index),
+    ):
+        size, elapsed, kept = measure(lambda: build(texts))
+        results[label] = size
+        print(f"  {label:<40}{size / n:>12.0f}{elapsed:>9.2f}s")
+        del kept
+
+    records = (results["ConversationMemory (Turn records + index)"]
+               - results["  of which BM25 search index"])
+    print(f"\n  Turn records alone: {records / n:.0f} bytes/turn "
+          f"({results['messages + pairs (previous)'] / max(records, 1):.1f}x smaller "
+          f"than messages + pairs)")
+    print(f"  Question + answer text, not counted above: {text_bytes / n:.0f} chars/turn")
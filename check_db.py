@@ -3,18 +3,18 @@ Manually check ChromaDB contents
 """
 import os
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from providers import get_embeddings, get_persist_dir
+
 def check_database():
     print("=" * 70)
     print("CHECKING CHROMADB CONTENTS")
     print("=" * 70)
 
-    repo_root = os.path.dirname(os.path.abspath(__file__))
-    persist_dir = os.path.join(repo_root, "chroma_db")
+    persist_dir = get_persist_dir()
 
     print(f"\n📂 ChromaDB Directory: {persist_dir}")
 
@@ -53,7 +53,7 @@ def check_database():
     # Try to connect to ChromaDB
     print(f"\n🔌 Attempting to connect to ChromaDB...")
     try:
-        embeddings = OpenAIEmbeddings()
+        embeddings = get_embeddings()
         vectorstore = Chroma(
             persist_directory=persist_dir,
             embedding_function=embeddings,
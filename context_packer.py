@@ -0,0 +1,138 @@
+"""
+Context packing for retriever tool output.
+
+Adjacent chunks from ingest_pdf overlap by up to 150 characters, and several
+of the top-k results often come from the same page. Feeding them to the LLM
+one by one repeats that overlap and has no size limit. The packer merges
+chunks from the same page into passages (removing the overlap), then fills a
+token budget with the passages in relevance order.
+"""
+
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+
+# Shortest suffix/prefix match treated as chunk overlap rather than a
+# coincidental repeat of a few characters.
+MIN_OVERLAP_CHARS = 20
+# Splitter overlap is 150 chars, but it snaps to separators, so look further.
+MAX_OVERLAP_CHARS = 400
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens with tiktoken's cl100k_base encoding.
+
+    tiktoken downloads its encoding files on first use; without network
+    access that fails, so fall back to the usual ~4 characters per token.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4) if text else 0
+
+
+def merge_text(a: str, b: str):
+    """Return a + b with their overlap removed, or None if they don't overlap."""
+    if b in a:
+        return a
+    longest = min(len(a), len(b), MAX_OVERLAP_CHARS)
+    for k in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return None
+
+
+def _page_key(doc: Document):
+    meta = doc.metadata or {}
+    return (meta.get("doc_name") or meta.get("source"), meta.get("page"))
+
+
+def _merge_page(chunks: List[Tuple[Document, float]]) -> List[Dict]:
+    """Merge one page's chunks into passages of contiguous text."""
+    # start_index (written at ingest time) gives the chunks' order on the
+    # page; chunks ingested before it existed keep retrieval order and are
+    # merged by matching text.
+    chunks = sorted(
+        chunks, key=lambda c: c[0].metadata.get("start_index", float("inf"))
+    )
+    passages = []
+    for doc, score in chunks:
+        passage = {"text": doc.page_content, "score": score, "chunks": 1,
+                   "metadata": doc.metadata or {}}
+        # A new chunk can bridge two passages, so keep absorbing until the
+        # merged passage overlaps nothing else.
+        merged_any = True
+        while merged_any:
+            merged_any = False
+            for other in passages:
+                merged = (merge_text(other["text"], passage["text"])
+                          or merge_text(passage["text"], other["text"]))
+                if merged is not None:
+                    passages.remove(other)
+                    passage = {
+                        "text": merged,
+                        "score": max(other["score"], passage["score"]),
+                        "chunks": other["chunks"] + passage["chunks"],
+                        "metadata": other["metadata"],
+                    }
+                    merged_any = True
+                    break
+        passages.append(passage)
+    return passages
+
+
+def pack_context(
+    results: List[Tuple[Document, float]], token_budget: int
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Pack retrieved (Document, score) pairs into a token-budgeted context.
+
+    Returns:
+        (passages, stats). Each passage is a dict with 'text', 'score'
+        (best chunk score), 'chunks' (how many were merged), 'metadata'
+        and 'tokens', ordered by relevance. stats has 'chunks',
+        'raw_tokens' (what the unpacked chunks would cost), 'packed_tokens',
+        'overlap_tokens' (removed by merging overlapping chunks), and
+        'dropped' / 'dropped_tokens' (passages left out because they did
+        not fit the budget).
+    """
+    pages = {}
+    for doc, score in results:
+        pages.setdefault(_page_key(doc), []).append((doc, score))
+
+    passages = []
+    for chunks in pages.values():
+        passages.extend(_merge_page(chunks))
+    passages.sort(key=lambda p: p["score"], reverse=True)
+
+    packed, used, dropped, dropped_tokens = [], 0, 0, 0
+    for passage in passages:
+        passage["tokens"] = count_tokens(passage["text"])
+        # Skip what doesn't fit rather than stopping: a smaller, less
+        # relevant passage may still fit in the remaining budget. The best
+        # passage is always kept so a tight budget never empties the context.
+        if used + passage["tokens"] > token_budget and packed:
+            dropped += 1
+            dropped_tokens += passage["tokens"]
+            continue
+        packed.append(passage)
+        used += passage["tokens"]
+
+    raw = sum(count_tokens(doc.page_content) for doc, _ in results)
+    stats = {
+        "chunks": len(results),
+        "raw_tokens": raw,
+        "packed_tokens": used,
+        "overlap_tokens": max(raw - used - dropped_tokens, 0),
+        "dropped": dropped,
+        "dropped_tokens": dropped_tokens,
+    }
+    return packed, stats
@@ -0,0 +1,202 @@
+"""
+Precomputed hierarchical document summaries.
+
+After a document is ingested, its text is rebuilt from the stored chunks,
+grouped into sections of SUMMARY_SECTION_PAGES pages, and each section is
+summarized (map-reduce, see summarizer.py); the section summaries are then
+reduced into a document summary. The result is persisted next to the vector
+DB, so the agent's document_summary tool answers "summarize this document"
+instantly instead of retrieving fragments and summarizing them per request.
+
+Re-ingesting a document refreshes incrementally: sections whose text hash is
+unchanged keep their stored summary, and the document summary is only
+recomputed when a section changed.
+
+Configuration (environment):
+    INGEST_SUMMARIES       build summaries after ingestion in the app and
+                           server (default 0; costs extra LLM calls)
+    SUMMARY_MODEL          chat model used (default gpt-4o-mini; fake-* offline)
+    SUMMARY_SECTION_PAGES  pages per section (default 5)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import json
+import os
+
+from context_packer import merge_text
+from providers import create_chat_model, get_persist_dir
+from summarizer import summarize, REDUCE_PROMPT, SUMMARY_MAX_CONCURRENCY
+from tracing import span, submit_traced
+
+INGEST_SUMMARIES = os.getenv("INGEST_SUMMARIES", "0").lower() in ("1", "true", "yes")
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_SECTION_PAGES = int(os.getenv("SUMMARY_SECTION_PAGES", "5"))
+
+
+def _summary_dir() -> str:
+    # Inside the Chroma directory, so clear_database() removes them too
+    return os.path.join(get_persist_dir(), "summaries")
+
+
+def summary_path(doc_name: str) -> str:
+    """JSON file holding one document's summaries."""
+    digest = hashlib.sha256(doc_name.encode()).hexdigest()[:16]
+    return os.path.join(_summary_dir(), f"{digest}.json")
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def load_summary(doc_name: str):
+    """The stored summary record for a document, or None."""
+    try:
+        with open(summary_path(doc_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def delete_summary(doc_name: str):
+    """Remove a document's stored summaries (if any)."""
+    try:
+        os.remove(summary_path(doc_name))
+    except OSError:
+        pass
+
+
+def _page_texts(doc_name: str):
+    """
+    Rebuild each page's text from the stored chunks.
+
+    Returns (pages, ingested_at) where pages is a sorted list of
+    (page number, text). Chunks overlap, so each chunk contributes only
+    the part past the end of the previous one (by start_index). Pages with
+    chunks ingested before start_index was stored keep the stored chunk
+    order and drop overlaps by matching text instead.
+    """
+    from retriever import get_vectorstore, _flush_chroma_cache
+
+    _flush_chroma_cache()
+    stored = get_vectorstore()._collection.get(
+        where={"doc_name": doc_name}, include=["documents", "metadatas"]
+    )
+    pages = {}
+    ingested_at = None
+    for text, meta in zip(stored["documents"], stored["metadatas"]):
+        meta = meta or {}
+        ingested_at = ingested_at or meta.get("ingested_at")
+        pages.setdefault(meta.get("page", 0), []).append(
+            (meta.get("start_index"), text)
+        )
+
+    result = []
+    for page, chunks in sorted(pages.items()):
+        if any(start is None for start, _ in chunks):
+            text = ""
+            for _, chunk in chunks:
+                merged = merge_text(text, chunk) if text else chunk
+                text = merged if merged is not None else f"{text}\n{chunk}"
+            result.append((page, text))
+            continue
+        chunks.sort()
+        text, end = "", 0
+        for start, chunk in chunks:
+            if start + len(chunk) <= end:
+                continue
+            text += chunk[max(0, end - start):]
+            end = start + len(chunk)
+        result.append((page, text))
+    return result, ingested_at
+
+
+def _sections(pages):
+    """Group (page, text) pairs into titled sections."""
+    sections = []
+    for i in range(0, len(pages), SUMMARY_SECTION_PAGES):
+        group = pages[i:i + SUMMARY_SECTION_PAGES]
+        first, last = group[0][0] + 1, group[-1][0] + 1
+        sections.append({
+            "title": f"Page {first}" if first == last else f"Pages {first}-{last}",
+            "text": "\n\n".join(text for _, text in group),
+        })
+    return sections
+
+
+def build_summaries(doc_name: str, model_name: str = SUMMARY_MODEL,
+                    callbacks=None) -> dict:
+    """
+    Build (or incrementally refresh) a document's hierarchical summary and
+    persist it. Returns the record: doc_name, model, ingested_at,
+    updated_at, summary, sections (title, hash, summary), plus
+    'reused_sections' — how many section summaries were carried over.
+    """
+    with span("summaries.build", doc_name=doc_name) as current:
+        pages, ingested_at = _page_texts(doc_name)
+        if not pages:
+            raise ValueError(f"No chunks stored for {doc_name!r}")
+        sections = _sections(pages)
+
+        previous = load_summary(doc_name) or {}
+        reusable = {}
+        if previous.get("model") == model_name:
+            reusable = {s["hash"]: s["summary"] for s in previous.get("sections", [])}
+
+        llm = create_chat_model(model_name, temperature=0.0)
+        texts = {}
+        for section in sections:
+            text = section.pop("text")
+            section["hash"] = _hash(text)
+            section["summary"] = reusable.get(section["hash"])
+            texts[section["hash"]] = text
+        changed = [s for s in sections if s["summary"] is None]
+        current.set_attribute("sections", len(sections))
+        current.set_attribute("changed_sections", len(changed))
+        if changed:
+            # Sections in parallel, each section's segments one at a time
+            with ThreadPoolExecutor(max_workers=SUMMARY_MAX_CONCURRENCY) as pool:
+                futures = [
+                    submit_traced(pool, summarize, llm, texts[s["hash"]],
+                                  max_concurrency=1, callbacks=callbacks)
+                    for s in changed
+                ]
+                for section, future in zip(changed, futures):
+                    section["summary"] = future.result()
+
+        outline = "\n\n".join(f"{s['title']}: {s['summary']}" for s in sections)
+        outline_hash = _hash(outline)
+        if reusable and previous.get("outline_hash") == outline_hash:
+            document_summary = previous["summary"]
+        elif len(sections) == 1:
+            document_summary = sections[0]["summary"]
+        else:
+            document_summary = summarize(llm, outline, prompt=REDUCE_PROMPT,
+                                         callbacks=callbacks)
+
+        record = {
+            "doc_name": doc_name,
+            "model": model_name,
+            "ingested_at": ingested_at,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "summary": document_summary,
+            "outline_hash": outline_hash,
+            "sections": sections,
+        }
+        os.makedirs(_summary_dir(), exist_ok=True)
+        path = summary_path(doc_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(path + ".tmp", path)
+        record["reused_sections"] = len(sections) - len(changed)
+        return record
+
+
+def format_summary(record: dict, outline: bool = True) -> str:
+    """Render a stored record as the document_summary tool's output."""
+    lines = [f"Summary of {record['doc_name']}:", record["summary"]]
+    if outline and len(record["sections"]) > 1:
+        lines.append("\nSection outline:")
+        lines += [f"- {s['title']}: {s['summary']}" for s in record["sections"]]
+    return "\n".join(lines)
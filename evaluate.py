@@ -16,20 +16,49 @@ Stage 2 — Generation (costs LLM calls, opt-in via --generation):
 Usage:
     python evaluate.py                # retrieval eval only
     python evaluate.py --generation   # full eval (runs the agent + judge)
+    python evaluate.py --generation --cache
+                                      # replay unchanged LLM calls from disk
+    python evaluate.py --generation --workers 8 --fresh
+                                      # 8 cases at a time, ignore old results
+
+Generation cases run on a thread pool (--workers, default 4). Rate limits
+are shared: a 429 backs every worker off together (exponential, jittered),
+and LLM calls run in llm_scheduler's batch class, so LLM_MAX_CONCURRENCY /
+LLM_TPM_BUDGET cap the eval like any other workload. Each finished case is
+appended to eval_results.jsonl (--results); a rerun reuses the cases
+already there for the same models, knowledge base, guardrail and packing
+settings (RELEVANCE_THRESHOLD, CONTEXT_TOKEN_BUDGET, ...) and answering
+code, so an interrupted eval resumes. A closing table reports wall time, API calls and tokens per
+stage.
+
+Offline (fake providers; needs a DB ingested with EMBEDDING_MODEL=fake):
+    EMBEDDING_MODEL=fake CHROMA_DIR=./chroma_fake \
+    EVAL_AGENT_MODEL=fake-chat EVAL_JUDGE_MODEL=fake-judge \
+    python evaluate.py --generation
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import json
 import os
+import random
 import sys
+import threading
+import time
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from retriever import retrieve_with_scores
+from tracing import submit_traced
 
 TOP_K = 5
+# Per-case generation results, appended as cases finish (see eval_generation)
+RESULTS_PATH = "eval_results.jsonl"
+REFUSAL_MARKERS = ("not", "no relevant", "doesn't", "does not", "unable",
+                   "couldn't find", "don't have", "can't", "can’t", "cannot")
 
 
 def load_dataset(path="golden_dataset.json"):
@@ -89,7 +118,7 @@ def eval_retrieval(dataset):
     return threshold
 
 
-def judge_faithfulness(llm, answer, context):
+def judge_faithfulness(llm, answer, context, callbacks=None):
     """LLM-as-judge: is every claim in the answer supported by the context?"""
     from langchain_core.messages import HumanMessage
 
@@ -105,34 +134,199 @@ Answer:
 Is every factual claim in the Answer supported by the Context? Statements like
 "this is not in the documents" count as SUPPORTED. Reply with exactly one word:
 SUPPORTED or UNSUPPORTED."""
-    result = llm.invoke([HumanMessage(content=prompt)])
+    result = llm.invoke([HumanMessage(content=prompt)],
+                        config={"callbacks": callbacks or []})
     return "UNSUPPORTED" not in result.content.upper()
 
 
-def query_with_backoff(agent, question, max_attempts=2, wait_s=20):
-    """Run agent.query, retrying on rate-limit errors so infra noise
-    doesn't pollute the quality metrics."""
-    import time
+class SharedBackoff:
+    """
+    Rate-limit backoff shared by all eval workers: a 429 seen by one
+    worker pauses every worker, for exponentially growing, jittered delays
+    (instead of each worker sleeping a fixed 20 s on its own).
+    """
 
-    t0 = time.time()
-    for attempt in range(max_attempts):
-        answer = agent.query(question)["answer"]
-        if "429" not in answer and "Rate limit" not in answer:
-            print(f"      ({time.time() - t0:.1f}s)", flush=True)
-            return answer
-        if attempt < max_attempts - 1:
-            print(f"      (rate limited, waiting {wait_s}s...)", flush=True)
-            time.sleep(wait_s)
-    print(f"      ({time.time() - t0:.1f}s, still rate limited)", flush=True)
-    return answer
+    def __init__(self, base_s=2.0, max_s=60.0):
+        self.base_s = base_s
+        self.max_s = max_s
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self.pauses = 0
+
+    def wait(self):
+        """Block while a pause is in effect."""
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def rate_limited(self, attempt: int) -> float:
+        """Pause everyone after the attempt-th (0-based) rate limit."""
+        delay = min(self.max_s, self.base_s * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            self.pauses += 1
+        return delay
+
+
+def _is_rate_limited(answer: str) -> bool:
+    return "429" in answer or "rate limit" in answer.lower()
 
 
-def eval_generation(dataset):
-    """Run the full agent on the golden set; judge correctness + faithfulness."""
+def query_with_backoff(agent, question, backoff=None, max_attempts=4):
+    """Run agent.query, retrying on rate-limit errors so infra noise
+    doesn't pollute the quality metrics. Returns the full result dict."""
+    backoff = backoff or SharedBackoff()
+    for attempt in range(max_attempts):
+        backoff.wait()
+        result = agent.query(question)
+        if not _is_rate_limited(result["answer"]):
+            return result
+        if attempt < max_attempts - 1:
+            backoff.rate_limited(attempt)
+    return result
+
+
+# Modules whose code (prompts included) shapes an answer; this file holds
+# the judge prompt
+_ANSWER_MODULES = ("agents", "retriever", "context_packer", "summarizer",
+                   "doc_summaries")
+
+
+def eval_config() -> dict:
+    """
+    The settings a generation result depends on besides the case and the
+    models: the guardrail and packing settings read from the environment,
+    the knowledge base contents, and a hash of the source of the answering
+    and judging code (SYSTEM_PROMPT and the judge prompt included).
+    """
+    import importlib
+    import agents
+    from retriever import db_generation
+
+    source = hashlib.sha256()
+    paths = [importlib.import_module(name).__file__ for name in _ANSWER_MODULES]
+    for path in paths + [os.path.abspath(__file__)]:
+        with open(path, "rb") as f:
+            source.update(f.read())
+    return {
+        "top_k": TOP_K,
+        "relevance_threshold": agents.RELEVANCE_THRESHOLD,
+        "context_token_budget": agents.CONTEXT_TOKEN_BUDGET,
+        "prefetch_similarity": agents.PREFETCH_SIMILARITY,
+        "prompt_caching": agents.PROMPT_CACHING,
+        "db_generation": db_generation(),
+        "source": source.hexdigest()[:16],
+    }
+
+
+def case_key(kind, case, agent_model, judge_model, config) -> str:
+    """Identifies a case's result: the case, the models and eval_config().
+    Anything else changing means the result is stale."""
+    payload = json.dumps([kind, case, agent_model, judge_model, config],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def load_results(path) -> dict:
+    """Finished case records of an earlier (possibly interrupted) run, by
+    key. Failed cases and a torn last line are skipped, so they rerun."""
+    records = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" not in record:
+                    records[record["key"]] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _usage(totals: dict) -> dict:
+    """API calls and tokens (LLM + embedding) from UsageTracker totals."""
+    return {
+        "calls": totals["llm_calls"] + totals["embedding_calls"],
+        "tokens": (totals["input_tokens"] + totals["output_tokens"]
+                   + totals["embedding_tokens"]),
+    }
+
+
+def run_case(kind, case, key, agent_model, judge, backoff) -> dict:
+    """Answer one golden question and score it; returns its JSONL record."""
     from agents import AgenticRAG
+    from usage import UsageCallbackHandler, track_usage
+
+    record = {"key": key, "kind": kind, "question": case["question"]}
+    try:
+        # A fresh agent per case: no memory carried between questions
+        agent = AgenticRAG(model_name=agent_model, temperature=0.0, top_k=TOP_K,
+                           verbose=False)
+        started = time.time()
+        result = query_with_backoff(agent, case["question"], backoff)
+        record["agent"] = {"started": started, "seconds": time.time() - started,
+                           **_usage(result["usage"])}
+        answer = record["answer"] = result["answer"]
+        if "error" in result:
+            record["error"] = result["error"]
+            return record
+
+        if kind == "unanswerable":
+            record["refused"] = any(m in answer.lower() for m in REFUSAL_MARKERS)
+            return record
+
+        record["correct"] = case["gold_answer_contains"].lower() in answer.lower()
+        # Judge against the chunks the agent actually retrieved, not a
+        # fresh retrieval of the question that it may never have seen
+        context = "\n".join(
+            doc["content"] for doc in result.get("retrieved_docs", [])
+        )
+        started = time.time()
+        with track_usage("eval_judge", question=case["question"][:200]) as tracker:
+            record["faithful"] = judge_faithfulness(
+                judge, answer, context, callbacks=[UsageCallbackHandler(tracker)]
+            )
+        record["judge"] = {"started": started, "seconds": time.time() - started,
+                           **_usage(tracker.totals())}
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def _stage_stats(records, stage) -> dict:
+    """Wall time (first start to last finish), API calls and tokens of one
+    stage over the cases run now."""
+    runs = [r[stage] for r in records if stage in r]
+    if not runs:
+        return {"wall_s": 0.0, "calls": 0, "tokens": 0}
+    return {
+        "wall_s": (max(r["started"] + r["seconds"] for r in runs)
+                   - min(r["started"] for r in runs)),
+        "calls": sum(r["calls"] for r in runs),
+        "tokens": sum(r["tokens"] for r in runs),
+    }
+
+
+def eval_generation(dataset, workers=4, results_path=RESULTS_PATH, resume=True):
+    """
+    Run the full agent on the golden set; judge correctness + faithfulness.
+
+    Cases run on `workers` threads; each finished case is appended to
+    results_path (JSONL) at once. With resume, cases already finished
+    there with the same models, settings, code and knowledge base (see
+    eval_config) are reused rather than rerun, so an interrupted eval picks up where it stopped. Returns the
+    agent and judge stage stats (see print_summary) of the cases run now.
+    """
+    from providers import create_chat_model
 
     # Models are env-overridable so the eval runs with whichever API key is
-    # valid (agent model must be one AgenticRAG supports: claude-* or gpt-*).
+    # valid (agent model must be one AgenticRAG supports: claude-*, gpt-*,
+    # or fake-* to run offline — see fake_providers.py).
     agent_model = os.getenv("EVAL_AGENT_MODEL", "gpt-4o-mini")
     judge_model = os.getenv("EVAL_JUDGE_MODEL", "gpt-4o-mini")
 
@@ -141,71 +335,151 @@ def eval_generation(dataset):
           f"judge={judge_model})")
     print("=" * 70)
 
-    if judge_model.startswith("claude"):
-        from langchain_anthropic import ChatAnthropic
-        judge = ChatAnthropic(model=judge_model, temperature=0.0, max_tokens=10)
-    else:
-        from langchain_openai import ChatOpenAI
-        judge = ChatOpenAI(model=judge_model, temperature=0.0, max_tokens=10)
+    judge = create_chat_model(judge_model, temperature=0.0, max_tokens=10)
+
+    cases = ([("answerable", c) for c in dataset["answerable"]]
+             + [("unanswerable", c) for c in dataset["unanswerable"]])
+    config = eval_config()
+    keys = [case_key(kind, case, agent_model, judge_model, config)
+            for kind, case in cases]
+    previous = load_results(results_path) if resume else {}
+    records = {key: previous[key] for key in keys if key in previous}
+    todo = [(kind, case, key) for (kind, case), key in zip(cases, keys)
+            if key not in records]
+    print(f"  {len(records)}/{len(cases)} cases reused from {results_path}; "
+          f"running {len(todo)} on {workers} workers")
+
+    backoff = SharedBackoff()
+    ran = []
+    # End a line torn by an interrupted run, so the next record starts clean
+    torn = (resume and os.path.exists(results_path)
+            and os.path.getsize(results_path) > 0)
+    if torn:
+        with open(results_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    with open(results_path, "a" if resume else "w") as out, \
+            ThreadPoolExecutor(max_workers=max(1, workers),
+                               thread_name_prefix="eval") as pool:
+        if torn:
+            out.write("\n")
+        futures = [
+            submit_traced(pool, run_case, kind, case, key, agent_model, judge, backoff)
+            for kind, case, key in todo
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            # One line per finished case: a crash loses at most the
+            # cases in flight
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            records[record["key"]] = record
+            ran.append(record)
+            seconds = record.get("agent", {}).get("seconds", 0.0)
+            status = "ERROR" if "error" in record else "done "
+            print(f"  [{done}/{len(todo)}] {status} {seconds:5.1f}s  "
+                  f"{record['question']}", flush=True)
+    if backoff.pauses:
+        print(f"  (rate limited {backoff.pauses} times; workers backed off together)")
 
+    print("\n" + "-" * 70)
+    print("CORRECTNESS + FAITHFULNESS")
+    print("-" * 70)
+    answerable = [records[key] for (kind, _), key in zip(cases, keys)
+                  if kind == "answerable"]
     correct = faithful = 0
-    answerable = dataset["answerable"]
-    for case in answerable:
-        print(f"  -> {case['question']}", flush=True)
-        agent = AgenticRAG(model_name=agent_model, temperature=0.0, top_k=TOP_K, verbose=False)
-        answer = query_with_backoff(agent, case["question"])
-
-        is_correct = case["gold_answer_contains"].lower() in answer.lower()
-        context = "\n".join(
-            doc.page_content
-            for doc, _ in retrieve_with_scores(case["question"], top_k=TOP_K)
-        )
-        is_faithful = judge_faithfulness(judge, answer, context)
-
-        correct += is_correct
-        faithful += is_faithful
-        c = "✓" if is_correct else "✗"
-        f = "✓" if is_faithful else "✗"
+    for case, record in zip(dataset["answerable"], answerable):
+        if "error" in record:
+            print(f"  ERROR: {record['error'][:100]}  {case['question']}")
+            continue
+        correct += record["correct"]
+        faithful += record["faithful"]
+        c = "✓" if record["correct"] else "✗"
+        f = "✓" if record["faithful"] else "✗"
         print(f"  correct:{c} faithful:{f}  {case['question']}")
-        if not is_correct:
+        if not record["correct"]:
             print(f"      expected to contain: {case['gold_answer_contains']!r}")
-            print(f"      got: {answer[:150]!r}")
+            print(f"      got: {record['answer'][:150]!r}")
 
-    print(f"\n  Correctness:  {correct}/{len(answerable)} = "
-          f"{correct/len(answerable):.0%}")
-    print(f"  Faithfulness: {faithful}/{len(answerable)} = "
-          f"{faithful/len(answerable):.0%}")
+    n = len(answerable)
+    print(f"\n  Correctness:  {correct}/{n} = {correct/n:.0%}")
+    print(f"  Faithfulness: {faithful}/{n} = {faithful/n:.0%}")
 
     print("\n" + "-" * 70)
     print("GUARDRAIL CHECK — off-topic questions must be refused")
     print("-" * 70)
-    refusal_markers = ("not", "no relevant", "doesn't", "does not", "unable",
-                       "couldn't find", "don't have", "can't", "can’t",
-                       "cannot")
     refused = 0
-    for case in dataset["unanswerable"]:
-        print(f"  -> {case['question']}", flush=True)
-        agent = AgenticRAG(model_name=agent_model, temperature=0.0, top_k=TOP_K, verbose=False)
-        answer = query_with_backoff(agent, case["question"])
-        is_refusal = any(m in answer.lower() for m in refusal_markers)
-        refused += is_refusal
-        r = "✓ refused" if is_refusal else "✗ ANSWERED ANYWAY"
+    for case, key in zip(dataset["unanswerable"], keys[len(answerable):]):
+        record = records[key]
+        if "error" in record:
+            print(f"  [ERROR] {record['error'][:100]}  {case['question']}")
+            continue
+        refused += record["refused"]
+        r = "✓ refused" if record["refused"] else "✗ ANSWERED ANYWAY"
         print(f"  [{r}] {case['question']}")
-        if not is_refusal:
-            print(f"      got: {answer[:150]!r}")
+        if not record["refused"]:
+            print(f"      got: {record['answer'][:150]!r}")
     n = len(dataset["unanswerable"])
     print(f"\n  Refusal rate: {refused}/{n} = {refused/n:.0%}")
 
+    return {"agent": _stage_stats(ran, "agent"), "judge": _stage_stats(ran, "judge")}
+
+
+def print_summary(stages: dict, wall_s: float):
+    """Wall time, API calls and tokens per stage. Agent and judge calls
+    overlap across workers, so their wall times overlap too; cases reused
+    from an earlier run are not counted."""
+    print("\n" + "=" * 70)
+    print("SUMMARY — wall time, API calls and tokens per stage")
+    print("=" * 70)
+    print(f"  {'stage':<12}{'wall s':>10}{'API calls':>12}{'tokens':>12}")
+    for name, stats in stages.items():
+        print(f"  {name:<12}{stats['wall_s']:>10.1f}{stats['calls']:>12}"
+              f"{stats['tokens']:>12}")
+    calls = sum(s["calls"] for s in stages.values())
+    tokens = sum(s["tokens"] for s in stages.values())
+    print(f"  {'total':<12}{wall_s:>10.1f}{calls:>12}{tokens:>12}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate the RAG pipeline")
     parser.add_argument("--generation", action="store_true",
                         help="also run the agent + LLM judge (costs API calls)")
+    parser.add_argument("--cache", action="store_true",
+                        help="replay unchanged LLM calls from the on-disk "
+                             "response cache (LLM_CACHE, see llm_cache.py)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="generation cases run in parallel (default 4)")
+    parser.add_argument("--results", default=RESULTS_PATH,
+                        help=f"per-case results JSONL (default {RESULTS_PATH})")
+    parser.add_argument("--fresh", action="store_true",
+                        help="rerun every case instead of resuming from --results")
     args = parser.parse_args()
+    if args.cache:
+        os.environ.setdefault("LLM_CACHE", "1")
+
+    from usage import track_usage
 
+    started = time.perf_counter()
     dataset = load_dataset()
-    eval_retrieval(dataset)
+    with track_usage("eval_retrieval") as tracker:
+        eval_retrieval(dataset)
+    stages = {"retrieval": {"wall_s": time.perf_counter() - started,
+                            **_usage(tracker.totals())}}
     if args.generation:
-        eval_generation(dataset)
+        from llm_scheduler import llm_priority
+
+        # Batch class: under admission control, user questions go first
+        with llm_priority("batch"):
+            stages.update(eval_generation(dataset, workers=args.workers,
+                                          results_path=args.results,
+                                          resume=not args.fresh))
+        if args.cache:
+            from llm_cache import cache_path, get_response_cache
+            stats = get_response_cache().stats()
+            print(f"\n  LLM response cache: {stats['hits']} hits, "
+                  f"{stats['misses']} misses ({stats['hit_rate']:.0%}) "
+                  f"— {cache_path()}")
     else:
         print("\n(run with --generation for correctness/faithfulness/guardrail eval)")
+    print_summary(stages, time.perf_counter() - started)
@@ -0,0 +1,307 @@
+"""
+Deterministic offline stand-ins for the OpenAI / Anthropic providers.
+
+Selected by name (see providers.py): chat models called "fake-*" and
+EMBEDDING_MODEL=fake. They let the whole pipeline — ingestion, retrieval,
+the agent, evaluate.py, automated_test.py and load tests — run on a build
+machine without API keys, so our own overhead can be measured in isolation.
+
+- FakeEmbeddings: feature-hashing set of content words (stopwords dropped),
+  L2-normalized. Texts sharing vocabulary get similar vectors, so retrieval
+  still ranks sensibly. A shared component lifts every score like OpenAI
+  embeddings do: a question sharing no content words with a chunk scores
+  ~0.60, below RELEVANCE_THRESHOLD, and one whose content words mostly
+  appear in it scores above (check_calibration(); run this module to check).
+- FakeChatModel: a scripted ReAct agent. It calls document_retriever with
+  the user's question (document_summary for "summarize ..." questions),
+  retries once when the guardrail asks it to, then answers from the first
+  retrieved passage (or refuses). Tool-less prompts
+  (summaries, the evaluation judge) get fixed, plausible replies.
+
+Latency is injectable per instance or via FAKE_LLM_LATENCY_MS /
+FAKE_EMBEDDING_LATENCY_MS (plus optional *_JITTER_MS, seeded).
+"""
+
+import hashlib
+import math
+import os
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from context_packer import count_tokens
+from memory import tokenize
+
+_GREETINGS = ("hi", "hello", "hey", "thanks", "thank you", "good morning")
+
+
+def _env_ms(name: str) -> float:
+    return float(os.getenv(name, "0") or 0)
+
+
+class _Latency:
+    """Sleeps a fixed delay plus seeded uniform jitter (milliseconds)."""
+
+    def __init__(self, base_ms: float, jitter_ms: float, seed: int = 0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+
+    def wait(self):
+        delay = self.base_ms
+        if self.jitter_ms:
+            delay += self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashing-trick embeddings: deterministic, offline, no model download."""
+
+    # Weight of the shared dimension: baseline cosine = w^2 / (w^2 + 1).
+    # Chroma's relevance is 1 - sqrt(2) * (1 - cosine), so unrelated texts
+    # score ~0.60 and the 0.65 threshold falls at a word-set cosine of ~0.12
+    # (a short question with half its words in an ~800-char chunk).
+    SHARED_WEIGHT = 1.6
+
+    def __init__(self, dimensions: int = 3072, latency_ms: Optional[float] = None,
+                 jitter_ms: Optional[float] = None):
+        self.model = "fake-embedding"
+        self.dimensions = dimensions
+        self._latency = _Latency(
+            _env_ms("FAKE_EMBEDDING_LATENCY_MS") if latency_ms is None else latency_ms,
+            _env_ms("FAKE_EMBEDDING_JITTER_MS") if jitter_ms is None else jitter_ms,
+        )
+
+    def _embed(self, text: str) -> List[float]:
+        # A set: repeated words would otherwise dominate long chunks and
+        # drown a short question's overlap. Single characters (digits,
+        # initials) match by coincidence too often to count as overlap.
+        features = {t for t in tokenize(text) if len(t) > 1}
+        hashed = [0.0] * (self.dimensions - 1)
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            hashed[(value >> 1) % len(hashed)] += sign
+        norm = math.sqrt(sum(v * v for v in hashed)) or 1.0
+        vector = [self.SHARED_WEIGHT] + [v / norm for v in hashed]
+        total = math.sqrt(self.SHARED_WEIGHT ** 2 + 1)
+        return [v / total for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._latency.wait()
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._latency.wait()
+        return self._embed(text)
+
+
+def _text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in content
+    )
+
+
+def _user_question(text: str) -> str:
+    # AgenticRAG.query prefixes earlier turns; the question comes last
+    return text.rsplit("Current question:", 1)[-1].strip()
+
+
+def _first_passage(tool_output: str) -> str:
+    """The text of the first '[Document 1 | ...]' block of retriever output."""
+    parts = re.split(r"\n\[Document \d+[^\]]*\]\n", tool_output, maxsplit=2)
+    return parts[1].strip() if len(parts) > 1 else tool_output.strip()
+
+
+class FakeChatModel(BaseChatModel):
+    """Scripted chat model that drives the ReAct loop deterministically."""
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+    max_tokens: Optional[int] = None
+    latency_ms: Optional[float] = None
+    jitter_ms: Optional[float] = None
+    answer_chars: int = 300
+    _latency: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _wait(self):
+        if self._latency is None:
+            self._latency = _Latency(
+                _env_ms("FAKE_LLM_LATENCY_MS") if self.latency_ms is None
+                else self.latency_ms,
+                _env_ms("FAKE_LLM_JITTER_MS") if self.jitter_ms is None
+                else self.jitter_ms,
+            )
+        self._latency.wait()
+
+    def _reply(self, messages, tools) -> AIMessage:
+        last = messages[-1]
+        human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        question = _user_question(_text(human)) if human else ""
+        tool_names = {t["function"]["name"] for t in tools or []}
+
+        if isinstance(last, ToolMessage):
+            output = _text(last)
+            if last.name == "document_summary":
+                if output.startswith("Summary of"):
+                    return AIMessage(content=output[:self.answer_chars])
+                return self._tool_call(question, 1)
+            retries = sum(isinstance(m, ToolMessage) for m in messages)
+            if output.startswith("No sufficiently relevant") and retries < 2:
+                return self._tool_call(f"{question} (document terminology)", retries)
+            if (output.startswith(("Still no", "No relevant", "No sufficiently"))):
+                return AIMessage(content=(
+                    "The uploaded documents do not contain this information."
+                ))
+            if output.startswith("Error"):
+                return AIMessage(content=f"I could not search the documents: {output}")
+            passage = _first_passage(output)[:self.answer_chars]
+            return AIMessage(content=f"According to the documents: {passage}")
+
+        text = _text(last)
+        if "SUPPORTED or UNSUPPORTED" in text:
+            return AIMessage(content="SUPPORTED")
+        if text.lstrip().startswith("Summarize"):
+            body = text.split("\n\n", 1)[-1].rsplit("\n\nSummary:", 1)[0]
+            sentences = re.split(r"(?<=[.!?])\s+", body.strip())
+            return AIMessage(content=" ".join(sentences[:2]))
+        if "document_retriever" in tool_names:
+            if question.lower().strip(" !.?") in _GREETINGS:
+                return AIMessage(content="Hello! Ask me anything about your documents.")
+            if ("document_summary" in tool_names
+                    and re.search(r"\bsummar|\bwhat is .* about\b", question.lower())):
+                return self._tool_call("all", 0, "document_summary")
+            return self._tool_call(question, 0)
+        return AIMessage(content=text[:self.answer_chars])
+
+    @staticmethod
+    def _tool_call(query: str, n: int, tool: str = "document_retriever") -> AIMessage:
+        return AIMessage(content="", tool_calls=[{
+            "name": tool, "args": {"__arg1": query},
+            "id": f"fake_call_{n}", "type": "tool_call",
+        }])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._wait()
+        reply = self._reply(messages, kwargs.get("tools"))
+        input_tokens = sum(count_tokens(_text(m)) for m in messages)
+        output_tokens = count_tokens(_text(reply)) + 10 * len(reply.tool_calls)
+        reply.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        reply.response_metadata = {"model_name": self.model_name}
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+
+# Passages (~800 chars, like ingest_pdf's chunks) and questions for
+# check_calibration: "overlapping" questions mostly use words of one
+# passage, "unrelated" ones share no content words with any.
+_CALIBRATION_PASSAGES = (
+    "The Transformer is a sequence transduction model based entirely on "
+    "attention, replacing the recurrent layers most commonly used in "
+    "encoder-decoder architectures with multi-headed self-attention. For "
+    "translation tasks it can be trained significantly faster than "
+    "architectures based on recurrent or convolutional layers. On the WMT "
+    "2014 English-to-German and English-to-French translation tasks it "
+    "achieves a new state of the art, and the best model even outperforms "
+    "all previously reported ensembles. The encoder maps an input sequence "
+    "of symbol representations to a sequence of continuous representations; "
+    "the decoder then generates an output sequence one element at a time, "
+    "consuming the previously generated symbols as additional input when "
+    "generating the next. Positional encodings inject information about "
+    "token order.",
+    "The four-cylinder petrol engine delivers 150 kW and 300 Nm of torque "
+    "and is paired with a seven-speed dual-clutch transmission driving the "
+    "front wheels. Combined fuel consumption is 6.8 litres per 100 km, and "
+    "the car accelerates from 0 to 100 km/h in 7.6 seconds. Standard "
+    "equipment includes LED headlights, a stereo system with six speakers, "
+    "two-zone climate control and a rear-view camera. Optional packages add "
+    "a panorama glass roof, a harman/kardon surround sound system with "
+    "twelve speakers and adaptive suspension. Rear seats fold in a 40:20:40 "
+    "split, extending the luggage compartment to 1600 litres. The service "
+    "interval display shows when the next oil change and brake fluid "
+    "inspection are due, and the warranty covers three years.",
+)
+_CALIBRATION_QUESTIONS = {
+    "overlapping": (
+        "How fast can the Transformer be trained for translation tasks?",
+        "What does the encoder map the input sequence to?",
+        "What do positional encodings inject?",
+        "How much torque does the petrol engine deliver?",
+        "How many speakers does the harman/kardon surround sound system have?",
+        "What split do the rear seats fold in?",
+    ),
+    "unrelated": (
+        "What is the capital of France?",
+        "How do I bake a chocolate cake?",
+        "Who won the 2018 FIFA World Cup?",
+        "Explain how photosynthesis works.",
+        "Which river flows through Vienna?",
+    ),
+}
+
+
+def check_calibration(threshold: Optional[float] = None) -> dict:
+    """
+    Best relevance score (as Chroma computes it: 1 - L2^2 / sqrt(2)) of
+    each calibration question over the calibration passages. 'ok' is true
+    when every overlapping question clears the guardrail threshold
+    (RELEVANCE_THRESHOLD) and every unrelated one stays below it.
+    """
+    if threshold is None:
+        from agents import RELEVANCE_THRESHOLD
+        threshold = RELEVANCE_THRESHOLD
+    embeddings = FakeEmbeddings(latency_ms=0, jitter_ms=0)
+    passages = embeddings.embed_documents(list(_CALIBRATION_PASSAGES))
+    scores = {}
+    for kind, questions in _CALIBRATION_QUESTIONS.items():
+        for question in questions:
+            vector = embeddings.embed_query(question)
+            scores[question] = (kind, max(
+                1 - sum((a - b) ** 2 for a, b in zip(vector, p)) / math.sqrt(2)
+                for p in passages
+            ))
+    ok = all((score >= threshold) == (kind == "overlapping")
+             for kind, score in scores.values())
+    return {"threshold": threshold, "scores": scores, "ok": ok}
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = check_calibration()
+    print("=" * 70)
+    print(f"FAKE EMBEDDING CALIBRATION (threshold {result['threshold']})")
+    print("=" * 70)
+    for question, (kind, score) in result["scores"].items():
+        passed = (score >= result["threshold"]) == (kind == "overlapping")
+        print(f"  [{'ok' if passed else 'FAIL'}] {kind:<12} {score:.3f}  {question}")
+    print(f"\n  {'Calibrated' if result['ok'] else 'NOT calibrated'}")
+    sys.exit(0 if result["ok"] else 1)
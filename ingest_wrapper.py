@@ -1,13 +1,25 @@
 """
 Wrapper script to run ingestion in a subprocess.
 This isolates the ingestion from Streamlit's execution context.
+
+    python ingest_wrapper.py <pdf_path> [display_name]
+    python ingest_wrapper.py --summarize <display_name>
+
+The --summarize form builds the document's precomputed summaries; the app
+starts it in the background once ingestion has finished.
 """
 import sys
-from ingestion import ingest_pdf
+from ingestion import ingest_pdf, summarize_document
 
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--summarize":
+        print(summarize_document(sys.argv[2]))
+        sys.stdout.flush()
+        sys.exit(0)
+
     if len(sys.argv) not in (2, 3):
-        print("Usage: python ingest_wrapper.py <pdf_path> [display_name]")
+        print("Usage: python ingest_wrapper.py <pdf_path> [display_name]\n"
+              "       python ingest_wrapper.py --summarize <display_name>")
         sys.exit(1)
 
     pdf_path = sys.argv[1]
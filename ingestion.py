@@ -28,7 +28,9 @@ if RecursiveCharacterTextSplitter is None:
         "ensure langchain is installed and up-to-date (e.g. pip install -U langchain)."
     )
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from providers import get_embeddings, get_persist_dir, is_fake
+from tracing import span
+from usage import track_usage, record_embedding, UsageCallbackHandler
 import os
 
 # Load environment variables from .env if present (optional)
@@ -41,8 +43,7 @@ except Exception:
 
 def clear_database():
     """Safely clear the ChromaDB database"""
-    repo_root = os.path.dirname(os.path.abspath(__file__))
-    persist_dir = os.path.join(repo_root, "chroma_db")
+    persist_dir = get_persist_dir()
 
     if os.path.exists(persist_dir):
         import shutil
@@ -62,18 +63,74 @@ def clear_database():
     os.chmod(persist_dir, 0o777)
 
 
-def ingest_pdf(pdf_path, doc_name=None):
+def ingest_pdf(pdf_path, doc_name=None, summaries=False):
     """Ingest a PDF into ChromaDB.
 
     doc_name: display name stored in chunk metadata (defaults to the file's
     basename). Lets the UI show the real uploaded filename even when the
     PDF arrives via a temp file.
+    summaries: also build the document's precomputed summaries (see
+    doc_summaries.py) before returning.
     """
+    return ingest_pdf_result(pdf_path, doc_name, summaries)["status"]
+
+
+def ingest_pdf_result(pdf_path, doc_name=None, summaries=False):
+    """Ingest a PDF like ingest_pdf, returning a result dict.
+
+    Keys: 'status' (the message ingest_pdf returns), 'doc_name', 'chunks'
+    and 'usage' (embedding calls/tokens and estimated cost; see usage.py).
+    The usage is also written to the usage ledger.
+    """
+    display_name = doc_name or os.path.basename(pdf_path)
+    with span("ingest.pdf", doc_name=display_name), \
+            track_usage("ingest", doc_name=display_name) as tracker:
+        chunks = _ingest_pdf(pdf_path, display_name)
+        if summaries:
+            _build_summaries(display_name, tracker)
+        usage = tracker.totals()
+    return {
+        "status": (f"Ingestion complete ({chunks} chunks, "
+                   f"{usage['embedding_tokens']:,} embedding tokens)"),
+        "doc_name": display_name,
+        "chunks": chunks,
+        "usage": usage,
+    }
+
+
+def summarize_document(doc_name):
+    """Build or refresh an ingested document's precomputed summaries.
+
+    Run after ingestion (ingest_wrapper.py --summarize does this in the
+    background for the app). Sections unchanged since the last build keep
+    their summaries. Returns a status message.
+    """
+    with track_usage("summarize", doc_name=doc_name) as tracker:
+        record = _build_summaries(doc_name, tracker)
+        usage = tracker.totals()
+    sections = len(record["sections"])
+    return (f"Summaries ready ({sections} sections, "
+            f"{sections - record['reused_sections']} summarized, "
+            f"{usage['llm_calls']} LLM calls)")
+
+
+def _build_summaries(doc_name, tracker):
+    from doc_summaries import build_summaries
+    from llm_scheduler import llm_priority
+
+    # Background work: yields to user questions under admission control
+    with llm_priority("batch"):
+        return build_summaries(doc_name, callbacks=[UsageCallbackHandler(tracker)])
+
+
+def _ingest_pdf(pdf_path, display_name):
+    """Load, split, embed and store one PDF; returns the chunk count."""
     # Try to load the PDF; if parsing problems occur, attempt a simple
     # sanitization by rewriting the PDF with PyPDF2 and reloading.
     loader = PyPDFLoader(pdf_path)
     try:
-        documents = loader.load()
+        with span("ingest.load_pdf"):
+            documents = loader.load()
     except Exception:
         # Lazy import to avoid extra dependency unless needed
         try:
@@ -87,30 +144,36 @@ def ingest_pdf(pdf_path, doc_name=None):
             with open(safe_path, "wb") as f:
                 writer.write(f)
             loader = PyPDFLoader(safe_path)
-            documents = loader.load()
+            with span("ingest.load_pdf", sanitized=True):
+                documents = loader.load()
         except Exception:
             # Re-raise the original loader error if sanitization fails
             raise
 
+    # start_index lets the retriever's context packer order and de-overlap
+    # adjacent chunks from the same page.
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=800,
-        chunk_overlap=150
+        chunk_overlap=150,
+        add_start_index=True
     )
 
-    chunks = text_splitter.split_documents(documents)
+    with span("ingest.split", pages=len(documents)) as current:
+        chunks = text_splitter.split_documents(documents)
+        current.set_attribute("chunks", len(chunks))
 
     # Stamp provenance metadata on every chunk so the knowledge base is
     # self-describing: the UI reads these back to show what is loaded,
     # since the vector DB outlives any app session.
     from datetime import datetime
-    display_name = doc_name or os.path.basename(pdf_path)
     ingested_at = datetime.now().strftime("%Y-%m-%d %H:%M")
     for chunk in chunks:
         chunk.metadata["doc_name"] = display_name
         chunk.metadata["ingested_at"] = ingested_at
 
-    # Ensure OPENAI_API_KEY is available
-    if not os.environ.get("OPENAI_API_KEY"):
+    # Ensure OPENAI_API_KEY is available (the offline fake embedder needs none)
+    if (not is_fake(os.getenv("EMBEDDING_MODEL", ""))
+            and not os.environ.get("OPENAI_API_KEY")):
         raise RuntimeError(
             "OPENAI_API_KEY environment variable is not set.\n"
             "Set it in your shell or add it to an .env file in the project root.\n"
@@ -118,12 +181,11 @@ def ingest_pdf(pdf_path, doc_name=None):
             "Or add to .env: OPENAI_API_KEY=<your_key>"
         )
 
-    embeddings = OpenAIEmbeddings()
+    embeddings = get_embeddings()
 
     # Use an absolute, repo-root relative path for Chroma persistence so the
     # DB is created consistently regardless of current working directory.
-    repo_root = os.path.dirname(os.path.abspath(__file__))
-    persist_dir = os.path.join(repo_root, "chroma_db")
+    persist_dir = get_persist_dir()
     os.makedirs(persist_dir, mode=0o777, exist_ok=True)
     os.chmod(persist_dir, 0o777)
 
@@ -131,20 +193,29 @@ def ingest_pdf(pdf_path, doc_name=None):
     # a document with the same name replaces it (delete old chunks first)
     # instead of duplicating its content.
     try:
-        existing = Chroma(
-            persist_directory=persist_dir, embedding_function=embeddings
-        )
-        existing._collection.delete(where={"doc_name": display_name})
-        del existing
+        with span("ingest.delete_existing"):
+            existing = Chroma(
+                persist_directory=persist_dir, embedding_function=embeddings
+            )
+            existing._collection.delete(where={"doc_name": display_name})
+            del existing
     except Exception:
         pass
 
     # Simple ingestion without custom client (works in subprocess)
-    vectorstore = Chroma.from_documents(
-        chunks,
-        embedding=embeddings,
-        persist_directory=persist_dir,
-    )
+    with span("ingest.embed_and_store", chunks=len(chunks)):
+        vectorstore = Chroma.from_documents(
+            chunks,
+            embedding=embeddings,
+            persist_directory=persist_dir,
+        )
+    # Only billed once the embeddings went through
+    record_embedding(embeddings.model, [c.page_content for c in chunks],
+                     batch_size=getattr(embeddings, "chunk_size", None))
+
+    # New contents: invalidates answers cached against the old DB
+    from retriever import bump_db_generation
+    bump_db_generation()
 
     # Explicitly close the connection to prevent locks
     try:
@@ -158,4 +229,4 @@ def ingest_pdf(pdf_path, doc_name=None):
     # calls are deprecated. We avoid calling `vectorstore.persist()` to
     # prevent deprecation warnings and potential locking issues.
 
-    return "Ingestion complete"
+    return len(chunks)
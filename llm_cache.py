@@ -0,0 +1,152 @@
+"""
+Exact-match, on-disk LLM response cache (opt-in).
+
+Plugs into LangChain's model-level `cache=` hook, so every chat model built
+by providers.create_chat_model — the agent's and the evaluation judge's —
+looks up a response before calling the API. LangChain supplies the key
+parts: the full message list and the model's serialized settings plus call
+kwargs (model name, temperature, max_tokens, bound tool schemas). Both are
+hashed — the messages without fields never sent to the provider, like ids
+and usage metadata — so any change to the prompt, tools or model misses.
+
+Replaying the golden set after a retrieval-only change therefore reuses
+every LLM turn whose input did not change, without API calls or
+rate-limit waits.
+
+Configuration (environment):
+    LLM_CACHE  unset/0 = off (default); 1 = llm_cache.sqlite in the repo
+               root; anything else = path of the SQLite file
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import warnings
+from functools import lru_cache
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+# Marks responses served from the cache (see usage.UsageCallbackHandler)
+CACHE_HIT_KEY = "response_cache_hit"
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# Message fields LangChain serializes but providers never see. Replayed
+# responses differ in them (cache-hit marker, zeroed cost), so they must
+# not break the key of the next ReAct step.
+_UNSENT_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+
+def _prompt_hash(prompt: str) -> str:
+    """Hash of the serialized message list without unsent fields."""
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return _hash(prompt)
+    for message in messages:
+        kwargs = message.get("kwargs") if isinstance(message, dict) else None
+        if isinstance(kwargs, dict):
+            for field in _UNSENT_FIELDS:
+                kwargs.pop(field, None)
+    return _hash(json.dumps(messages, sort_keys=True))
+
+
+class ResponseCache(BaseCache):
+    """SQLite-backed LangChain cache keyed by sha256(prompt), sha256(llm)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " prompt_hash TEXT, llm_hash TEXT, generations TEXT,"
+                " PRIMARY KEY (prompt_hash, llm_hash))"
+            )
+
+    def _connect(self):
+        # sqlite3 connections can't be shared across threads; the agent's
+        # tools and llm.batch call the model from worker threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, prompt: str, llm_string: str):
+        # Admission control waits for the verdict: only a miss reaches the
+        # provider, so only a miss queues for a slot and spends budget
+        from llm_scheduler import admit_pending, skip_pending
+
+        row = self._connect().execute(
+            "SELECT generations FROM responses"
+            " WHERE prompt_hash = ? AND llm_hash = ?",
+            (_prompt_hash(prompt), _hash(llm_string)),
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            admit_pending()
+            return None
+        skip_pending()
+        with warnings.catch_warnings():
+            # langchain_core.load.loads is flagged beta
+            warnings.simplefilter("ignore")
+            generations = loads(row[0])
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                message.response_metadata[CACHE_HIT_KEY] = True
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (_prompt_hash(prompt), _hash(llm_string), dumps(return_val)),
+            )
+
+    def clear(self, **kwargs):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+def cache_path():
+    """The configured cache file, or None when the cache is off."""
+    setting = os.getenv("LLM_CACHE", "").strip()
+    if setting.lower() in ("", "0", "false", "no", "none"):
+        return None
+    if setting.lower() in ("1", "true", "yes"):
+        repo_root = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(repo_root, "llm_cache.sqlite")
+    return os.path.abspath(setting)
+
+
+@lru_cache(maxsize=None)
+def _open(path: str) -> ResponseCache:
+    return ResponseCache(path)
+
+
+def get_response_cache():
+    """The shared ResponseCache for LLM_CACHE, or None if disabled."""
+    path = cache_path()
+    return _open(path) if path else None
@@ -0,0 +1,344 @@
+"""
+Process-wide admission control and priority queueing for LLM calls (opt-in).
+
+Under a burst every AgenticRAG.query used to fire its LLM calls at once;
+the provider's rate limit then answered with 429s that ended as "Error
+processing question". The scheduler admits LLM requests against
+
+- a concurrency limit (LLM_MAX_CONCURRENCY requests in flight),
+- a tokens-per-minute budget (LLM_TPM_BUDGET, sliding 60 s window; a
+  request is charged its prompt tokens plus an output allowance up front,
+  corrected to the reported usage when it finishes; cache hits are free),
+
+and queues the rest by priority class: "interactive" (the default: app,
+server and load test questions) before "batch" (evaluations, document and
+memory summaries). Batch work may not take the last LLM_INTERACTIVE_SLOTS
+slots, so it soaks up spare capacity without delaying user questions.
+A 429 from the provider pauses admissions for LLM_RATE_LIMIT_PAUSE seconds.
+
+Code marks background work with `with llm_priority("batch"):`; the class
+follows the context into worker threads started with tracing.submit_traced.
+
+Admission happens in a callback handler that providers.create_chat_model
+attaches to every model, so it covers all LLM calls (including each
+attempt of a ResilientChatModel). For models with the response cache
+(llm_cache.py), the callback only notes the request: the cache admits it
+on a miss, so a cache hit neither waits for a slot nor spends budget.
+metrics() reports queue waits, queue depth, in-flight requests, window
+tokens, rejections, pauses and skipped cache hits per class.
+
+Configuration (environment):
+    LLM_MAX_CONCURRENCY     LLM requests in flight, 0 = no limit (default 0)
+    LLM_TPM_BUDGET          tokens per minute, 0 = no limit (default 0)
+    LLM_INTERACTIVE_SLOTS   slots batch work may not use (default 2)
+    LLM_QUEUE_TIMEOUT       seconds a request may wait for admission (default 120)
+    LLM_RATE_LIMIT_PAUSE    seconds to stop admitting after a 429 (default 5)
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from context_packer import count_tokens
+from llm_cache import CACHE_HIT_KEY
+from tracing import percentile
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "0"))
+LLM_TPM_BUDGET = int(os.getenv("LLM_TPM_BUDGET", "0"))
+LLM_INTERACTIVE_SLOTS = int(os.getenv("LLM_INTERACTIVE_SLOTS", "2"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+LLM_RATE_LIMIT_PAUSE = float(os.getenv("LLM_RATE_LIMIT_PAUSE", "5"))
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+# Output tokens charged up front, before the real count is known
+OUTPUT_ALLOWANCE = 300
+WINDOW_SECONDS = 60.0
+# Recent queue waits kept per class for the percentiles
+WAIT_SAMPLES = 1000
+
+_priority: ContextVar = ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(name: str):
+    """Run the LLM calls in this block (and its traced worker threads) in
+    the given priority class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {name!r}; use one of {sorted(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class AdmissionTimeout(RuntimeError):
+    """An LLM request waited longer than LLM_QUEUE_TIMEOUT to be admitted."""
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "admitted")
+
+    def __init__(self, priority: str, tokens: int):
+        self.priority = priority
+        self.tokens = tokens
+        self.admitted = False
+
+
+class LLMScheduler:
+    """Priority admission against a concurrency limit and a TPM budget."""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 tpm_budget: int = LLM_TPM_BUDGET,
+                 interactive_slots: int = LLM_INTERACTIVE_SLOTS,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.tpm_budget = tpm_budget
+        self.interactive_slots = interactive_slots
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._queue = []                 # heap of (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._window = deque()           # [admitted_at, tokens] charges
+        self._window_tokens = 0
+        self.in_flight = {name: 0 for name in PRIORITIES}
+        self.paused_until = 0.0
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name in PRIORITIES}
+        self.counters = {name: {"admitted": 0, "timeouts": 0, "cache_hits": 0}
+                         for name in PRIORITIES}
+        self.rate_limit_pauses = 0
+
+    # -- admission --------------------------------------------------------
+
+    def _expire(self, now):
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _blocked_for(self, waiter: _Waiter, now: float):
+        """0 if the waiter can start now, else seconds until it might
+        (None: until a running request finishes)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        running = sum(self.in_flight.values())
+        if self.max_concurrency:
+            limit = self.max_concurrency
+            if waiter.priority != "interactive":
+                limit = max(1, limit - self.interactive_slots)
+            if running >= limit:
+                return None
+        if self.tpm_budget and self._window:
+            self._expire(now)
+            # A request bigger than the whole budget runs on an empty window
+            if self._window and self._window_tokens + waiter.tokens > self.tpm_budget:
+                return WINDOW_SECONDS - (now - self._window[0][0])
+        return 0
+
+    def acquire(self, priority: str, tokens: int):
+        """Block until admitted; returns the charge to pass to release()."""
+        waiter = _Waiter(priority, tokens)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), waiter))
+            while True:
+                now = time.monotonic()
+                if self._queue[0][2] is waiter:
+                    blocked = self._blocked_for(waiter, now)
+                    if blocked == 0:
+                        heapq.heappop(self._queue)
+                        break
+                else:
+                    blocked = None
+                if now >= deadline:
+                    self._queue.remove(next(e for e in self._queue if e[2] is waiter))
+                    heapq.heapify(self._queue)
+                    self.counters[priority]["timeouts"] += 1
+                    # The next waiter may be admissible now
+                    self._cond.notify_all()
+                    raise AdmissionTimeout(
+                        f"LLM request ({priority}) not admitted within "
+                        f"{self.queue_timeout:.0f}s"
+                    )
+                wait = deadline - now if blocked is None else min(blocked, deadline - now)
+                self._cond.wait(max(0.001, wait))
+
+            self.in_flight[priority] += 1
+            charge = [time.monotonic(), tokens]
+            self._window.append(charge)
+            self._window_tokens += tokens
+            self.counters[priority]["admitted"] += 1
+            self._waits[priority].append(now - started)
+            # The new head of the queue may fit too
+            self._cond.notify_all()
+        return charge
+
+    def release(self, priority: str, charge, actual_tokens=None, rate_limited=False):
+        """A request finished: free its slot and correct its token charge."""
+        with self._cond:
+            self.in_flight[priority] -= 1
+            if actual_tokens is not None:
+                self._window_tokens += actual_tokens - charge[1]
+                charge[1] = actual_tokens
+            if rate_limited:
+                self.rate_limit_pauses += 1
+                self.paused_until = max(self.paused_until,
+                                        time.monotonic() + LLM_RATE_LIMIT_PAUSE)
+            self._cond.notify_all()
+
+    def cache_hit(self, priority: str):
+        """A request was answered from the response cache, unadmitted."""
+        with self._cond:
+            self.counters[priority]["cache_hits"] += 1
+
+    # -- metrics ----------------------------------------------------------
+
+    def metrics(self) -> dict:
+        """Queue waits (seconds), depth, in-flight and counters per class,
+        plus the tokens charged in the current window."""
+        with self._cond:
+            self._expire(time.monotonic())
+            queued = {name: 0 for name in PRIORITIES}
+            for _, _, waiter in self._queue:
+                queued[waiter.priority] += 1
+            classes = {}
+            for name in PRIORITIES:
+                waits = sorted(self._waits[name])
+                classes[name] = {
+                    **self.counters[name],
+                    "queued": queued[name],
+                    "in_flight": self.in_flight[name],
+                    **{f"wait_p{pct}": round(percentile(waits, pct), 3) if waits else None
+                       for pct in (50, 95, 99)},
+                    "wait_max": round(waits[-1], 3) if waits else None,
+                }
+            return {"classes": classes, "window_tokens": self._window_tokens,
+                    "max_concurrency": self.max_concurrency,
+                    "tpm_budget": self.tpm_budget,
+                    "rate_limit_pauses": self.rate_limit_pauses}
+
+
+def _is_rate_limit(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None), "status_code", None)
+    return status == 429 or "rate limit" in str(error).lower() or "429" in str(error)
+
+
+# The request whose admission waits for the response cache's verdict, per
+# thread: LangChain looks up the cache on the thread that started the run.
+_pending = threading.local()
+
+
+class SchedulerCallbackHandler(BaseCallbackHandler):
+    """Admits each chat model request before it is sent (blocking the
+    calling thread while it queues) and releases it when it ends.
+
+    With deferred=True (models with a response cache) the request is only
+    noted at start; the cache calls admit_pending() on a miss and
+    skip_pending() on a hit.
+    """
+
+    # Let AdmissionTimeout reach the caller instead of being logged
+    raise_error = True
+
+    def __init__(self, scheduler: LLMScheduler, deferred: bool = False):
+        self.scheduler = scheduler
+        self.deferred = deferred
+        self._runs = {}                  # run_id -> (priority, charge)
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        text = "".join(str(m.content) for batch in messages for m in batch)
+        priority = _priority.get()
+        tokens = count_tokens(text) + OUTPUT_ALLOWANCE
+        if self.deferred:
+            _pending.run = (self, run_id, priority, tokens)
+        else:
+            self._admit(run_id, priority, tokens)
+
+    def on_llm_new_token(self, token, *, run_id=None, **kwargs):
+        # model.stream() skips the cache lookup: admit at the first token
+        run = getattr(_pending, "run", None)
+        if run is not None and run[1] == run_id:
+            admit_pending()
+
+    def _admit(self, run_id, priority: str, tokens: int):
+        charge = self.scheduler.acquire(priority, tokens)
+        with self._lock:
+            self._runs[run_id] = (priority, charge)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                if (message.response_metadata or {}).get(CACHE_HIT_KEY):
+                    continue
+                usage = message.usage_metadata or {}
+                tokens += usage.get("total_tokens", 0)
+        self.scheduler.release(*run, actual_tokens=tokens)
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.scheduler.release(*run, rate_limited=_is_rate_limit(error))
+
+
+def admit_pending():
+    """Response cache miss: admit this thread's deferred request (blocks
+    while it queues; no-op without one)."""
+    run = getattr(_pending, "run", None)
+    if run is not None:
+        _pending.run = None
+        handler, run_id, priority, tokens = run
+        handler._admit(run_id, priority, tokens)
+
+
+def skip_pending():
+    """Response cache hit: drop this thread's deferred request unadmitted."""
+    run = getattr(_pending, "run", None)
+    if run is not None:
+        _pending.run = None
+        handler, _, priority, _ = run
+        handler.scheduler.cache_hit(priority)
+
+
+_scheduler = None
+_handlers = {}
+_init_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(LLM_MAX_CONCURRENCY or LLM_TPM_BUDGET)
+
+
+def get_scheduler_handler(deferred: bool = False):
+    """The shared SchedulerCallbackHandler (deferred: for models whose
+    response cache admits on a miss), or None when no limit is set."""
+    global _scheduler
+    if not enabled():
+        return None
+    with _init_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        if deferred not in _handlers:
+            _handlers[deferred] = SchedulerCallbackHandler(_scheduler, deferred)
+        return _handlers[deferred]
+
+
+def metrics() -> dict:
+    """Scheduler metrics ({} when disabled)."""
+    return _scheduler.metrics() if _scheduler is not None else {}
@@ -0,0 +1,214 @@
+"""
+Load test: replay a question set against AgenticRAG with concurrent users.
+
+Each request is an independent user — a fresh AgenticRAG (cheap: the graph
+and LLM client are shared) asking one question — so conversation history
+doesn't grow across the run. Two load models:
+
+  closed loop (--concurrency N): N users, each sends its next question as
+      soon as the previous answer arrives.
+  open loop (--rate R): questions arrive as a Poisson process at R/s,
+      regardless of how fast they are answered; latency then includes
+      queueing behind --max-inflight workers, like real traffic.
+
+Reports throughput, latency p50/p95/p99, error rate and LLM round-trips
+(and tokens/cost) per query from the result's usage totals.
+
+Usage:
+    python loadtest.py --concurrency 4 --requests 40
+    python loadtest.py --rate 2 --duration 60 --questions demo_questions.md
+
+Offline (fake providers; needs a DB ingested with EMBEDDING_MODEL=fake):
+    EMBEDDING_MODEL=fake CHROMA_DIR=./chroma_fake FAKE_LLM_LATENCY_MS=800 \
+    python loadtest.py --model fake-chat --concurrency 8 --requests 100
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from agents import AgenticRAG
+from tracing import percentile
+import tracing
+
+
+def load_questions(path):
+    """Questions from golden_dataset.json (answerable + unanswerable) or
+    from the **Question:** "..." lines of demo_questions.md."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            dataset = json.load(f)
+        return [case["question"]
+                for key in ("answerable", "unanswerable")
+                for case in dataset.get(key, [])]
+    with open(path) as f:
+        return re.findall(r'\*\*Question:\*\*\s*"(.+?)"', f.read())
+
+
+def run_one(question, args, scheduled_at):
+    """One user request. Latency counts from its (scheduled) arrival."""
+    record = {"question": question}
+    try:
+        agent = AgenticRAG(model_name=args.model, temperature=0.0,
+                           top_k=args.top_k, verbose=False)
+        result = agent.query(question)
+        if "error" in result:
+            record["error"] = result["error"]
+        usage = result.get("usage") or {}
+        record["llm_calls"] = usage.get("llm_calls", 0)
+        record["input_tokens"] = usage.get("input_tokens", 0)
+        record["output_tokens"] = usage.get("output_tokens", 0)
+        record["cost_usd"] = usage.get("cost_usd")
+        record["answer_cache_hit"] = "answer_cache" in result
+        record["coalesced"] = bool(result.get("coalesced"))
+    except Exception as e:
+        record["error"] = str(e)
+    record["latency"] = time.perf_counter() - scheduled_at
+    return record
+
+
+def closed_loop(questions, args):
+    """--concurrency users, back to back, until --requests are sent."""
+    feed = itertools.islice(itertools.cycle(questions), args.requests)
+    lock = threading.Lock()
+    records = []
+
+    def user():
+        while True:
+            with lock:
+                question = next(feed, None)
+            if question is None:
+                return
+            record = run_one(question, args, time.perf_counter())
+            with lock:
+                records.append(record)
+                done = len(records)
+            if done % max(1, args.requests // 10) == 0:
+                print(f"  {done}/{args.requests} done", flush=True)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(user)
+    return records
+
+
+def open_loop(questions, args):
+    """Poisson arrivals at --rate/s for --duration seconds."""
+    rng = random.Random(args.seed)
+    feed = itertools.cycle(questions)
+    futures = []
+    start = time.perf_counter()
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=args.max_inflight) as pool:
+        while next_arrival - start < args.duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(run_one, next(feed), args, next_arrival))
+            next_arrival += rng.expovariate(args.rate)
+        print(f"  {len(futures)} requests sent, waiting for answers...",
+              flush=True)
+    return [f.result() for f in futures]
+
+
+def report(records, elapsed):
+    latencies = sorted(r["latency"] for r in records)
+    ok = [r for r in records if "error" not in r]
+    errors = len(records) - len(ok)
+    calls = sorted(r.get("llm_calls", 0) for r in ok)
+    n = len(records)
+
+    print("\n" + "=" * 70)
+    print("RESULTS")
+    print("=" * 70)
+    print(f"  Requests:     {n} in {elapsed:.1f}s")
+    print(f"  Throughput:   {n / elapsed:.2f} queries/s")
+    print(f"  Error rate:   {errors}/{n} = {errors / n:.1%}")
+    print(f"  Latency (s):  mean {sum(latencies) / n:.2f}"
+          f"  p50 {percentile(latencies, 50):.2f}"
+          f"  p95 {percentile(latencies, 95):.2f}"
+          f"  p99 {percentile(latencies, 99):.2f}"
+          f"  max {latencies[-1]:.2f}")
+    if ok:
+        print(f"  LLM calls/q:  mean {sum(calls) / len(ok):.2f}"
+              f"  p95 {percentile(calls, 95)}  max {calls[-1]}")
+        tokens_in = sum(r["input_tokens"] for r in ok) / len(ok)
+        tokens_out = sum(r["output_tokens"] for r in ok) / len(ok)
+        print(f"  Tokens/q:     {tokens_in:.0f} in, {tokens_out:.0f} out")
+        costs = [r["cost_usd"] for r in ok]
+        if None not in costs:
+            print(f"  Cost/q:       ${sum(costs) / len(ok):.4f}")
+    cache_hits = sum(r.get("answer_cache_hit", False) for r in records)
+    if cache_hits:
+        print(f"  Answer cache: {cache_hits}/{n} = {cache_hits / n:.1%} hits")
+    coalesced = sum(r.get("coalesced", False) for r in records)
+    if coalesced:
+        print(f"  Coalesced:    {coalesced}/{n} = {coalesced / n:.1%} shared an "
+              f"identical in-flight query")
+    if errors:
+        print("\n  Errors:")
+        for message, count in Counter(r["error"] for r in records
+                                      if "error" in r).most_common(5):
+            print(f"    {count:>4}x {message[:100]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--questions", default="golden_dataset.json",
+                        help="golden_dataset.json or demo_questions.md")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="closed loop: simultaneous users")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="closed loop: total requests (default: one "
+                             "pass over the questions)")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="open loop: arrivals per second (overrides "
+                             "--concurrency)")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="open loop: seconds of arrivals")
+    parser.add_argument("--max-inflight", type=int, default=64,
+                        help="open loop: worker threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None,
+                        help="write per-request records to this JSONL file")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if not questions:
+        raise SystemExit(f"No questions found in {args.questions}")
+    args.requests = args.requests or len(questions)
+
+    print("=" * 70)
+    if args.rate:
+        print(f"LOAD TEST — open loop, {args.rate}/s for {args.duration:.0f}s"
+              f" (model={args.model})")
+    else:
+        print(f"LOAD TEST — closed loop, {args.concurrency} users,"
+              f" {args.requests} requests (model={args.model})")
+    print("=" * 70)
+
+    started = time.perf_counter()
+    records = open_loop(questions, args) if args.rate else closed_loop(questions, args)
+    elapsed = time.perf_counter() - started
+    tracing.flush()
+
+    if not records:
+        raise SystemExit("No requests completed")
+    report(records, elapsed)
+    if args.out:
+        with open(args.out, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print(f"\n  Per-request records: {args.out}")
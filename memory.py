@@ -2,41 +2,230 @@
 Conversation memory system for Agentic RAG.
 
 Manages conversation history, context, and provides memory as a tool for the agent.
+
+With a token budget (MEMORY_TOKEN_BUDGET), memory stays bounded: once the
+verbatim turns exceed the budget, the oldest ones are folded into a rolling
+summary on a background thread, and only the newest turns are kept as-is.
+The context prefix is then the summary plus the recent turns, whatever the
+length of the session.
+
+Configuration (environment):
+    MEMORY_TOKEN_BUDGET    tokens of verbatim turns to keep; 0 = keep
+                           everything (default 0)
+    MEMORY_SUMMARY_TOKENS  target size of the rolling summary (default 300)
+    MEMORY_SUMMARY_MODEL   model that writes the summary (default gpt-4o-mini)
 """
 
-from typing import List, Dict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Optional
+import heapq
+import logging
+import math
+import os
+import re
+import threading
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from langchain_core.chat_history import BaseChatMessageHistory
 
+from context_packer import count_tokens
 
-class ConversationMemory:
-    """Simple in-memory conversation storage."""
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "0"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+COMPACT_PROMPT = """Summarize the conversation below between a user and a document assistant. Merge the earlier summary with the new turns, keep the facts, names and figures the user may refer back to, and stay under {words} words.
+
+{text}
+
+Summary:"""
+
+logger = logging.getLogger(__name__)
+
+# Compactions of all sessions run here, off the request path
+_COMPACT_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-compact")
+
+# Approximate bytes per turn beyond its text: the Turn record (~70) plus its
+# share of the search index (~1100); measured with bench_memory.py
+TURN_OVERHEAD_BYTES = 1200
+
+_TOKEN = re.compile(r"\w+")
+# Too common to rank turns by
+_STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how i in is it "
+    "its me my of on or that the this to was we were what when where which "
+    "who why with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class HistoryIndex:
+    """
+    Incremental BM25 inverted index over conversation turns.
+
+    Each Q&A pair is indexed once when it is added; a search only visits
+    the postings of the query's terms, so its cost follows how many turns
+    share those terms rather than the length of the history.
+    """
+
+    K1 = 1.2
+    B = 0.75
 
     def __init__(self):
-        self.messages: List[BaseMessage] = []
-        self.conversation_pairs: List[Dict[str, str]] = []
+        # term -> {turn id: term frequency}
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    def add(self, turn_id: int, text: str):
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term][turn_id] = tf
+        length = sum(terms.values())
+        self.lengths[turn_id] = length
+        self.total_length += length
+
+    def remove(self, turn_id: int, text: str):
+        """Drop a turn, given the text it was added with."""
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(turn_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(turn_id, 0)
+
+    def search(self, query: str, limit: int = 3) -> List[tuple]:
+        """Top (score, turn id) pairs, best first; newer turns win ties."""
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for turn_id, tf in postings.items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[turn_id] / avg_length)
+                scores[turn_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, ((score, turn_id) for turn_id, score in scores.items()))
+
+    def clear(self):
+        self.postings.clear()
+        self.lengths.clear()
+        self.total_length = 0
+
+
+class Turn:
+    """
+    One Q&A exchange, stored once. Reads like the {"question", "answer"}
+    dicts conversation_pairs used to hold (turn["answer"], dict(turn)).
+    """
+
+    __slots__ = ("question", "answer", "tokens")
+
+    def __init__(self, question: str, answer: str, tokens: int = 0):
+        self.question = question
+        self.answer = answer
+        # Size in tokens, tracked in bounded mode only
+        self.tokens = tokens
+
+    def __getitem__(self, key: str) -> str:
+        if key == "question":
+            return self.question
+        if key == "answer":
+            return self.answer
+        raise KeyError(key)
+
+    def keys(self):
+        return ("question", "answer")
+
+    def __repr__(self):
+        return f"Turn(question={self.question!r}, answer={self.answer!r})"
+
+
+class ConversationMemory:
+    """
+    Simple in-memory conversation storage.
+
+    Each exchange is one compact Turn; the message list and Q&A pairs are
+    views of them. A question waits in _question until its answer arrives
+    (an unanswered question is replaced by the next one).
+    """
+
+    def __init__(self, token_budget: Optional[int] = None):
+        self.turns: List[Turn] = []
+        self._question: Optional[str] = None
+        # Ranked search over turns; turn ids count from the first turn
+        # ever added, so they survive compaction
+        self.index = HistoryIndex()
+        self.token_budget = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+        # Rolling summary of the turns compacted away (budget mode only)
+        self.summary = ""
+        self.compacted_turns = 0
+        self._verbatim_tokens = 0
+        self._text_chars = 0
+        self._lock = threading.RLock()
+        self._compaction = None
+        # Bumped by clear() so an in-flight compaction is discarded
+        self._epoch = 0
 
     def add_user_message(self, message: str):
         """Add a user message to history."""
-        self.messages.append(HumanMessage(content=message))
+        with self._lock:
+            self._question = message
 
     def add_ai_message(self, message: str):
-        """Add an AI response to history."""
-        self.messages.append(AIMessage(content=message))
-
-        # Also store as Q&A pair for easy access
-        if len(self.messages) >= 2:
-            last_human = None
-            for msg in reversed(self.messages[:-1]):
-                if isinstance(msg, HumanMessage):
-                    last_human = msg.content
-                    break
-
-            if last_human:
-                self.conversation_pairs.append({
-                    "question": last_human,
-                    "answer": message
-                })
+        """Add an AI response to history (ignored without a question)."""
+        with self._lock:
+            if self._question:
+                turn_id = self.turn_count
+                turn = self._append_turn(turn_id, self._question, message)
+                self._question = None
+                self._turn_added(turn_id, turn)
+                if self.token_budget:
+                    self._maybe_compact()
+
+    def _append_turn(self, turn_id: int, question: str, answer: str) -> Turn:
+        """Index and keep one Q&A exchange."""
+        text = f"{question}\n{answer}"
+        self.index.add(turn_id, text)
+        turn = Turn(question, answer)
+        if self.token_budget:
+            turn.tokens = count_tokens(text)
+            self._verbatim_tokens += turn.tokens
+        self._text_chars += len(question) + len(answer)
+        self.turns.append(turn)
+        return turn
+
+    @property
+    def conversation_pairs(self) -> List[Turn]:
+        """Q&A pairs held verbatim, oldest first (read-only view)."""
+        return self.turns
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """The turns as alternating Human/AI messages (built on access)."""
+        with self._lock:
+            messages = []
+            for turn in self.turns:
+                messages.append(HumanMessage(content=turn.question))
+                messages.append(AIMessage(content=turn.answer))
+            if self._question:
+                messages.append(HumanMessage(content=self._question))
+        return messages
+
+    @property
+    def turn_count(self) -> int:
+        """Turns ever added, including ones no longer held verbatim."""
+        return self.compacted_turns + len(self.turns)
 
     def get_messages(self) -> List[BaseMessage]:
         """Get all messages."""
@@ -52,61 +241,228 @@ class ConversationMemory:
         Returns:
             Formatted conversation history
         """
-        if not self.conversation_pairs:
+        with self._lock:
+            summary = self.summary
+            recent = self.turns[-num_turns:]
+        if not recent and not summary:
             return "No previous conversation."
 
-        recent = self.conversation_pairs[-num_turns:]
         context_parts = []
+        if summary:
+            context_parts.append(f"Summary of earlier conversation:\n{summary}")
+            context_parts.append("")
 
         for i, pair in enumerate(recent, 1):
             context_parts.append(f"Turn {i}:")
             context_parts.append(f"Q: {pair['question']}")
-            context_parts.append(f"A: {pair['answer'][:200]}...")  # Truncate long answers
+            if self.token_budget:
+                # Bounded by the budget already; keep the answer whole
+                context_parts.append(f"A: {pair['answer']}")
+            else:
+                context_parts.append(f"A: {pair['answer'][:200]}...")  # Truncate long answers
             context_parts.append("")
 
         return "\n".join(context_parts)
 
     def get_conversation_summary(self) -> str:
         """Get a summary of the conversation for context."""
-        if not self.conversation_pairs:
-            return "No conversation history yet."
+        with self._lock:
+            num_turns = self.turn_count
+            if not num_turns:
+                return "No conversation history yet."
 
-        num_turns = len(self.conversation_pairs)
-        last_question = self.conversation_pairs[-1]["question"] if self.conversation_pairs else "None"
+            last_question = self.turns[-1]["question"] if self.turns else "None"
 
         return f"Conversation has {num_turns} turns. Last question: {last_question}"
 
     def search_history(self, query: str) -> str:
         """
         Search conversation history for relevant past Q&As.
-        Simple keyword-based search.
+        BM25-ranked over the question and answer words of every turn.
         """
-        if not self.conversation_pairs:
-            return "No conversation history to search."
+        with self._lock:
+            if not self.turns and not self.summary:
+                return "No conversation history to search."
 
-        query_lower = query.lower()
-        relevant_pairs = []
+            matches = self.index.search(query, limit=3)
+            pairs = [self.turns[turn_id - self.compacted_turns]
+                     for _, turn_id in matches]
+            summary = self.summary
+            first_turn = self.compacted_turns
 
-        for pair in self.conversation_pairs:
-            if (query_lower in pair["question"].lower() or
-                query_lower in pair["answer"].lower()):
-                relevant_pairs.append(pair)
+        if len(pairs) < 3 and first_turn:
+            pairs += self._search_older(query, first_turn, 3 - len(pairs))
 
-        if not relevant_pairs:
+        if not pairs:
+            if summary:
+                # The answer may be in the compacted turns
+                return (f"No relevant recent turns found for: {query}\n\n"
+                        f"Summary of earlier conversation:\n{summary}")
             return f"No relevant history found for: {query}"
 
-        # Return most recent relevant pairs
+        # Best match first
         result_parts = ["Found relevant conversation history:"]
-        for pair in relevant_pairs[-3:]:  # Last 3 relevant
+        for pair in pairs:
             result_parts.append(f"\nQ: {pair['question']}")
             result_parts.append(f"A: {pair['answer'][:150]}...")
 
         return "\n".join(result_parts)
 
+    # -- bounded mode -----------------------------------------------------
+
+    def _maybe_compact(self):
+        """Schedule a compaction of the oldest turns if over budget (one at
+        a time per session; the newest turn always stays verbatim)."""
+        if self._verbatim_tokens <= self.token_budget or self._compaction is not None:
+            return
+        over = self._verbatim_tokens - self.token_budget
+        count, freed = 0, 0
+        while freed < over and count < len(self.turns) - 1:
+            freed += self.turns[count].tokens
+            count += 1
+        if not count:
+            return
+        turns = self.turns[:count]
+        self._compaction = _COMPACT_POOL.submit(
+            self._compact, self.summary, turns, self._epoch
+        )
+
+    def _compact(self, summary: str, turns: List[Turn], epoch: int):
+        try:
+            new_summary = self._summarize(summary, turns)
+        except Exception as e:
+            logger.warning("Memory summarization failed (%s); keeping questions only", e)
+            new_summary = _fallback_summary(summary, turns)
+
+        with self._lock:
+            self._compaction = None
+            if epoch != self._epoch:
+                return
+            # Only appends happened meanwhile, so these are still the oldest
+            for i, turn in enumerate(turns):
+                self.index.remove(self.compacted_turns + i,
+                                  f"{turn.question}\n{turn.answer}")
+            del self.turns[:len(turns)]
+            self._verbatim_tokens -= sum(turn.tokens for turn in turns)
+            self._text_chars -= sum(len(t.question) + len(t.answer) for t in turns)
+            self.compacted_turns += len(turns)
+            self.summary = new_summary
+            self._summary_changed()
+            self._maybe_compact()
+
+    def _summarize(self, summary: str, turns: List[Turn]) -> str:
+        from llm_scheduler import llm_priority
+
+        parts = [f"Earlier summary: {summary}"] if summary else []
+        for turn in turns:
+            parts.append(f"User: {turn.question}\nAssistant: {turn.answer}")
+        prompt = COMPACT_PROMPT.format(words=int(MEMORY_SUMMARY_TOKENS * 0.75),
+                                       text="\n\n".join(parts))
+        # Background work: yields to user questions under admission control
+        with llm_priority("batch"):
+            response = _summary_model().invoke([HumanMessage(content=prompt)])
+        # The word limit is only a request; the memory budget relies on it
+        return _clip_tokens(response.content.strip(), MEMORY_SUMMARY_TOKENS)
+
+    # -- persistence hooks (see session_store.StoredMemory) ---------------
+
+    def _turn_added(self, turn_id: int, turn: Turn):
+        """Called (under the lock) for every new turn."""
+
+    def _summary_changed(self):
+        """Called (under the lock) after a compaction updated the summary."""
+
+    def _search_older(self, query: str, before_turn: int, limit: int) -> List[Dict[str, str]]:
+        """Matching Q&A pairs among turns before before_turn that are no
+        longer held in memory (none: they only live on in the summary)."""
+        return []
+
+    # -- size and serialization (see session_manager.py) -----------------
+
+    def approx_bytes(self) -> int:
+        """Rough RAM footprint, kept up to date in O(1)."""
+        return (self._text_chars + len(self.summary) + len(self._question or "")
+                + TURN_OVERHEAD_BYTES * len(self.turns))
+
+    def export_state(self) -> dict:
+        """Plain-data snapshot of the conversation (the index is rebuilt
+        from the turns on import)."""
+        with self._lock:
+            return {
+                "turns": [[t.question, t.answer] for t in self.turns],
+                "question": self._question,
+                "summary": self.summary,
+                "compacted_turns": self.compacted_turns,
+                "token_budget": self.token_budget,
+            }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ConversationMemory":
+        memory = cls(token_budget=state["token_budget"])
+        memory.compacted_turns = state["compacted_turns"]
+        memory.summary = state["summary"]
+        memory._question = state["question"]
+        for i, (question, answer) in enumerate(state["turns"]):
+            memory._append_turn(memory.compacted_turns + i, question, answer)
+        if memory.token_budget:
+            memory._maybe_compact()
+        return memory
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Block until no compaction is running (tests, benchmarks)."""
+        while True:
+            with self._lock:
+                future = self._compaction
+            if future is None:
+                return
+            future.result(timeout=timeout)
+
     def clear(self):
         """Clear all conversation history."""
-        self.messages = []
-        self.conversation_pairs = []
+        with self._lock:
+            self.turns = []
+            self._question = None
+            self.index.clear()
+            self.summary = ""
+            self.compacted_turns = 0
+            self._verbatim_tokens = 0
+            self._text_chars = 0
+            self._compaction = None
+            self._epoch += 1
+
+
+@lru_cache(maxsize=1)
+def _summary_model():
+    """The summarizer LLM, built once and shared by every memory (like
+    agents.get_agent_graph)."""
+    from providers import create_chat_model
+
+    return create_chat_model(MEMORY_SUMMARY_MODEL, 0.0,
+                             max_tokens=MEMORY_SUMMARY_TOKENS * 2)
+
+
+def _clip_tokens(text: str, limit: int) -> str:
+    """The longest whole-word prefix of text within limit tokens."""
+    if count_tokens(text) <= limit:
+        return text
+    words = text.split(" ")
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= limit:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo])
+
+
+def _fallback_summary(summary: str, turns: List[Turn]) -> str:
+    """Summary without an LLM: the earlier summary plus the compacted
+    questions, trimmed from the front to MEMORY_SUMMARY_TOKENS."""
+    text = " ".join([summary] + [f"Asked: {t.question}" for t in turns]).strip()
+    while count_tokens(text) > MEMORY_SUMMARY_TOKENS and " " in text:
+        text = text[len(text) // 4:].split(" ", 1)[-1]
+    return text
 
 
 def create_memory_tool_description() -> str:
@@ -0,0 +1,123 @@
+"""
+Model and storage providers shared by ingestion, retrieval and the agent.
+
+Choosing the chat model, the embedding model and the Chroma directory in one
+place lets every entry point (app, CLI scripts, evaluation, load tests) be
+switched together — e.g. to the offline fakes in fake_providers.py:
+
+    EMBEDDING_MODEL=fake EVAL_AGENT_MODEL=fake-chat python evaluate.py
+
+Configuration (environment):
+    EMBEDDING_MODEL  OpenAI embedding model name, or fake / fake-* for the
+                     offline hashing embedder (default: OpenAIEmbeddings'
+                     default model)
+    CHROMA_DIR       vector DB directory (default: chroma_db in the repo
+                     root). Use a separate one for fake embeddings — their
+                     dimensionality differs from OpenAI's.
+    LLM_CACHE        on-disk chat response cache (see llm_cache.py)
+    LLM_TIMEOUT, LLM_HEDGE, LLM_FALLBACK_MODELS, ...
+                     timeouts, hedging and failover (see resilient_llm.py)
+"""
+
+import os
+
+
+def is_fake(model_name: str) -> bool:
+    """Offline fake providers are selected by a 'fake' name prefix."""
+    return bool(model_name) and model_name.startswith("fake")
+
+
+def is_anthropic(model_name: str) -> bool:
+    """Whether create_chat_model builds a ChatAnthropic for this name."""
+    return not (model_name.startswith("gpt") or is_fake(model_name))
+
+
+def get_persist_dir() -> str:
+    """Absolute Chroma persistence directory (independent of the cwd)."""
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    return os.path.abspath(
+        os.getenv("CHROMA_DIR") or os.path.join(repo_root, "chroma_db")
+    )
+
+
+def get_embeddings():
+    """The embedding model for both ingestion and query time."""
+    model = os.getenv("EMBEDDING_MODEL", "")
+    if is_fake(model):
+        from fake_providers import FakeEmbeddings
+        return FakeEmbeddings()
+
+    from langchain_openai import OpenAIEmbeddings
+    if model:
+        return OpenAIEmbeddings(model=model)
+    return OpenAIEmbeddings()
+
+
+def create_chat_model(model_name: str, temperature: float, max_tokens=None):
+    """
+    Initialize a chat model based on the model provider (name prefix).
+
+    With LLM_CACHE set, the model serves repeated requests from the on-disk
+    response cache (see llm_cache.py). With LLM_HEDGE or
+    LLM_FALLBACK_MODELS set, it is wrapped in a ResilientChatModel that
+    hedges slow requests and fails over to the fallback models (see
+    resilient_llm.py). With LLM_MAX_CONCURRENCY or LLM_TPM_BUDGET set,
+    each request that is not a response cache hit first waits for
+    admission by the process-wide LLM scheduler (see llm_scheduler.py).
+    """
+    from resilient_llm import LLM_FALLBACK_MODELS, LLM_HEDGE, ResilientChatModel
+
+    fallbacks = [m for m in LLM_FALLBACK_MODELS if m != model_name]
+    if not (LLM_HEDGE or fallbacks):
+        return _create_single_model(model_name, temperature, max_tokens)
+    # The wrapper retries on other models; a slow in-client retry loop
+    # would only delay the failover.
+    return ResilientChatModel(models=[
+        _create_single_model(name, temperature, max_tokens, max_retries=0)
+        for name in [model_name] + fallbacks
+    ])
+
+
+def _create_single_model(model_name: str, temperature: float, max_tokens=None,
+                         max_retries: int = 2):
+    from llm_cache import get_response_cache
+    from llm_scheduler import get_scheduler_handler
+    from resilient_llm import LLM_TIMEOUT
+
+    # None leaves LangChain's default (no global cache configured)
+    cache = get_response_cache()
+    # Admission control when LLM_MAX_CONCURRENCY / LLM_TPM_BUDGET is set;
+    # with the response cache, only cache misses are admitted
+    scheduler = get_scheduler_handler(deferred=cache is not None)
+    callbacks = [scheduler] if scheduler else None
+    if is_fake(model_name):
+        from fake_providers import FakeChatModel
+        return FakeChatModel(
+            model_name=model_name, temperature=temperature, max_tokens=max_tokens,
+            cache=cache,
+            callbacks=callbacks,
+        )
+    elif model_name.startswith("gpt"):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens or 2000,
+            cache=cache,
+            callbacks=callbacks,
+            # Token usage also when streaming (server.py)
+            stream_usage=True,
+            timeout=LLM_TIMEOUT,
+            max_retries=max_retries,
+        )
+    # Default to Anthropic
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(
+        model=model_name,
+        temperature=temperature,
+        max_tokens=max_tokens or 4096,
+        cache=cache,
+        callbacks=callbacks,
+        timeout=LLM_TIMEOUT,
+        max_retries=max_retries,
+    )
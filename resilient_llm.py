@@ -0,0 +1,322 @@
+"""
+Resilient chat model: timeouts, hedged requests, failover, circuit breaker.
+
+One slow or rate-limited LLM request used to stall a whole answer (and
+evaluate.py had to sleep through 429s). ResilientChatModel wraps an ordered
+list of chat models — the primary plus LLM_FALLBACK_MODELS, possibly from
+other providers — and for every call:
+
+- gives each attempt at most LLM_TIMEOUT seconds;
+- with LLM_HEDGE on, sends a second (hedged) request when the first has
+  not answered after the model's recent p95 latency (LLM_HEDGE_PERCENTILE),
+  and takes whichever answers first. Tail latency then tracks the typical
+  latency instead of the slowest request, at the price of a few extra
+  requests (at most 1 - pct of them, by construction);
+- on an error or timeout fails over to the next model;
+- skips models whose circuit breaker is open: after LLM_BREAKER_FAILURES
+  consecutive failures a model is not tried for LLM_BREAKER_COOLDOWN
+  seconds, then one trial request decides whether it is healthy again.
+
+metrics() reports, per model, raw attempt latency percentiles next to the
+end-to-end call latency, plus hedges, hedge wins, failovers, timeouts and
+breaker state, which is where the tail reduction shows. bench_llm_resilience.py
+measures it against stub_chat_server.py.
+
+providers.create_chat_model returns this wrapper when LLM_HEDGE is on or
+LLM_FALLBACK_MODELS is set.
+
+Configuration (environment):
+    LLM_TIMEOUT            seconds per attempt (default 60)
+    LLM_HEDGE              1 to send hedged requests (default 0)
+    LLM_HEDGE_PERCENTILE   latency percentile that triggers a hedge (default 95)
+    LLM_HEDGE_MIN_DELAY    lower bound on the hedge delay, seconds (default 0.5)
+    LLM_FALLBACK_MODELS    comma-separated models to fail over to, in order
+    LLM_BREAKER_FAILURES   consecutive failures that open a breaker (default 5)
+    LLM_BREAKER_COOLDOWN   seconds a breaker stays open (default 30)
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import threading
+import time
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManager
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from tracing import percentile, submit_traced
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_FALLBACK_MODELS = [
+    m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()
+]
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Latency samples needed before the hedge delay follows the percentile;
+# until then hedging waits for the full LLM_TIMEOUT / 2.
+MIN_SAMPLES = 20
+WINDOW = 500
+
+# Attempts run here so the caller can wait on several at once. Abandoned
+# attempts (hedge losers, timeouts) finish in the background.
+_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-attempt")
+
+
+class ModelStats:
+    """Per-model latency window, counters and circuit breaker."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.attempt_latencies = deque(maxlen=WINDOW)
+        self.call_latencies = deque(maxlen=WINDOW)
+        self.counters = {"attempts": 0, "errors": 0, "timeouts": 0,
+                         "hedges": 0, "hedge_wins": 0, "failovers": 0,
+                         "breaker_skips": 0}
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._trial_running = False
+
+    def count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def hedge_delay(self, timeout: float) -> float:
+        with self._lock:
+            samples = sorted(self.attempt_latencies)
+        if len(samples) < MIN_SAMPLES:
+            return timeout / 2
+        return max(LLM_HEDGE_MIN_DELAY, percentile(samples, LLM_HEDGE_PERCENTILE))
+
+    def record_call(self, latency: float):
+        """End-to-end latency of a call, hedges and failovers included."""
+        with self._lock:
+            self.call_latencies.append(latency)
+
+    # -- circuit breaker --------------------------------------------------
+
+    def allow(self) -> bool:
+        """Closed: yes. Open: no, until the cooldown ends; then a single
+        trial request is let through (half-open)."""
+        with self._lock:
+            if self.consecutive_failures < LLM_BREAKER_FAILURES:
+                return True
+            if time.time() < self.open_until or self._trial_running:
+                self.counters["breaker_skips"] += 1
+                return False
+            self._trial_running = True
+            return True
+
+    def record(self, latency=None, error=False, timeout: float = LLM_TIMEOUT):
+        """
+        Outcome of a finished attempt — also ones the caller abandoned, so
+        a half-open trial always resolves. An answer slower than the
+        timeout counts as a timeout failure.
+        """
+        with self._lock:
+            if latency is not None:
+                self.attempt_latencies.append(latency)
+            self._trial_running = False
+            if not error and latency <= timeout:
+                self.consecutive_failures = 0
+                return
+            self.counters["errors" if error else "timeouts"] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= LLM_BREAKER_FAILURES:
+                self.open_until = time.time() + LLM_BREAKER_COOLDOWN
+
+    def state(self) -> str:
+        with self._lock:
+            if self.consecutive_failures < LLM_BREAKER_FAILURES:
+                return "closed"
+            return "open" if time.time() < self.open_until else "half-open"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = sorted(self.attempt_latencies)
+            calls = sorted(self.call_latencies)
+            snap = dict(self.counters)
+        for label, values in (("attempt", attempts), ("call", calls)):
+            for pct in (50, 95, 99):
+                snap[f"{label}_p{pct}"] = (
+                    round(percentile(values, pct), 3) if values else None
+                )
+        snap["breaker"] = self.state()
+        return snap
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def stats_for(name: str) -> ModelStats:
+    """Process-wide stats (and breaker) of one model name."""
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = ModelStats(name)
+        return _stats[name]
+
+
+def metrics() -> dict:
+    """Per-model counters, breaker state and attempt vs call latency
+    percentiles (seconds)."""
+    with _stats_lock:
+        models = list(_stats.values())
+    return {m.name: m.snapshot() for m in models}
+
+
+def _model_name(model) -> str:
+    bound = getattr(model, "bound", model)
+    return str(getattr(bound, "model_name", None) or getattr(bound, "model", None)
+               or type(bound).__name__)
+
+
+class ResilientChatModel(BaseChatModel):
+    """Hedging, failover chat model over an ordered list of chat models."""
+
+    models: List[Any]
+    timeout: float = LLM_TIMEOUT
+    hedge: bool = LLM_HEDGE
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": _model_name(self.models[0]),
+                "fallbacks": [_model_name(m) for m in self.models[1:]]}
+
+    @property
+    def model_name(self) -> str:
+        return _model_name(self.models[0])
+
+    def bind_tools(self, tools, **kwargs: Any):
+        """
+        Bind the tools on every underlying model.
+
+        The result is a RunnableBinding carrying the tool schemas, like a
+        provider model's bind_tools returns: LangGraph's create_react_agent
+        rebinds bare tools onto anything else, which would replace the
+        schemas and kwargs (e.g. prompt-caching markers) bound here. The
+        wrapper ignores the outer binding's kwargs; each attempt uses its
+        model's own binding.
+        """
+        bound = []
+        for model in self.models:
+            model_kwargs = dict(kwargs)
+            if "cache_control" in model_kwargs and "anthropic" not in type(model).__module__:
+                # Anthropic prompt-caching marker; other providers reject it
+                model_kwargs.pop("cache_control")
+            bound.append(model.bind_tools(tools, **model_kwargs))
+        schemas = [t if isinstance(t, dict) else convert_to_openai_tool(t)
+                   for t in tools]
+        return self.model_copy(update={"models": bound}).bind(tools=schemas)
+
+    def _attempt(self, model, stats: ModelStats, messages, stop, callbacks):
+        started = time.perf_counter()
+        try:
+            message = model.invoke(messages, stop=stop,
+                                   config={"callbacks": callbacks})
+        except Exception:
+            stats.record(error=True)
+            raise
+        stats.record(time.perf_counter() - started, timeout=self.timeout)
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        callbacks = None
+        if run_manager is not None:
+            # Attempts report as child runs of this call (usage, spans)
+            callbacks = CallbackManager(
+                handlers=run_manager.inheritable_handlers,
+                inheritable_handlers=run_manager.inheritable_handlers,
+                parent_run_id=run_manager.run_id,
+            )
+        started = time.perf_counter()
+        candidates = [(m, stats_for(_model_name(m))) for m in self.models]
+        primary_stats = candidates[0][1]
+
+        pending = {}      # future -> (stats, started_at, is_hedge)
+        next_candidate = 0
+        hedged = False
+        last_error = None
+
+        def launch(is_hedge=False):
+            """Start an attempt on the next model whose breaker allows it
+            (hedges reuse the primary if no other model is available)."""
+            nonlocal next_candidate
+            while next_candidate < len(candidates):
+                model, stats = candidates[next_candidate]
+                next_candidate += 1
+                if stats.allow():
+                    break
+            else:
+                if not is_hedge:
+                    return False
+                model, stats = candidates[0]
+            stats.count("attempts")
+            future = submit_traced(_POOL, self._attempt, model, stats,
+                                   messages, stop, callbacks)
+            pending[future] = (stats, time.perf_counter(), is_hedge)
+            return True
+
+        if not launch():
+            raise RuntimeError("All LLM circuit breakers are open")
+
+        while pending:
+            now = time.perf_counter()
+            oldest = min(t for _, t, _ in pending.values())
+            wait_for = self.timeout - (now - oldest)
+            can_hedge = self.hedge and not hedged
+            if can_hedge:
+                wait_for = min(wait_for, primary_stats.hedge_delay(self.timeout)
+                               - (now - started))
+            done, _ = wait(pending, timeout=max(0.0, wait_for),
+                           return_when=FIRST_COMPLETED)
+
+            if not done:
+                now = time.perf_counter()
+                timed_out = [f for f, (_, t, _) in pending.items()
+                             if now - t >= self.timeout]
+                for future in timed_out:
+                    # Abandoned; the attempt records its outcome when done
+                    stats, _, _ = pending.pop(future)
+                    last_error = TimeoutError(
+                        f"{stats.name} did not answer within {self.timeout:.0f}s"
+                    )
+                if can_hedge and not timed_out:
+                    hedged = True
+                    primary_stats.count("hedges")
+                    launch(is_hedge=True)
+                elif not pending:
+                    if launch():
+                        primary_stats.count("failovers")
+                continue
+
+            for future in done:
+                stats, _, is_hedge = pending.pop(future)
+                try:
+                    message = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if is_hedge:
+                    primary_stats.count("hedge_wins")
+                primary_stats.record_call(time.perf_counter() - started)
+                # Usage is reported by the attempt's own LLM run; clear it
+                # here so callbacks on this wrapper don't count it twice.
+                message = message.model_copy(update={"usage_metadata": None})
+                return ChatResult(generations=[ChatGeneration(message=message)])
+
+            if not pending and launch():
+                primary_stats.count("failovers")
+
+        raise last_error or RuntimeError("LLM request failed")
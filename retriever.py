@@ -6,30 +6,42 @@ The retriever bridges stored knowledge (vector DB) and the LLM.
 """
 
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from typing import List, Tuple
 from langchain_core.documents import Document
+from providers import get_embeddings, get_persist_dir
+from single_flight import group, normalize
+from tracing import span
+from usage import record_embedding
+import threading
+
+_connect_lock = threading.Lock()
+_retrieval_flights = group("retrieve_with_scores")
+_embed_flights = group("embed_query")
+_vector_flights = group("retrieve_by_vector")
 
 
 def get_vectorstore():
     """Get the Chroma vectorstore instance."""
     import os
 
-    # Use absolute repo-root path for consistency with ingestion
-    repo_root = os.path.dirname(os.path.abspath(__file__))
-    persist_dir = os.path.join(repo_root, "chroma_db")
+    # Same absolute path and embedding model as ingestion
+    persist_dir = get_persist_dir()
     if not os.path.exists(persist_dir):
         raise FileNotFoundError(
             "No documents loaded. Please upload a PDF first through the Streamlit interface."
         )
 
-    embeddings = OpenAIEmbeddings()
+    with span("retriever.get_vectorstore"):
+        embeddings = get_embeddings()
 
-    # Use langchain-chroma which handles ChromaDB properly
-    vectorstore = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings,
-    )
+        # Use langchain-chroma which handles ChromaDB properly. Chroma's
+        # shared-client cache isn't thread-safe on first connect, so
+        # concurrent queries would race to create the client.
+        with _connect_lock:
+            vectorstore = Chroma(
+                persist_directory=persist_dir,
+                embedding_function=embeddings,
+            )
 
     return vectorstore
 
@@ -61,15 +73,122 @@ def retrieve_with_scores(
 
     doc_names: optional list of document names to scope the search to.
 
+    Concurrent identical searches (same normalized query, top_k and
+    documents) share one embedding call and search (see single_flight.py).
+
     Returns:
         List of (Document, score) tuples where score is a relevance score
         normalized to [0, 1]. Higher scores mean more similar/relevant.
     """
+    key = _search_key(query, top_k, doc_names)
+    results, _ = _retrieval_flights.do(key, _retrieve_with_scores, query, top_k, doc_names)
+    # Callers may reorder or extend the list; the Documents are shared
+    return list(results)
+
+
+def _search_key(query: str, top_k: int, doc_names) -> tuple:
+    """Single-flight key of a search: normalized query, top_k, documents."""
+    return (normalize(query), top_k, tuple(sorted(doc_names)) if doc_names else None)
+
+
+def _retrieve_with_scores(query, top_k, doc_names):
     vectorstore = get_vectorstore()
-    results = vectorstore.similarity_search_with_relevance_scores(
-        query, k=top_k, filter=_doc_filter(doc_names)
+    # Embedding and search are traced as separate stages; the search itself
+    # is what similarity_search_with_relevance_scores would do with the
+    # vector.
+    embedding = _embed(vectorstore, query)
+    return _search_by_vector(vectorstore, embedding, top_k, doc_names)
+
+
+def _embed(vectorstore, query: str) -> List[float]:
+    with span("retriever.embed_query", chars=len(query)):
+        embedding = vectorstore.embeddings.embed_query(query)
+    record_embedding(getattr(vectorstore.embeddings, "model", "unknown"), [query])
+    return embedding
+
+
+def _search_by_vector(vectorstore, embedding, top_k, doc_names):
+    with span("chroma.similarity_search_with_relevance_scores", k=top_k,
+              doc_filter=",".join(doc_names) if doc_names else None):
+        relevance_fn = vectorstore._select_relevance_score_fn()
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=top_k, filter=_doc_filter(doc_names)
+        )
+        return [(doc, relevance_fn(distance)) for doc, distance in results]
+
+
+def embed_query(query: str) -> List[float]:
+    """Embed a query with the same model the vectorstore searches with.
+    Concurrent calls for the same (normalized) query share one request."""
+    vector, _ = _embed_flights.do(normalize(query), _embed_new, query)
+    return vector
+
+
+def _embed_new(query):
+    return _embed(get_vectorstore(), query)
+
+
+def retrieve_by_vector(
+    embedding: List[float], top_k: int = 5, doc_names=None, query=None
+) -> List[Tuple[Document, float]]:
+    """
+    Like retrieve_with_scores, but for an already-embedded query.
+
+    Lets callers that embedded a query for another purpose (e.g. comparing
+    it with a prefetched question) search without paying for a second
+    embedding call. Scores use the same [0, 1] normalization. Pass the
+    query text the vector was embedded from to share concurrent identical
+    searches like retrieve_with_scores does.
+    """
+    if query is None:
+        return _search_by_vector(get_vectorstore(), embedding, top_k, doc_names)
+    results, _ = _vector_flights.do(
+        _search_key(query, top_k, doc_names), _search_by_vector,
+        get_vectorstore(), embedding, top_k, doc_names,
     )
-    return results
+    return list(results)
+
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed many queries in one embeddings request per provider batch
+    (same model and vectors as embed_query)."""
+    embeddings = get_vectorstore().embeddings
+    with span("retriever.embed_queries", queries=len(queries),
+              chars=sum(len(q) for q in queries)):
+        vectors = embeddings.embed_documents(list(queries))
+    record_embedding(getattr(embeddings, "model", "unknown"), list(queries),
+                     batch_size=getattr(embeddings, "chunk_size", None))
+    return vectors
+
+
+def retrieve_by_vectors(
+    embeddings: List[List[float]], top_k: int = 5, doc_names=None
+) -> List[List[Tuple[Document, float]]]:
+    """
+    retrieve_by_vector for many already-embedded queries in one Chroma
+    query. Returns one result list per embedding, in order, with the same
+    [0, 1] scores.
+    """
+    vectorstore = get_vectorstore()
+    if not embeddings:
+        return []
+    with span("chroma.query_batch", k=top_k, queries=len(embeddings),
+              doc_filter=",".join(doc_names) if doc_names else None):
+        relevance_fn = vectorstore._select_relevance_score_fn()
+        results = vectorstore._collection.query(
+            query_embeddings=list(embeddings), n_results=top_k,
+            where=_doc_filter(doc_names),
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [(Document(page_content=text, metadata=meta or {}, id=doc_id),
+              relevance_fn(distance))
+             for text, meta, doc_id, distance in zip(
+                 results["documents"][i], results["metadatas"][i],
+                 results["ids"][i], results["distances"][i])
+             if text is not None]
+            for i in range(len(embeddings))
+        ]
 
 
 def retrieve_documents_only(
@@ -95,6 +214,38 @@ def _flush_chroma_cache():
         pass
 
 
+def _generation_file():
+    import os
+    return os.path.join(get_persist_dir(), "generation")
+
+
+def db_generation() -> str:
+    """
+    Identifier of the knowledge base's current contents. It changes
+    whenever a document is ingested or deleted (in any process), so caches
+    of answers derived from the DB can tell when they went stale.
+    """
+    try:
+        with open(_generation_file()) as f:
+            return f.read().strip()
+    except OSError:
+        return "0"
+
+
+def bump_db_generation():
+    """Start a new generation after the DB contents changed."""
+    import os
+    import time
+
+    path = _generation_file()
+    try:
+        with open(path + ".tmp", "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
 def list_documents():
     """
     List every document in the persistent knowledge base.
@@ -132,7 +283,11 @@ def list_documents():
 
 
 def delete_document(doc_name: str):
-    """Delete all chunks belonging to one document."""
+    """Delete all chunks (and precomputed summaries) of one document."""
+    from doc_summaries import delete_summary
+
     _flush_chroma_cache()
     collection = get_vectorstore()._collection
     collection.delete(where={"doc_name": doc_name})
+    bump_db_generation()
+    delete_summary(doc_name)
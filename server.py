@@ -0,0 +1,363 @@
+"""
+Headless HTTP API for the agentic RAG system (ASGI, served by uvicorn).
+
+app.py reruns a whole Streamlit script per interaction and keeps state in
+the browser session, so it cannot be load-balanced. This is a plain ASGI
+app over the same AgenticRAG, retriever and ingestion code:
+
+    GET    /health                 liveness, document count, settings,
+                                   coalescing, scheduler and answer-cache
+                                   stats
+    GET    /documents              documents in the knowledge base
+    DELETE /documents/{name}       delete one document
+    POST   /query                  ask a question (JSON, or server-sent
+                                   events with "stream": true or
+                                   Accept: text/event-stream)
+    POST   /ingest?name=<file.pdf> upload a PDF (raw body); returns a job
+    GET    /ingest/{job_id}        ingestion job status
+
+POST /query takes {"question", "session_id"?, "model"?, "temperature"?,
+"top_k"?, "doc_names"?, "stream"?}. A session_id keeps conversation memory
+between requests: in the SQLite session store when SESSION_STORE is set
+(any worker can serve the session), else in this process's SessionManager.
+A streamed answer sends "token" events with the agent's text as the LLM
+produces it, then one "result" event with the same JSON as a plain request.
+
+Worker model: requests are async, and the blocking agent, retrieval and
+ingestion work runs on a thread pool (SERVER_THREADS per process). The work
+is dominated by waiting on LLM and embedding APIs, so one process serves
+many concurrent questions; add processes (--workers) for CPU headroom.
+Ingestion runs one job at a time per process. Job status is kept as files
+next to the vector DB, so any worker can report it.
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8000] [--workers 1]
+    uvicorn server:app --workers 4
+
+Configuration (environment):
+    SERVER_MODEL        default model for /query (default claude-opus-4-6)
+    SERVER_THREADS      threads for blocking work per process (default 32)
+    SERVER_MAX_UPLOAD_MB  largest accepted PDF (default 50)
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, unquote
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from agents import AgenticRAG
+from answer_cache import ANSWER_CACHE, answer_cache
+from doc_summaries import INGEST_SUMMARIES
+from ingestion import ingest_pdf_result, summarize_document
+import llm_scheduler
+from providers import get_persist_dir
+from retriever import delete_document, list_documents
+from session_manager import SessionManager
+from session_store import get_session_store
+import single_flight
+from tracing import submit_traced
+
+SERVER_MODEL = os.getenv("SERVER_MODEL", "claude-opus-4-6")
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "32"))
+SERVER_MAX_UPLOAD_MB = float(os.getenv("SERVER_MAX_UPLOAD_MB", "50"))
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_PING_INTERVAL = 15
+
+_POOL = ThreadPoolExecutor(max_workers=SERVER_THREADS, thread_name_prefix="server")
+# Chroma writes are serialized; one ingestion at a time per process
+_INGEST_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+_session_store = get_session_store()
+_sessions = SessionManager()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _run(fn, *args):
+    """Run blocking work on the thread pool (keeping the trace context)."""
+    return asyncio.wrap_future(submit_traced(_POOL, fn, *args))
+
+
+# -- HTTP plumbing -------------------------------------------------------
+
+
+async def _read_body(receive, limit: int) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "Client disconnected")
+        body += message.get("body", b"")
+        if len(body) > limit:
+            raise HTTPError(413, f"Body larger than {limit // (1024 * 1024)} MB")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def _read_json(receive) -> dict:
+    body = await _read_body(receive, 1024 * 1024)
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return data
+
+
+async def _send_json(send, status: int, data):
+    payload = json.dumps(data, default=str).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(payload)).encode())]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+# -- endpoints -----------------------------------------------------------
+
+
+async def health(scope, receive, send):
+    documents = await _run(list_documents)
+    await _send_json(send, 200, {
+        "status": "ok",
+        "documents": len(documents),
+        "model": SERVER_MODEL,
+        "threads": SERVER_THREADS,
+        "session_store": bool(_session_store),
+        # Calls saved by sharing identical in-flight work
+        "coalescing": single_flight.metrics(),
+        # Admission control of LLM calls ({} unless enabled)
+        "llm_scheduler": llm_scheduler.metrics(),
+        # Near-duplicate questions served from the semantic answer cache
+        # ({} unless ANSWER_CACHE is on)
+        "answer_cache": answer_cache.stats() if ANSWER_CACHE else {},
+    })
+
+
+async def documents(scope, receive, send):
+    await _send_json(send, 200, {"documents": await _run(list_documents)})
+
+
+async def delete(scope, receive, send, name: str):
+    known = {d["name"] for d in await _run(list_documents)}
+    if name not in known:
+        raise HTTPError(404, f"No document named {name!r}")
+    await _run(delete_document, name)
+    await _send_json(send, 200, {"deleted": name})
+
+
+def _agent_for(request: dict) -> AgenticRAG:
+    """A per-request agent (cheap: the LLM and graph are shared) on the
+    session's memory."""
+    agent = AgenticRAG(
+        model_name=request.get("model") or SERVER_MODEL,
+        temperature=float(request.get("temperature", 0.7)),
+        top_k=int(request.get("top_k", 5)),
+        verbose=False,
+        doc_filter=request.get("doc_names") or None,
+    )
+    session_id = request.get("session_id")
+    if session_id:
+        store = _session_store or _sessions
+        agent.memory = store.get(str(session_id))
+    return agent
+
+
+async def query(scope, receive, send):
+    request = await _read_json(receive)
+    question = str(request.get("question") or "").strip()
+    if not question:
+        raise HTTPError(400, "'question' is required")
+    try:
+        agent = await _run(_agent_for, request)
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, f"Invalid settings: {e}")
+
+    accept = dict(scope["headers"]).get(b"accept", b"")
+    if not (request.get("stream") or b"text/event-stream" in accept):
+        result = await _run(agent.query, question)
+        await _send_json(send, 500 if "error" in result else 200, result)
+        return
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_token(text):
+        loop.call_soon_threadsafe(events.put_nowait, ("token", {"text": text}))
+
+    def answer():
+        try:
+            result = agent.query(question, on_token=on_token)
+            item = ("error", result) if "error" in result else ("result", result)
+        except Exception as e:
+            item = ("error", {"error": str(e)})
+        loop.call_soon_threadsafe(events.put_nowait, item)
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"),
+                            (b"cache-control", b"no-cache"),
+                            (b"x-accel-buffering", b"no")]})
+    submit_traced(_POOL, answer)
+    while True:
+        try:
+            event, data = await asyncio.wait_for(events.get(), SSE_PING_INTERVAL)
+        except asyncio.TimeoutError:
+            await send({"type": "http.response.body", "body": b": ping\n\n",
+                        "more_body": True})
+            continue
+        done = event != "token"
+        await send({"type": "http.response.body", "body": _sse(event, data),
+                    "more_body": not done})
+        if done:
+            return
+
+
+# -- ingestion jobs ------------------------------------------------------
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(get_persist_dir(), "jobs", f"{job_id}.json")
+
+
+def _save_job(job: dict):
+    path = _job_path(job["id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(job, f, default=str)
+    os.replace(tmp, path)
+
+
+def _ingest_job(job: dict, pdf_path: str):
+    job.update(status="running", started_at=time.time())
+    _save_job(job)
+    try:
+        job["result"] = ingest_pdf_result(pdf_path, job["doc_name"])
+        job["status"] = "done"
+        if INGEST_SUMMARIES:
+            job["status"] = "summarizing"
+            _save_job(job)
+            try:
+                job["summaries"] = summarize_document(job["doc_name"])
+            except Exception as e:
+                # The document is searchable; only the summaries are missing
+                job["summaries"] = f"Summaries failed: {e}"
+            job["status"] = "done"
+    except Exception as e:
+        job.update(status="failed", error=str(e))
+    finally:
+        os.remove(pdf_path)
+        job["finished_at"] = time.time()
+        _save_job(job)
+
+
+async def ingest(scope, receive, send):
+    params = parse_qs(scope.get("query_string", b"").decode())
+    name = (params.get("name") or [""])[0].strip()
+    if not name.lower().endswith(".pdf"):
+        raise HTTPError(400, "Pass the file name as ?name=<file>.pdf")
+    body = await _read_body(receive, int(SERVER_MAX_UPLOAD_MB * 1024 * 1024))
+    if not body.startswith(b"%PDF"):
+        raise HTTPError(400, "Body is not a PDF")
+
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(body)
+    job = {"id": uuid.uuid4().hex, "doc_name": name, "status": "queued",
+           "submitted_at": time.time()}
+    _save_job(job)
+    _INGEST_POOL.submit(_ingest_job, job, pdf_path)
+    await _send_json(send, 202, {"job_id": job["id"],
+                                 "status_url": f"/ingest/{job['id']}"})
+
+
+async def ingest_status(scope, receive, send, job_id: str):
+    try:
+        with open(_job_path(os.path.basename(job_id))) as f:
+            job = json.load(f)
+    except FileNotFoundError:
+        raise HTTPError(404, f"No ingestion job {job_id!r}")
+    await _send_json(send, 200, job)
+
+
+# -- routing -------------------------------------------------------------
+
+_ROUTES = {
+    ("GET", "/health"): health,
+    ("GET", "/documents"): documents,
+    ("POST", "/query"): query,
+    ("POST", "/ingest"): ingest,
+}
+_PREFIX_ROUTES = {
+    ("DELETE", "/documents/"): delete,
+    ("GET", "/ingest/"): ingest_status,
+}
+
+
+def _route(method: str, path: str):
+    """(handler, extra args) for a request; raises 404/405."""
+    path = path.rstrip("/") or "/"
+    handler = _ROUTES.get((method, path))
+    if handler:
+        return handler, ()
+    for (route_method, prefix), handler in _PREFIX_ROUTES.items():
+        if path.startswith(prefix) and method == route_method:
+            return handler, (unquote(path[len(prefix):]),)
+    known = [m for m, p in _ROUTES if p == path]
+    known += [m for m, p in _PREFIX_ROUTES if path.startswith(p)]
+    if known:
+        raise HTTPError(405, f"Use {' or '.join(sorted(known))} for {path}")
+    raise HTTPError(404, f"Not found: {path}")
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    try:
+        handler, args = _route(scope["method"], scope["path"])
+        await handler(scope, receive, send, *args)
+    except HTTPError as e:
+        await _send_json(send, e.status, {"error": e.message})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes; each runs SERVER_THREADS threads")
+    args = parser.parse_args()
+
+    uvicorn.run("server:app", host=args.host, port=args.port,
+                workers=args.workers)
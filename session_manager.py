@@ -0,0 +1,253 @@
+"""
+Multi-session conversation memory with a global RAM cap.
+
+A server hosting many users keeps one ConversationMemory per session, and
+nothing bounded their total size. SessionManager hands out memories by
+session ID and tracks each one's approximate size
+(ConversationMemory.approx_bytes). When the sessions in memory add up to
+more than SESSION_MEMORY_LIMIT_MB, the least recently used ones are written
+to SESSION_SPILL_DIR as zstd-compressed msgpack and dropped. The next get()
+of an evicted session reads it back, so callers never see the difference.
+
+A memory that is still referenced elsewhere when it is evicted (a request
+in flight) is picked up again from that live object rather than the disk
+copy, and every turn or summary it gains while evicted rewrites its spill
+file, so nothing added meanwhile is lost once the request lets go of it.
+
+Sessions belong to one process, so each process spills into its own
+subdirectory of SESSION_SPILL_DIR (named after its PID): server workers
+sharing the directory cannot load or delete each other's files for the
+same session ID. Subdirectories of processes that are no longer running
+are removed at startup.
+
+Configuration (environment):
+    SESSION_MEMORY_LIMIT_MB  RAM cap for in-memory sessions (default 256)
+    SESSION_SPILL_DIR        directory for evicted sessions
+                             (default session_spill/ in the repo root)
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import shutil
+import threading
+import weakref
+
+import ormsgpack
+import zstandard
+
+from memory import ConversationMemory
+
+SESSION_MEMORY_LIMIT_MB = float(os.getenv("SESSION_MEMORY_LIMIT_MB", "256"))
+SESSION_SPILL_DIR = os.getenv(
+    "SESSION_SPILL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "session_spill"),
+)
+
+# Bumped if the on-disk layout changes; older files are ignored
+FORMAT_VERSION = 1
+
+
+def _pid_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove_dead_spill_dirs(root: str):
+    """Delete the per-process spill directories of exited processes."""
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir() and entry.name.isdigit() and not _pid_running(int(entry.name)):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class _ManagedMemory(ConversationMemory):
+    """A session's memory that marks itself changed for its manager when
+    a turn is added or a compaction shrinks it. The manager re-reads only
+    those sizes; no manager lock is taken under the memory's lock.
+
+    While evicted (_spilled_to is its manager) a change rewrites the spill
+    file instead, under the memory's lock, which also orders it against
+    the eviction's own write and the file's removal on revival."""
+
+    _session_id = None
+    _changed = None
+    _spilled_to = None
+
+    def _attach(self, session_id: str, changed: set):
+        self._session_id = session_id
+        self._changed = changed
+        # A compaction may have finished before attaching
+        changed.add(session_id)
+        return self
+
+    def _mark_changed(self):
+        if self._spilled_to is not None:
+            self._spilled_to._write_spill(self._session_id, self)
+        elif self._changed is not None:
+            self._changed.add(self._session_id)
+
+    def _turn_added(self, turn_id, turn):
+        self._mark_changed()
+
+    def _summary_changed(self):
+        self._mark_changed()
+
+
+class SessionManager:
+    """ConversationMemory per session ID, LRU-evicted to disk over a cap."""
+
+    def __init__(self, memory_limit_mb: float = SESSION_MEMORY_LIMIT_MB,
+                 spill_dir: str = None, token_budget=None):
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        if spill_dir is None:
+            _remove_dead_spill_dirs(SESSION_SPILL_DIR)
+            spill_dir = os.path.join(SESSION_SPILL_DIR, str(os.getpid()))
+        self.spill_dir = spill_dir
+        self.token_budget = token_budget
+        os.makedirs(spill_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._hot = OrderedDict()                  # session_id -> memory
+        # Size of each hot memory when last seen, and their running total;
+        # memories add their session ID to _changed when they grow
+        self._sizes = {}
+        self._hot_bytes = 0
+        self._changed = set()
+        self._evicted = weakref.WeakValueDictionary()
+        self._decompressor = zstandard.ZstdDecompressor()
+        self.evictions = 0
+        self.rehydrations = 0
+        self.revived = 0
+
+    def _path(self, session_id: str) -> str:
+        digest = hashlib.sha256(session_id.encode()).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{digest}.msgpack.zst")
+
+    def get(self, session_id: str) -> ConversationMemory:
+        """The session's memory, rehydrated from disk if it was evicted
+        (a new, empty memory for an unknown session)."""
+        with self._lock:
+            memory = self._hot.get(session_id)
+            if memory is not None:
+                self._hot.move_to_end(session_id)
+            else:
+                memory = self._evicted.pop(session_id, None)
+                if memory is not None:
+                    self.revived += 1
+                    self._unspill(session_id, memory)
+                else:
+                    memory = self._rehydrate(session_id)
+                self._hot[session_id] = memory
+            self._refresh_size(session_id)
+            while self._changed:
+                changed = self._changed.pop()
+                if changed in self._hot:
+                    self._refresh_size(changed)
+            self._enforce_limit(keep=session_id)
+            return memory
+
+    def _refresh_size(self, session_id: str) -> int:
+        """Re-read one hot memory's size (O(1)) into the running total."""
+        size = self._hot[session_id].approx_bytes()
+        self._hot_bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+        return size
+
+    def _rehydrate(self, session_id: str) -> ConversationMemory:
+        path = self._path(session_id)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return self._new_memory(session_id)
+        state = ormsgpack.unpackb(self._decompressor.decompress(blob))
+        os.remove(path)
+        if state.get("version") != FORMAT_VERSION or state.get("session_id") != session_id:
+            return self._new_memory(session_id)
+        self.rehydrations += 1
+        return _ManagedMemory.from_state(state["memory"])._attach(
+            session_id, self._changed)
+
+    def _new_memory(self, session_id: str) -> ConversationMemory:
+        return _ManagedMemory(token_budget=self.token_budget)._attach(
+            session_id, self._changed)
+
+    def _enforce_limit(self, keep: str):
+        """Evict least recently used sessions until under the cap, going
+        by the running total."""
+        if self._hot_bytes <= self.memory_limit:
+            return
+        for session_id in list(self._hot):
+            if self._hot_bytes <= self.memory_limit:
+                break
+            if session_id == keep or self._hot[session_id]._compaction is not None:
+                continue
+            self._evict(session_id)
+
+    def _evict(self, session_id: str):
+        memory = self._hot.pop(session_id)
+        self._hot_bytes -= self._sizes.pop(session_id)
+        with memory._lock:
+            memory._spilled_to = self
+            self._write_spill(session_id, memory)
+        self._evicted[session_id] = memory
+        self.evictions += 1
+
+    def _write_spill(self, session_id: str, memory: ConversationMemory):
+        """Write the memory's spill file (called under its lock)."""
+        state = {"version": FORMAT_VERSION, "session_id": session_id,
+                 "memory": memory.export_state()}
+        # zstd compressors are not thread-safe; hooks write from any thread
+        blob = zstandard.ZstdCompressor(level=3).compress(ormsgpack.packb(state))
+        path = self._path(session_id)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def _unspill(self, session_id: str, memory: ConversationMemory):
+        """Take a live evicted memory back; its spill file goes."""
+        with memory._lock:
+            memory._spilled_to = None
+            self._discard_file(session_id)
+
+    def _discard_file(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, session_id: str):
+        """Forget a session, in memory and on disk."""
+        with self._lock:
+            if self._hot.pop(session_id, None) is not None:
+                self._hot_bytes -= self._sizes.pop(session_id)
+            memory = self._evicted.pop(session_id, None)
+            if memory is not None:
+                self._unspill(session_id, memory)
+            else:
+                self._discard_file(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hot_bytes = sum(m.approx_bytes() for m in self._hot.values())
+            spilled = [e for e in os.scandir(self.spill_dir)
+                       if e.name.endswith(".msgpack.zst")]
+            return {
+                "hot_sessions": len(self._hot),
+                "hot_bytes": hot_bytes,
+                "limit_bytes": self.memory_limit,
+                "spilled_sessions": len(spilled),
+                "spilled_bytes": sum(e.stat().st_size for e in spilled),
+                "evictions": self.evictions,
+                "rehydrations": self.rehydrations,
+                "revived": self.revived,
+            }
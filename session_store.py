@@ -0,0 +1,336 @@
+"""
+Persistent conversation sessions in SQLite (opt-in).
+
+Conversation memory used to live only in Streamlit's session_state: lost on
+restart, and tied to the one worker process that served the session. The
+session store keeps every Q&A turn (and the rolling summary of a bounded
+memory, see memory.py) in a WAL-mode SQLite file keyed by session ID, so
+any worker pointed at the same file can resume any session.
+
+- Appends are queued and written in batches by a background thread, one
+  transaction per batch, instead of a commit per turn. Turn numbers are
+  assigned inside that transaction, so workers appending to the same
+  session at once never overwrite each other's turns.
+- Resuming a session loads only its metadata and the last
+  SESSION_RECENT_TURNS turns. Older turns stay on disk; the memory tool
+  still finds them through an FTS5 index over the stored turns.
+- The most recently used sessions stay in memory (SESSION_CACHE_SIZE).
+  A cached session is reloaded if another worker has added turns to it.
+
+Configuration (environment):
+    SESSION_STORE           unset/0 = off (default); 1 = sessions.sqlite in
+                            the repo root; anything else = path of the file
+    SESSION_RECENT_TURNS    turns loaded when a session resumes (default 20)
+    SESSION_CACHE_SIZE      sessions kept in memory (default 256)
+    SESSION_FLUSH_INTERVAL  max seconds an append waits to be written (default 0.5)
+"""
+
+import atexit
+from collections import OrderedDict
+from functools import lru_cache
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from memory import ConversationMemory, Turn, tokenize
+
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "20"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "256"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+
+# Queued appends that trigger a write before the interval is up
+BATCH_SIZE = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    turns INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    turn INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    at REAL,
+    UNIQUE (session_id, turn)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    question, answer, content='turns', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS turns_ai AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, question, answer)
+    VALUES (new.id, new.question, new.answer);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_ad AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, question, answer)
+    VALUES ('delete', old.id, old.question, old.answer);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_au AFTER UPDATE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, question, answer)
+    VALUES ('delete', old.id, old.question, old.answer);
+    INSERT INTO turns_fts (rowid, question, answer)
+    VALUES (new.id, new.question, new.answer);
+END;
+"""
+
+
+class StoredMemory(ConversationMemory):
+    """ConversationMemory that writes its turns through to a SessionStore."""
+
+    def __init__(self, store: "SessionStore", session_id: str, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.session_id = session_id
+
+    def _turn_added(self, turn_id: int, turn: Turn):
+        # The store numbers it: another worker may have appended meanwhile
+        # (get() then reloads this copy)
+        self.store.append(self.session_id, turn.question, turn.answer)
+
+    def _summary_changed(self):
+        self.store.save_summary(self.session_id, self.summary)
+
+    def _search_older(self, query, before_turn, limit):
+        return self.store.search(self.session_id, query, before_turn, limit)
+
+    def clear(self):
+        super().clear()
+        self.store.delete(self.session_id)
+
+
+class SessionStore:
+    """SQLite session store with batched writes and an LRU of hot sessions."""
+
+    def __init__(self, path: str, recent_turns: int = SESSION_RECENT_TURNS,
+                 cache_size: int = SESSION_CACHE_SIZE,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.path = path
+        self.recent_turns = recent_turns
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()          # session_id -> StoredMemory
+        self._pending = []                 # queued writes, in order
+        self._wake = threading.Condition()
+        self._write_lock = threading.Lock()
+        self.loads = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.rows_written = 0
+        conn = self._connect()
+        # Files from before turns_au may hold FTS rows of replaced turns
+        stale_fts = conn.execute(
+            "SELECT count(*) = 1 FROM sqlite_master"
+            " WHERE name IN ('turns', 'turns_au')"
+        ).fetchone()[0]
+        conn.executescript(_SCHEMA)
+        if stale_fts:
+            with conn:
+                conn.execute("INSERT INTO turns_fts (turns_fts) VALUES ('rebuild')")
+        threading.Thread(target=self._flush_loop, daemon=True,
+                         name="session-flush").start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        # One connection per thread (sqlite3 objects are thread-bound)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -- sessions ---------------------------------------------------------
+
+    def get(self, session_id: str) -> StoredMemory:
+        """The session's memory: from the hot cache if it is current,
+        otherwise loaded from disk (a new, empty session if unknown)."""
+        with self._lock:
+            memory = self._hot.get(session_id)
+            if memory is not None:
+                self._hot.move_to_end(session_id)
+        if memory is not None:
+            stored = self._stored_turns(session_id)
+            if stored != memory.turn_count:
+                # Maybe just our queued turns; otherwise another worker
+                # changed the session since this copy was loaded
+                self.flush()
+                stored = self._stored_turns(session_id)
+            if stored == memory.turn_count:
+                with self._lock:
+                    self.cache_hits += 1
+                return memory
+
+        memory = self._load(session_id)
+        with self._lock:
+            self._hot[session_id] = memory
+            self._hot.move_to_end(session_id)
+            while len(self._hot) > self.cache_size:
+                # Everything is on disk (or queued); just forget it
+                self._hot.popitem(last=False)
+        return memory
+
+    def _stored_turns(self, session_id: str) -> int:
+        row = self._connect().execute(
+            "SELECT turns FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _load(self, session_id: str) -> StoredMemory:
+        # Queued turns of this session must be readable first
+        self.flush()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT turns, summary FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        turns, summary = row if row else (0, "")
+        recent = conn.execute(
+            "SELECT turn, question, answer FROM turns WHERE session_id = ?"
+            " ORDER BY turn DESC LIMIT ?",
+            (session_id, self.recent_turns),
+        ).fetchall()
+        recent.reverse()
+
+        memory = StoredMemory(self, session_id)
+        with memory._lock:
+            memory.compacted_turns = recent[0][0] if recent else turns
+            memory.summary = summary
+            for turn, question, answer in recent:
+                memory._append_turn(turn, question, answer)
+            if memory.token_budget:
+                memory._maybe_compact()
+        with self._lock:
+            self.loads += 1
+        return memory
+
+    def search(self, session_id: str, query: str, before_turn: int,
+               limit: int = 3) -> List[Dict[str, str]]:
+        """Best FTS matches among the session's turns before before_turn."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self.flush()
+        match = " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+        rows = self._connect().execute(
+            "SELECT t.question, t.answer FROM turns_fts"
+            " JOIN turns t ON t.id = turns_fts.rowid"
+            " WHERE turns_fts MATCH ? AND t.session_id = ? AND t.turn < ?"
+            " ORDER BY bm25(turns_fts) LIMIT ?",
+            (match, session_id, before_turn, limit),
+        ).fetchall()
+        return [{"question": q, "answer": a} for q, a in rows]
+
+    def delete(self, session_id: str):
+        """Forget a session, including its queued writes."""
+        with self._lock:
+            self._hot.pop(session_id, None)
+        with self._write_lock:
+            with self._wake:
+                self._pending = [op for op in self._pending if op[1] != session_id]
+            with self._connect() as conn:
+                conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    # -- batched writes ---------------------------------------------------
+
+    def append(self, session_id: str, question: str, answer: str):
+        """Queue a turn; written within flush_interval seconds as the
+        session's next turn."""
+        self._enqueue(("turn", session_id, question, answer, time.time()))
+
+    def save_summary(self, session_id: str, summary: str):
+        self._enqueue(("summary", session_id, summary, time.time()))
+
+    def _enqueue(self, op):
+        with self._wake:
+            self._pending.append(op)
+            if len(self._pending) >= BATCH_SIZE:
+                self._wake.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self._wake:
+                self._wake.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write all queued appends in one transaction. A turn is numbered
+        by bumping the session's turn count first, which also takes the
+        database write lock, so concurrent writers number turns in turn."""
+        with self._write_lock:
+            with self._wake:
+                ops, self._pending = self._pending, []
+            if not ops:
+                return
+            with self._connect() as conn:
+                for op in ops:
+                    if op[0] == "turn":
+                        _, session_id, question, answer, at = op
+                        conn.execute(
+                            "INSERT INTO sessions (session_id, turns, updated_at)"
+                            " VALUES (?, 1, ?) ON CONFLICT (session_id) DO UPDATE"
+                            " SET turns = turns + 1,"
+                            " updated_at = excluded.updated_at",
+                            (session_id, at),
+                        )
+                        turn = conn.execute(
+                            "SELECT turns - 1 FROM sessions WHERE session_id = ?",
+                            (session_id,),
+                        ).fetchone()[0]
+                        # An update (not REPLACE, which skips the delete
+                        # trigger) keeps turns_fts in step via turns_au
+                        conn.execute(
+                            "INSERT INTO turns (session_id, turn, question, answer, at)"
+                            " VALUES (?, ?, ?, ?, ?) ON CONFLICT (session_id, turn)"
+                            " DO UPDATE SET question = excluded.question,"
+                            " answer = excluded.answer, at = excluded.at",
+                            (session_id, turn, question, answer, at),
+                        )
+                    else:
+                        _, session_id, summary, at = op
+                        conn.execute(
+                            "INSERT INTO sessions (session_id, summary, updated_at)"
+                            " VALUES (?, ?, ?) ON CONFLICT (session_id) DO UPDATE"
+                            " SET summary = excluded.summary,"
+                            " updated_at = excluded.updated_at",
+                            (session_id, summary, at),
+                        )
+            self.batches += 1
+            self.rows_written += len(ops)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hot_sessions": len(self._hot), "loads": self.loads,
+                    "cache_hits": self.cache_hits, "batches": self.batches,
+                    "rows_written": self.rows_written,
+                    "pending": len(self._pending)}
+
+
+def store_path():
+    """The configured session database, or None when the store is off."""
+    setting = os.getenv("SESSION_STORE", "").strip()
+    if setting.lower() in ("", "0", "false", "no", "none"):
+        return None
+    if setting.lower() in ("1", "true", "yes"):
+        repo_root = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(repo_root, "sessions.sqlite")
+    return os.path.abspath(setting)
+
+
+@lru_cache(maxsize=None)
+def _open(path: str) -> SessionStore:
+    return SessionStore(path)
+
+
+def get_session_store():
+    """The shared SessionStore for SESSION_STORE, or None if disabled."""
+    path = store_path()
+    return _open(path) if path else None
@@ -0,0 +1,109 @@
+"""
+Single-flight request coalescing.
+
+When several users ask the same popular question at the same moment, each
+request used to run its own retrieval and LLM calls. A SingleFlight group
+lets the first caller for a key (the leader) do the work while concurrent
+callers with the same key wait for it and share the result. Nothing is
+cached: once the leader finishes, the next call runs again.
+
+Groups in use:
+    agent.query            AgenticRAG.query without conversation context
+    retrieve_with_scores   retriever searches (embedding + vector search)
+    embed_query            query embeddings (the agent's prefetch and
+                           rewritten-query paths)
+    retrieve_by_vector     searches of an embedded query, keyed on its text
+
+metrics() reports, per group, how many calls ran and how many were served
+by another caller's in-flight call (i.e. calls saved).
+"""
+
+import threading
+
+
+def normalize(text: str) -> str:
+    """Case- and whitespace-insensitive form of a question for keys."""
+    return " ".join(text.lower().split())
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs), shared with concurrent callers of the same key.
+
+        Returns (result, leader): leader is False when the result came from
+        another caller's call — it is the same object, so copy it before
+        mutating. The leader's exception is raised in every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, True
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {"executions": self.executions, "coalesced": self.coalesced,
+                    "saved_rate": self.coalesced / total if total else 0.0,
+                    "in_flight": len(self._calls)}
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def group(name: str) -> SingleFlight:
+    """The process-wide SingleFlight group of this name."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def metrics() -> dict:
+    """Executions, coalesced (saved) calls and in-flight keys per group."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {g.name: g.stats() for g in groups}
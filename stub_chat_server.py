@@ -0,0 +1,115 @@
+"""
+Local stub of the OpenAI chat completions API, for testing timeouts,
+hedging, failover and circuit breaking (resilient_llm.py) without API calls.
+
+Every request sleeps a base latency; a fraction of requests (--tail-prob)
+sleeps the much longer --tail-ms instead, and --error-rate of them fail
+with HTTP 429. Answers are a fixed text with token usage, so the agent's
+bookkeeping keeps working.
+
+Usage:
+    python stub_chat_server.py --port 8765 --latency-ms 200 --tail-ms 3000 --tail-prob 0.05
+
+Point ChatOpenAI at it (any gpt-* model name works):
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub \\
+    python loadtest.py --model gpt-4o-mini
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+import uuid
+
+
+class StubConfig:
+    def __init__(self, latency_ms=200.0, tail_ms=3000.0, tail_prob=0.05,
+                 error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.tail_ms = tail_ms
+        self.tail_prob = tail_prob
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        """(delay seconds, fail with 429?) for the next request."""
+        with self._lock:
+            self.requests += 1
+            slow = self._random.random() < self.tail_prob
+            fail = self._random.random() < self.error_rate
+        return (self.tail_ms if slow else self.latency_ms) / 1000, fail
+
+
+def _handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            delay, fail = config.draw()
+            time.sleep(delay)
+            if fail:
+                self._send(429, {"error": {"message": "Rate limit reached (stub)",
+                                           "type": "rate_limit_error"}})
+                return
+            prompt_chars = sum(len(str(m.get("content", "")))
+                               for m in request.get("messages", []))
+            content = "Stub answer from the documents."
+            self._send(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_chars // 4,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": prompt_chars // 4 + len(content) // 4,
+                },
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=8765, config=None):
+    """Start the stub on a background thread; returns the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI chat server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tail-ms", type=float, default=3000)
+    parser.add_argument("--tail-prob", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(args.port, StubConfig(args.latency_ms, args.tail_ms,
+                                         args.tail_prob, args.error_rate))
+    print(f"Stub chat server on http://127.0.0.1:{args.port}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,155 @@
+"""
+Map-reduce summarization for the agent's summarizer tool.
+
+Long input is split into token-sized segments, the segments are summarized
+concurrently in one llm.batch (bounded by SUMMARY_MAX_CONCURRENCY), and the
+partial summaries are reduced into a final summary — recursively, if they
+are still too long for one prompt. Nothing is dropped, unlike truncating the
+input to fit a single call.
+
+Segment (and reduce) summaries are cached in memory by content hash and
+model, so summarizing the same document sections again costs no LLM calls.
+
+Configuration (environment):
+    SUMMARY_SEGMENT_TOKENS    max tokens per segment / reduce prompt (default 1500)
+    SUMMARY_MAX_CONCURRENCY   parallel segment summaries (default 4)
+    SUMMARY_CACHE_SIZE        cached summaries kept (default 1024)
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from langchain_core.messages import HumanMessage
+
+from context_packer import count_tokens
+from tracing import span
+
+SUMMARY_SEGMENT_TOKENS = int(os.getenv("SUMMARY_SEGMENT_TOKENS", "1500"))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+
+MAP_PROMPT = """Summarize the following text concisely in 2-3 sentences:
+
+{text}
+
+Summary:"""
+
+REDUCE_PROMPT = """Summarize the following partial summaries of one text into a single concise summary of 2-3 sentences:
+
+{text}
+
+Summary:"""
+
+
+class SummaryCache:
+    """Thread-safe LRU of summaries keyed by (model, prompt, text) hash."""
+
+    def __init__(self, max_size: int = SUMMARY_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, prompt: str, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, prompt, text):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            summary = self._items.get(key)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return summary
+
+    def put(self, key: str, summary: str):
+        with self._lock:
+            self._items[key] = summary
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+# Shared by every agent: identical sections hash to the same entry
+_cache = SummaryCache()
+
+
+def _model_name(llm) -> str:
+    return str(getattr(llm, "model", None) or getattr(llm, "model_name", None)
+               or type(llm).__name__)
+
+
+def split_segments(text: str, segment_tokens: int = SUMMARY_SEGMENT_TOKENS):
+    """Split text into segments of at most ~segment_tokens tokens."""
+    if count_tokens(text) <= segment_tokens:
+        return [text]
+    # ingestion resolves the splitter's import path across langchain versions
+    from ingestion import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=segment_tokens,
+        chunk_overlap=0,
+        length_function=count_tokens,
+    )
+    return splitter.split_text(text)
+
+
+def _summarize_all(llm, prompt: str, texts, max_concurrency: int, callbacks=None):
+    """Summarize each text with `prompt`; cache hits skip the LLM, misses
+    go out together in one bounded-concurrency batch."""
+    model = _model_name(llm)
+    keys = [SummaryCache.key(model, prompt, t) for t in texts]
+    summaries = [_cache.get(k) for k in keys]
+    missing = [i for i, s in enumerate(summaries) if s is None]
+    if missing:
+        responses = llm.batch(
+            [[HumanMessage(content=prompt.format(text=texts[i]))] for i in missing],
+            config={"max_concurrency": max_concurrency, "callbacks": callbacks},
+        )
+        for i, response in zip(missing, responses):
+            summaries[i] = response.content.strip()
+            _cache.put(keys[i], summaries[i])
+    return summaries
+
+
+def summarize(llm, text: str, segment_tokens: int = SUMMARY_SEGMENT_TOKENS,
+              max_concurrency: int = SUMMARY_MAX_CONCURRENCY,
+              prompt: str = MAP_PROMPT, callbacks=None) -> str:
+    """
+    Map-reduce summary of arbitrarily long text.
+
+    `prompt` is used for the map step (e.g. REDUCE_PROMPT when the text is
+    already a list of summaries); `callbacks` are passed to the LLM calls
+    (e.g. a UsageCallbackHandler outside an agent run).
+    """
+    text = text.strip()
+    if not text:
+        return ""
+    with span("summarizer.summarize", tokens=count_tokens(text)) as current:
+        segments = split_segments(text, segment_tokens)
+        current.set_attribute("segments", len(segments))
+        summaries = _summarize_all(llm, prompt, segments, max_concurrency,
+                                   callbacks)
+        # Reduce until the partial summaries fit in one prompt
+        while len(summaries) > 1:
+            groups = split_segments("\n\n".join(summaries), segment_tokens)
+            if len(groups) >= len(summaries):
+                # Summaries too long to shrink by grouping: reduce in one go
+                groups = ["\n\n".join(summaries)]
+            summaries = _summarize_all(llm, REDUCE_PROMPT, groups, max_concurrency,
+                                       callbacks)
+        return summaries[0]
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters of the shared segment-summary cache."""
+    return {"hits": _cache.hits, "misses": _cache.misses,
+            "size": len(_cache._items)}
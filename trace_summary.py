@@ -0,0 +1,64 @@
+"""
+Summarize per-stage latency from the JSONL traces written by tracing.py.
+
+Prints count, mean and p50/p95/p99/max duration for every span name
+(agent.query, llm.call, tool.document_retriever, retriever.embed_query,
+chroma.similarity_search_with_relevance_scores, ingest.*, ...).
+
+Usage:
+    python trace_summary.py                 # traces.jsonl in the repo root
+    python trace_summary.py path/to/traces.jsonl [--last 500]
+"""
+
+import argparse
+import json
+from collections import defaultdict
+
+from tracing import TRACE_FILE, percentile
+
+
+def load_spans(path, last=None):
+    with open(path) as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+    return spans[-last:] if last else spans
+
+
+def summarize(spans):
+    """Map span name -> stats dict (count, mean, p50, p95, p99, max in ms)."""
+    durations = defaultdict(list)
+    for s in spans:
+        durations[s["name"]].append(s["duration_ms"])
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        }
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency summary")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--last", type=int, default=None,
+                        help="only the most recent N spans")
+    args = parser.parse_args()
+
+    stats = summarize(load_spans(args.path, args.last))
+    if not stats:
+        print(f"No spans in {args.path}")
+        raise SystemExit(0)
+
+    print("=" * 94)
+    print(f"PER-STAGE LATENCY (ms) — {args.path}")
+    print("=" * 94)
+    print(f"  {'stage':<46}{'n':>6}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    # Slowest stages first: that's where to look
+    for name, st in sorted(stats.items(), key=lambda kv: -kv[1]["p95"]):
+        print(f"  {name:<46}{st['count']:>6}{st['mean']:>8.1f}"
+              f"{st['p50']:>8.1f}{st['p95']:>8.1f}{st['p99']:>8.1f}{st['max']:>8.1f}")
@@ -0,0 +1,209 @@
+"""
+Per-stage latency tracing with OpenTelemetry.
+
+Spans cover vectorstore setup, embedding, Chroma search, each LLM step and
+tool call of the agent, and each ingestion stage, so a slow query can be
+pinned on a stage. Exported spans go to a local JSONL file by default,
+rotated like the usage ledger so long-running processes don't grow it
+without bound; trace_summary.py turns that file into per-stage latency
+percentiles.
+
+Configuration (environment):
+    TRACE_EXPORTER        jsonl (default) | console | otlp | none
+    TRACE_FILE            JSONL path (default: traces.jsonl in the repo root)
+    TRACE_FILE_MAX_BYTES  rotate to <path>.1 beyond this size (default 20MB)
+"""
+
+from contextlib import contextmanager
+from contextvars import copy_context
+import json
+import math
+import os
+import threading
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult,
+)
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl").lower()
+TRACE_FILE = os.getenv(
+    "TRACE_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"),
+)
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list (0.0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Append finished spans to a JSONL file, one span per line, moving it
+    to <path>.1 once it is larger than max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = []
+        for span in spans:
+            lines.append(json.dumps({
+                "name": span.name,
+                "trace_id": format(span.context.trace_id, "032x"),
+                "span_id": format(span.context.span_id, "016x"),
+                "parent_id": (format(span.parent.span_id, "016x")
+                              if span.parent else None),
+                "start_ns": span.start_time,
+                "duration_ms": (span.end_time - span.start_time) / 1e6,
+                "status": span.status.status_code.name,
+                "attributes": dict(span.attributes or {}),
+            }, default=str))
+        try:
+            with self._lock:
+                if (os.path.exists(self.path)
+                        and os.path.getsize(self.path) > self.max_bytes):
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def _create_exporter():
+    if TRACE_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACE_EXPORTER == "otlp":
+        # Endpoint etc. come from the standard OTEL_EXPORTER_OTLP_* env vars
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        return OTLPSpanExporter()
+    if TRACE_EXPORTER == "none":
+        return None
+    return JsonlSpanExporter(TRACE_FILE)
+
+
+def _setup():
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "agentic-rag"})
+    )
+    exporter = _create_exporter()
+    if exporter is not None:
+        # Batched so exporting never sits on the request path; the provider
+        # flushes on interpreter exit (e.g. the ingestion subprocess).
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider
+
+
+_provider = _setup()
+tracer = _provider.get_tracer("agentic_rag")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Trace a block as a span, nested under the current one if any."""
+    with tracer.start_as_current_span(
+        name, attributes={k: v for k, v in attributes.items() if v is not None}
+    ) as current:
+        yield current
+
+
+def submit_traced(pool, fn, *args, **kwargs):
+    """pool.submit that keeps the caller's trace context in the worker."""
+    return pool.submit(copy_context().run, fn, *args, **kwargs)
+
+
+def flush():
+    """Export buffered spans now (e.g. before a short-lived script exits)."""
+    _provider.force_flush()
+
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler recording each LLM call and tool call of an
+    agent run as a span.
+
+    LangGraph runs tools on worker threads, so spans are parented
+    explicitly by run id (falling back to the span current when the handler
+    was created) instead of relying on the active context.
+    """
+
+    def __init__(self):
+        self._root = trace.set_span_in_context(trace.get_current_span())
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def _start(self, name, run_id, parent_run_id, attributes):
+        with self._lock:
+            parent = self._spans.get(parent_run_id)
+        context = trace.set_span_in_context(parent) if parent else self._root
+        started = tracer.start_span(name, context=context, attributes=attributes)
+        with self._lock:
+            self._spans[run_id] = started
+
+    def _end(self, run_id, error=None, attributes=None):
+        with self._lock:
+            ended = self._spans.pop(run_id, None)
+        if ended is None:
+            return
+        if attributes:
+            ended.set_attributes(attributes)
+        if error is not None:
+            ended.record_exception(error)
+            ended.set_status(trace.StatusCode.ERROR, str(error))
+        ended.end()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id,
+                            parent_run_id=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or "unknown"
+        self._start("llm.call", run_id, parent_run_id, {
+            "llm.model": str(model),
+            "llm.messages": len(messages[0]) if messages else 0,
+        })
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        attributes = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                ) or {}
+                for key in ("input_tokens", "output_tokens"):
+                    if key in usage:
+                        attributes[f"llm.{key}"] = (
+                            attributes.get(f"llm.{key}", 0) + usage[key]
+                        )
+        self._end(run_id, attributes=attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id,
+                      parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(f"tool.{name}", run_id, parent_run_id,
+                    {"tool.input": str(input_str)[:200]})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
@@ -0,0 +1,241 @@
+"""
+Token and cost accounting for queries and ingestion jobs.
+
+A UsageTracker collects usage from every LLM call (input/output/prompt-cache
+tokens and the number of round-trips) and every embedding call made while it
+is active. AgenticRAG.query and ingest_pdf each run inside track_usage(), so
+their totals come back in the result and are appended to a rolling local
+ledger (JSONL) for finding expensive question patterns and setting budgets.
+
+Configuration (environment):
+    USAGE_LEDGER            ledger path (default: usage_ledger.jsonl in the
+                            repo root; "none" disables it)
+    USAGE_LEDGER_MAX_BYTES  rotate to <path>.1 beyond this size (default 5MB)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import json
+import math
+import os
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from context_packer import count_tokens
+from llm_cache import CACHE_HIT_KEY
+
+USAGE_LEDGER = os.getenv(
+    "USAGE_LEDGER",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "usage_ledger.jsonl"),
+)
+USAGE_LEDGER_MAX_BYTES = int(os.getenv("USAGE_LEDGER_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# List prices in USD per 1M tokens (input, output), matched by model name
+# or a "<name>-" prefix (longest first). Estimates only — unknown models
+# report no cost.
+MODEL_PRICES = {
+    "claude-opus-4-5": (5.00, 25.00),
+    "claude-opus-4-6": (5.00, 25.00),
+    "claude-opus-4": (15.00, 75.00),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-haiku-4": (1.00, 5.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4-1106-preview": (10.00, 30.00),
+    "gpt-4-0125-preview": (10.00, 30.00),
+    "gpt-4-32k": (60.00, 120.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+# Anthropic bills cache reads at 0.1x and cache writes at 1.25x input price
+CACHE_READ_MULTIPLIER = 0.1
+CACHE_WRITE_MULTIPLIER = 1.25
+
+_current: ContextVar = ContextVar("usage_tracker", default=None)
+_ledger_lock = threading.Lock()
+
+
+def _price(model: str):
+    # A prefix only covers its own dated/suffixed names ("gpt-4-0613"), not
+    # other models that happen to start with it ("gpt-4.5", "gpt-4o")
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model == prefix or model.startswith(prefix + "-"):
+            return MODEL_PRICES[prefix]
+    return None
+
+
+class UsageTracker:
+    """Thread-safe usage totals, per model, for one query or ingestion job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models = {}
+
+    def _entry(self, model: str) -> dict:
+        return self.models.setdefault(model, {
+            "calls": 0, "input_tokens": 0, "output_tokens": 0,
+            "cache_read_tokens": 0, "cache_creation_tokens": 0,
+            "embedding_tokens": 0, "response_cache_hits": 0,
+        })
+
+    def add_llm(self, model: str, usage: dict, cached: bool = False):
+        """
+        Record one LLM round-trip from its usage_metadata. Responses replayed
+        from the on-disk response cache (llm_cache.py) are counted as hits
+        only: they cost no round-trip and no tokens.
+        """
+        details = usage.get("input_token_details") or {}
+        with self._lock:
+            entry = self._entry(model)
+            if cached:
+                entry["response_cache_hits"] += 1
+                return
+            entry["calls"] += 1
+            entry["input_tokens"] += usage.get("input_tokens", 0) or 0
+            entry["output_tokens"] += usage.get("output_tokens", 0) or 0
+            entry["cache_read_tokens"] += details.get("cache_read", 0) or 0
+            entry["cache_creation_tokens"] += details.get("cache_creation", 0) or 0
+
+    def add_embedding(self, model: str, tokens: int, calls: int = 1):
+        """Record `calls` embedding requests of `tokens` input tokens."""
+        with self._lock:
+            entry = self._entry(model)
+            entry["calls"] += calls
+            entry["embedding_tokens"] += tokens
+
+    def totals(self) -> dict:
+        """
+        Aggregate usage: llm_calls (round-trips), input/output/cache tokens,
+        embedding_calls/tokens, response_cache_hits, estimated cost_usd
+        (None if any model is unpriced) and the per-model breakdown.
+        """
+        with self._lock:
+            models = {m: dict(e) for m, e in self.models.items()}
+        totals = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0,
+                  "cache_read_tokens": 0, "cache_creation_tokens": 0,
+                  "embedding_calls": 0, "embedding_tokens": 0,
+                  "response_cache_hits": 0}
+        cost = 0.0
+        for model, e in models.items():
+            is_embedding = e["embedding_tokens"] > 0
+            totals["embedding_calls" if is_embedding else "llm_calls"] += e["calls"]
+            for key in ("input_tokens", "output_tokens", "cache_read_tokens",
+                        "cache_creation_tokens", "embedding_tokens",
+                        "response_cache_hits"):
+                totals[key] += e[key]
+            price = _price(model)
+            if price is None or cost is None:
+                cost = None
+                continue
+            # usage_metadata input_tokens already include cache reads/writes
+            uncached = (e["input_tokens"] - e["cache_read_tokens"]
+                        - e["cache_creation_tokens"])
+            cost += (
+                (uncached + e["embedding_tokens"]) * price[0]
+                + e["cache_read_tokens"] * price[0] * CACHE_READ_MULTIPLIER
+                + e["cache_creation_tokens"] * price[0] * CACHE_WRITE_MULTIPLIER
+                + e["output_tokens"] * price[1]
+            ) / 1e6
+        totals["cost_usd"] = round(cost, 6) if cost is not None else None
+        totals["by_model"] = models
+        return totals
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Feeds every LLM response's usage_metadata into a tracker."""
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+        # run_id -> requested model, for responses that don't echo it
+        self._models = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._models[run_id] = params.get("model") or params.get("model_name")
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        requested = self._models.pop(run_id, None)
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage is None:
+                    continue
+                metadata = message.response_metadata or {}
+                model = (metadata.get("model_name") or metadata.get("model")
+                         or requested or "unknown")
+                self.tracker.add_llm(model, usage,
+                                     cached=bool(metadata.get(CACHE_HIT_KEY)))
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        self._models.pop(run_id, None)
+
+
+def current_tracker():
+    """The tracker of the enclosing track_usage() block, or None."""
+    return _current.get()
+
+
+def record_embedding(model: str, texts, batch_size=None):
+    """
+    Count embedding calls against the active tracker (if any): one, or
+    one per batch_size texts for embed_documents, which sends its texts
+    in batches (OpenAIEmbeddings.chunk_size per request).
+    """
+    tracker = _current.get()
+    if tracker is not None:
+        calls = math.ceil(len(texts) / batch_size) if batch_size else 1
+        tracker.add_embedding(model, sum(count_tokens(t) for t in texts),
+                              calls=max(calls, 1))
+
+
+def write_ledger(record: dict):
+    """Append a record to the rolling usage ledger."""
+    if USAGE_LEDGER.lower() == "none":
+        return
+    line = json.dumps(record, default=str) + "\n"
+    with _ledger_lock:
+        try:
+            if (os.path.exists(USAGE_LEDGER)
+                    and os.path.getsize(USAGE_LEDGER) > USAGE_LEDGER_MAX_BYTES):
+                os.replace(USAGE_LEDGER, USAGE_LEDGER + ".1")
+            with open(USAGE_LEDGER, "a") as f:
+                f.write(line)
+        except OSError:
+            # Accounting must never break a query or ingestion
+            pass
+
+
+@contextmanager
+def track_usage(kind: str, **labels):
+    """
+    Track usage for one unit of work and write it to the ledger on exit.
+
+    Embedding calls inside the block (including on threads that copy the
+    context) are counted automatically; LLM calls need the tracker's
+    UsageCallbackHandler in their callbacks. Labels (question, model,
+    doc_name, ...) are stored with the ledger record.
+    """
+    tracker = UsageTracker()
+    token = _current.set(tracker)
+    started = time.time()
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+        write_ledger({
+            "kind": kind,
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.time() - started, 3),
+            **labels,
+            **tracker.totals(),
+        })